@@ -27,6 +27,7 @@ from clubs.models import (
     MembershipRequest,
     Note,
     NoteTag,
+    OutboxEmail,
     Profile,
     QuestionAnswer,
     RecurringEvent,
@@ -365,6 +366,12 @@ class QuestionAnswerAdmin(admin.ModelAdmin):
     list_filter = ("approved", "updated_at")
 
 
+class OutboxEmailAdmin(admin.ModelAdmin):
+    search_fields = ("recipients", "subject", "invite__id")
+    list_display = ("template", "subject", "recipients", "status", "attempts", "created_at")
+    list_filter = ("status", "template")
+
+
 class ZoomMeetingVisitAdmin(admin.ModelAdmin):
     search_fields = ("person__username", "event__club__code")
     list_display = ("person", "event", "join_time")
@@ -387,6 +394,7 @@ admin.site.register(MembershipRequest, MembershipRequestAdmin)
 admin.site.register(Major, MajorAdmin)
 admin.site.register(Membership, MembershipAdmin)
 admin.site.register(MembershipInvite, MembershipInviteAdmin)
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
 admin.site.register(Profile, ProfileAdmin)
 admin.site.register(QuestionAnswer, QuestionAnswerAdmin)
 admin.site.register(RecurringEvent)
@@ -0,0 +1,284 @@
+import collections
+import math
+import time
+
+from django.core.cache import cache
+from django.db.models import Count, F
+from django.utils.dateparse import parse_datetime
+
+from clubs.models import Membership, ZoomMeetingVisit
+
+
+# the live statistics for each event are periodically rebuilt from the database,
+# correcting any drift caused by visits that were modified outside of the Zoom webhook
+LIVE_STATS_REBUILD_INTERVAL = 60 * 60
+
+# the counters are kept around longer than the rebuild interval so they can be incremented
+LIVE_STATS_TIMEOUT = 60 * 60 * 24
+
+# the percentiles of the meeting durations that are kept up to date for each event
+LIVE_STATS_PERCENTILES = (25, 50, 75, 90)
+
+
+class DurationHistogram:
+    """
+    A histogram of meeting durations in seconds with logarithmically sized buckets.
+
+    Each bucket stores the number of durations in it and their sum. Percentiles are estimated
+    using the mean duration of the bucket that contains them, which is exact if all durations
+    in that bucket are the same and is otherwise off by at most the bucket growth factor.
+    Histograms can be merged by adding up their buckets.
+    """
+
+    GROWTH = 1.1
+    BUCKETS = 128
+
+    def __init__(self, counts=None, sums=None):
+        self.counts = collections.Counter(counts or {})
+        self.sums = collections.Counter(sums or {})
+
+    @classmethod
+    def get_bucket(cls, seconds):
+        if seconds < 1:
+            return 0
+        return min(cls.BUCKETS - 1, 1 + int(math.log(seconds, cls.GROWTH)))
+
+    def add(self, seconds):
+        bucket = self.get_bucket(seconds)
+        self.counts[bucket] += 1
+        self.sums[bucket] += seconds
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.sums.update(other.sums)
+
+    def percentile(self, percent):
+        """
+        Return the estimated duration at the specified percentile, or zero if the histogram is
+        empty. The median is the middle duration, or the larger of the two middle durations.
+        """
+        total = sum(self.counts.values())
+        if total == 0:
+            return 0
+        rank = min(total - 1, total * percent // 100)
+        for bucket in sorted(self.counts):
+            rank -= self.counts[bucket]
+            if rank < 0:
+                return self.sums[bucket] / self.counts[bucket]
+
+    def get_percentiles(self):
+        return {percent: self.percentile(percent) for percent in LIVE_STATS_PERCENTILES}
+
+
+def get_visit_duration(join_time, leave_time):
+    """
+    Return the number of whole seconds between the specified times, which may be strings
+    if they were set directly from a Zoom webhook payload.
+    """
+    if isinstance(join_time, str):
+        join_time = parse_datetime(join_time)
+    if isinstance(leave_time, str):
+        leave_time = parse_datetime(leave_time)
+    return max(0, round((leave_time - join_time).total_seconds()))
+
+
+def get_live_stats_key(event_id, name):
+    return f"live:event:{event_id}:{name}"
+
+
+def get_duration_keys(event_id, generation, bucket):
+    """
+    Return the cache keys for the count and the sum of a duration histogram bucket.
+    Each rebuild of the statistics uses a new generation so that stale buckets are ignored.
+    """
+    prefix = get_live_stats_key(event_id, f"durations:{generation}:{bucket}")
+    return f"{prefix}:count", f"{prefix}:sum"
+
+
+def get_attendee_key(person_id, participant_id):
+    """
+    Return a key that identifies a meeting attendee, using the participant id from Zoom if the
+    attendee could not be matched to a user.
+
+    Each participant that could not be matched counts as a separate attendee. The statistics
+    used to count all of these participants as a single attendee, or not count them at all.
+    """
+    return str(person_id) if person_id is not None else f"zoom-{participant_id}"
+
+
+def build_live_stats(event_ids):
+    """
+    Compute the live statistics for the specified events from the database and cache them.
+    Returns a dictionary mapping event ids to statistics.
+    """
+    event_ids = list(event_ids)
+    stats = {event_id: {"attending": 0, "attended": 0, "officers": []} for event_id in event_ids}
+
+    visits = ZoomMeetingVisit.objects.filter(event__id__in=event_ids)
+    for event_id, count in (
+        visits.filter(leave_time__isnull=True)
+        .values("event_id")
+        .annotate(count=Count("id"))
+        .values_list("event_id", "count")
+        .order_by()
+    ):
+        stats[event_id]["attending"] = count
+
+    attendees = collections.defaultdict(set)
+    histograms = collections.defaultdict(DurationHistogram)
+    for event_id, person_id, participant_id, join_time, leave_time in visits.filter(
+        leave_time__isnull=False
+    ).values_list("event_id", "person_id", "participant_id", "join_time", "leave_time"):
+        attendees[event_id].add(get_attendee_key(person_id, participant_id))
+        histograms[event_id].add(get_visit_duration(join_time, leave_time))
+    for event_id, keys in attendees.items():
+        stats[event_id]["attended"] = len(keys)
+
+    for event_id, username in (
+        visits.filter(
+            leave_time__isnull=True,
+            person__membership__club=F("event__club"),
+            person__membership__role__lte=Membership.ROLE_OFFICER,
+        )
+        .values_list("event_id", "person__username")
+        .distinct()
+    ):
+        stats[event_id]["officers"].append(username)
+
+    generation = int(time.time() * 1000)
+    values = {}
+    for event_id, event_stats in stats.items():
+        histogram = histograms[event_id]
+        event_stats["percentiles"] = histogram.get_percentiles()
+        for name, value in event_stats.items():
+            values[get_live_stats_key(event_id, name)] = value
+        values[get_live_stats_key(event_id, "generation")] = generation
+        for key in attendees[event_id]:
+            values[get_live_stats_key(event_id, f"attendee:{key}")] = True
+        for bucket, count in histogram.counts.items():
+            count_key, sum_key = get_duration_keys(event_id, generation, bucket)
+            values[count_key] = count
+            values[sum_key] = histogram.sums[bucket]
+        event_stats["median"] = event_stats["percentiles"][50]
+    cache.set_many(values, LIVE_STATS_TIMEOUT)
+    cache.set_many(
+        {get_live_stats_key(event_id, "ready"): True for event_id in event_ids},
+        LIVE_STATS_REBUILD_INTERVAL,
+    )
+
+    return stats
+
+
+def get_live_stats(event_ids):
+    """
+    Return a dictionary mapping each of the specified event ids to its live statistics,
+    which are the number of users currently attending the meeting, the number of users that
+    have already attended the meeting, the usernames of the officers currently attending the
+    meeting, and the median and other percentiles of the number of seconds that users attend
+    the meeting for.
+
+    Attendees are identified using get_attendee_key. Officers are members of the club hosting
+    the event with a role of officer or owner, other members are not counted as officers.
+
+    Statistics are read from the cache and rebuilt from the database if they are missing.
+    """
+    names = ["ready", "attending", "attended", "officers", "percentiles"]
+    keys = [get_live_stats_key(event_id, name) for event_id in event_ids for name in names]
+    cached = cache.get_many(keys)
+
+    stats = {}
+    missing = []
+    for event_id in event_ids:
+        values = [cached.get(get_live_stats_key(event_id, name)) for name in names]
+        if any(value is None for value in values):
+            missing.append(event_id)
+        else:
+            stats[event_id] = dict(zip(names[1:], values[1:]))
+            stats[event_id]["median"] = stats[event_id]["percentiles"][50]
+
+    if missing:
+        stats.update(build_live_stats(missing))
+    return stats
+
+
+def is_officer_visit(visit):
+    return (
+        visit.person_id is not None
+        and Membership.objects.filter(
+            person__id=visit.person_id,
+            club__id=visit.event.club_id,
+            role__lte=Membership.ROLE_OFFICER,
+        ).exists()
+    )
+
+
+def update_live_officers(event_id):
+    officers = list(
+        ZoomMeetingVisit.objects.filter(
+            event__id=event_id,
+            leave_time__isnull=True,
+            person__membership__club=F("event__club"),
+            person__membership__role__lte=Membership.ROLE_OFFICER,
+        )
+        .values_list("person__username", flat=True)
+        .distinct()
+    )
+    cache.set(get_live_stats_key(event_id, "officers"), officers, LIVE_STATS_TIMEOUT)
+
+
+def record_duration(event_id, generation, duration):
+    """
+    Add a meeting duration to the cached histogram for an event and update its percentiles.
+    """
+    bucket = DurationHistogram.get_bucket(duration)
+    count_key, sum_key = get_duration_keys(event_id, generation, bucket)
+    cache.add(count_key, 0, LIVE_STATS_TIMEOUT)
+    cache.add(sum_key, 0, LIVE_STATS_TIMEOUT)
+    cache.incr(count_key)
+    if duration > 0:
+        cache.incr(sum_key, duration)
+
+    keys = [get_duration_keys(event_id, generation, i) for i in range(DurationHistogram.BUCKETS)]
+    cached = cache.get_many([key for pair in keys for key in pair])
+    histogram = DurationHistogram(
+        {i: cached[count_key] for i, (count_key, _) in enumerate(keys) if count_key in cached},
+        {i: cached[sum_key] for i, (_, sum_key) in enumerate(keys) if sum_key in cached},
+    )
+    cache.set(
+        get_live_stats_key(event_id, "percentiles"),
+        histogram.get_percentiles(),
+        LIVE_STATS_TIMEOUT,
+    )
+
+
+def record_visit(visit, joined):
+    """
+    Update the live statistics for the event of the specified visit after a user joins or leaves
+    the meeting, and return the new statistics for the event.
+
+    The visit should already be saved. If the statistics for the event are not cached, they are
+    rebuilt from the database instead, which already includes the visit.
+    """
+    event_id = visit.event_id
+    ready_key = get_live_stats_key(event_id, "ready")
+    generation_key = get_live_stats_key(event_id, "generation")
+    cached = cache.get_many([ready_key, generation_key])
+    if ready_key not in cached or generation_key not in cached:
+        return build_live_stats([event_id])[event_id]
+
+    try:
+        cache.incr(get_live_stats_key(event_id, "attending"), 1 if joined else -1)
+        if not joined:
+            key = get_attendee_key(visit.person_id, visit.participant_id)
+            if cache.add(get_live_stats_key(event_id, f"attendee:{key}"), True, LIVE_STATS_TIMEOUT):
+                cache.incr(get_live_stats_key(event_id, "attended"))
+            duration = get_visit_duration(visit.join_time, visit.leave_time)
+            record_duration(event_id, cached[generation_key], duration)
+    except ValueError:
+        # one of the counters was evicted from the cache
+        return build_live_stats([event_id])[event_id]
+
+    if is_officer_visit(visit):
+        update_live_officers(event_id)
+
+    return get_live_stats([event_id])[event_id]
@@ -119,7 +119,7 @@ class LiveEventConsumer(AsyncWebsocketConsumer):
 
     @log_errors
     async def join_leave(self, event):
-        await self.send(text_data=json.dumps({"update": True}))
+        await self.send(text_data=json.dumps({"update": True, **event.get("stats", {})}))
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
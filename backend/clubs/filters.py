@@ -1,15 +1,17 @@
-import random
-from collections import OrderedDict
-from urllib.parse import quote
+import hashlib
 
+from django.db.models import BigIntegerField, Case, ExpressionWrapper, IntegerField, Value, When
+from django.db.models.functions import Cast
 from rest_framework import filters
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.response import Response
 
 
 DEFAULT_PAGE_SIZE = 15
 DEFAULT_SEED = 1234
 
+# largest prime that fits in a signed 32-bit integer
+RANDOM_MODULUS = 2147483647
+
 
 class OptionalPageNumberPagination(PageNumberPagination):
     """
@@ -30,55 +32,44 @@ class RandomPageNumberPagination(OptionalPageNumberPagination):
     """
     Custom pagination that supports randomly sorting objects with pagination.
     Must be used with the associated ordering filter.
+
+    Random listings are always paginated.
     """
 
     def paginate_queryset(self, queryset, request, view=None):
         if "random" in request.query_params.get("ordering", "").split(","):
-            rng = random.Random(request.GET.get("seed", DEFAULT_SEED))
-            results = list(queryset)
-            rng.shuffle(results)
-
-            self._random_count = getattr(request, "_original_item_count", None)
-            if self._random_count is None:
-                self._random_count = queryset.model.objects.count()
-            else:
-                del request._original_item_count
-
-            page = int(request.GET.get("page", 1))
-            page_size = int(request.GET.get("page_size", DEFAULT_PAGE_SIZE))
-
-            if (page - 1) * page_size >= self._random_count:
-                self._random_next_page = None
-            else:
-                new_params = request.GET.dict()
-                new_params["page"] = str(page + 1)
-                self._random_next_page = "{}?{}".format(
-                    request.build_absolute_uri(request.path),
-                    "&".join(["{}={}".format(k, quote(v)) for k, v in new_params.items()]),
-                )
-            return results
+            return PageNumberPagination.paginate_queryset(self, queryset, request, view)
 
         return super().paginate_queryset(queryset, request, view)
 
-    def get_paginated_response(self, data):
-        if hasattr(self, "_random_next_page"):
-            return Response(
-                OrderedDict(
-                    [
-                        ("count", self._random_count),
-                        ("next", self._random_next_page),
-                        ("results", data),
-                    ]
-                )
-            )
 
-        return super().get_paginated_response(data)
+def get_random_ordering(seed, field="id"):
+    """
+    Return an expression that can be used to sort objects in a pseudorandom order that is
+    determined by the seed and the specified integer field.
+
+    The expression only uses integer arithmetic so that it can be computed by the database.
+    """
+    # multiply two different linear hashes of the field modulo a prime, which keeps every
+    # intermediate value within a 64-bit integer
+    digest = hashlib.sha256(str(seed).encode("utf-8")).digest()
+    a, b, c, d = [int.from_bytes(digest[i:][:4], "big") % RANDOM_MODULUS for i in range(0, 16, 4)]
+    value = Cast(field, BigIntegerField())
+    return ExpressionWrapper(
+        ((value * (a or 1) + b) % RANDOM_MODULUS)
+        * ((value * (c or 1) + d) % RANDOM_MODULUS)
+        % RANDOM_MODULUS,
+        output_field=BigIntegerField(),
+    )
 
 
 class RandomOrderingFilter(filters.OrderingFilter):
     """
     Custom ordering filter that supports random pagination.
     Must be used with the associated pagination class.
+
+    The random order is computed by the database from the seed query parameter,
+    so it is stable across pages.
     """
 
     def filter_queryset(self, request, queryset, view):
@@ -87,19 +78,38 @@ class RandomOrderingFilter(filters.OrderingFilter):
 
         # handle random ordering
         if "random" in ordering:
-            page = int(request.GET.get("page", 1)) - 1
-            page_size = int(request.GET.get("page_size", DEFAULT_PAGE_SIZE))
-            rng = random.Random(request.GET.get("seed", DEFAULT_SEED))
+            seed = request.GET.get("seed", DEFAULT_SEED)
+            return new_queryset.annotate(random_order=get_random_ordering(seed)).order_by(
+                "random_order", "id"
+            )
 
-            all_ids = list(new_queryset.order_by("id").values_list("id", flat=True))
-            rng.shuffle(all_ids)
+        return new_queryset
 
-            start_index = page * page_size
-            end_index = (page + 1) * page_size
-            page_ids = all_ids[start_index:end_index]
 
-            request._original_item_count = new_queryset.count()
+class SearchDocumentFilter(filters.SearchFilter):
+    """
+    Drop-in replacement for the search filter that matches search terms against the
+    precomputed search document of each object, instead of every one of the search fields.
 
-            return new_queryset.filter(id__in=page_ids)
+    The search document is a single lowercase text column, so this becomes one substring
+    predicate per search term that can be served by a trigram index on PostgreSQL.
 
-        return new_queryset
+    Also annotates each result with a search_rank relevance score that can be used for ordering.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = [term.lower() for term in self.get_search_terms(request)]
+        if not terms:
+            return queryset
+
+        relevance = Value(0, output_field=IntegerField())
+        for term in terms:
+            queryset = queryset.filter(search_document__contains=term)
+            relevance += Case(
+                When(name__istartswith=term, then=Value(3)),
+                When(name__icontains=term, then=Value(2)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+
+        return queryset.annotate(search_rank=relevance)
@@ -0,0 +1,289 @@
+import os
+import re
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+import yaml
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template import engines
+
+
+subject_regex = re.compile(r"\s*<!--\s*SUBJECT:\s*(.*?)\s*-->", re.I)
+types_regex = re.compile(r"\s*<!--\s*TYPES:\s*(.*?)\s*-->", re.DOTALL)
+
+
+class MailDispatchError(Exception):
+    pass
+
+
+_local = threading.local()
+
+
+class EmailTemplate:
+    """
+    An email template that has been loaded and compiled ahead of time.
+
+    The SUBJECT and TYPES annotations are extracted from the template source when it is loaded
+    and removed from the compiled template, so that rendering an email only has to render the
+    subject and the body with the context.
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+
+        engine = engines["django"]
+        source = engine.get_template(path).template.source
+
+        # subject should match: <!-- SUBJECT: (subject) --> and may contain template variables
+        self.subject = None
+        match = subject_regex.search(source)
+        if match is not None:
+            self.subject = engine.from_string(match.group(1))
+            source = subject_regex.sub("", source, count=1)
+
+        self.types = None
+        match = types_regex.search(source)
+        if match is not None:
+            self.types = yaml.safe_load(match.group(1).strip())
+            source = types_regex.sub("", source, count=1)
+
+        self.template = engine.from_string(source)
+
+    def render(self, context):
+        """
+        Render the email with the specified context.
+        Returns the subject from the template, or None if it does not have one, and the HTML body.
+        """
+        subject = self.subject.render(context).strip() if self.subject is not None else None
+        return subject, self.template.render(context)
+
+
+_email_templates = {}
+
+
+def get_email_template_prefix():
+    return {"fyh": "fyh_emails"}.get(settings.BRANDING, "emails")
+
+
+def get_email_template_names():
+    """
+    Return the names of all email templates for the current branding.
+    """
+    path = os.path.join(settings.BASE_DIR, "templates", get_email_template_prefix())
+    return sorted(file.rsplit(".", 1)[0] for file in os.listdir(path) if file.endswith(".html"))
+
+
+def get_email_template(name):
+    """
+    Return the compiled email template with the specified name for the current branding.
+    Each template is only loaded and compiled once per process, unless debugging is enabled
+    so that changes to the templates show up without restarting the server.
+    """
+    path = f"{get_email_template_prefix()}/{name}.html"
+    if settings.DEBUG:
+        return EmailTemplate(name, path)
+
+    template = _email_templates.get(path)
+    if template is None:
+        template = EmailTemplate(name, path)
+        _email_templates[path] = template
+    return template
+
+
+@receiver(setting_changed)
+def clear_email_templates(*args, setting, **kwargs):
+    if setting in {"TEMPLATES", "BASE_DIR"}:
+        _email_templates.clear()
+
+
+def is_transient_mail_error(e):
+    """
+    Return true if sending an email failed because of an error that may go away if retried,
+    such as a dropped connection or a temporary rejection by the mail server.
+    """
+    if isinstance(e, smtplib.SMTPResponseException):
+        return 400 <= e.smtp_code < 500
+    if isinstance(e, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(e, smtplib.SMTPException):
+        return False
+    return isinstance(e, OSError)
+
+
+class MailDispatcher:
+    """
+    Sends email messages in batches over a single connection to the email backend.
+
+    Messages are queued with add and sent when the batch is full or when the dispatcher is
+    flushed. If sending a message fails with a transient error, the connection is reopened and
+    the message is retried with exponential backoff. The number of messages sent per second can
+    be limited to stay under the sending limits of the mail server.
+    """
+
+    def __init__(
+        self, batch_size=None, rate_limit=None, retries=2, backoff=1, connection=None, stdout=None
+    ):
+        self.batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+        self.rate_limit = rate_limit or settings.EMAIL_RATE_LIMIT
+        self.retries = retries
+        self.backoff = backoff
+        self.connection = connection
+        self.stdout = stdout
+
+        self.queue = []
+        self.next_send = 0
+        self.sent = 0
+        self.failed = []
+        self.batches = []
+
+    def add(self, message):
+        self.queue.append(message)
+        if len(self.queue) >= self.batch_size:
+            self.flush()
+
+    def wait(self):
+        """
+        Sleep until the next message can be sent without going over the rate limit.
+        """
+        if not self.rate_limit:
+            return
+        now = time.monotonic()
+        if now < self.next_send:
+            time.sleep(self.next_send - now)
+            now = self.next_send
+        self.next_send = now + 1 / self.rate_limit
+
+    def send_message(self, connection, message):
+        """
+        Send a single message over the specified connection, reconnecting and retrying after
+        transient errors. Returns the error if the message could not be sent, or None.
+        """
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+            try:
+                connection.open()
+                connection.send_messages([message])
+                return None
+            except Exception as e:
+                if not is_transient_mail_error(e) or attempt >= self.retries:
+                    return e
+
+                # the connection may be in a broken state, start over with a new one
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+    def flush(self):
+        """
+        Send all queued messages over a single connection and record the throughput of the batch.
+        """
+        batch, self.queue = self.queue, []
+        if not batch:
+            return
+
+        start = time.perf_counter()
+        connection = self.connection or get_connection()
+        sent = 0
+        try:
+            for message in batch:
+                self.wait()
+                error = self.send_message(connection, message)
+                if error is None:
+                    sent += 1
+                else:
+                    self.failed.append((message, error))
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        elapsed = time.perf_counter() - start
+
+        self.sent += sent
+        stats = {
+            "messages": len(batch),
+            "sent": sent,
+            "failed": len(batch) - sent,
+            "elapsed": elapsed,
+            "rate": sent / elapsed if elapsed > 0 else None,
+        }
+        self.batches.append(stats)
+        if self.stdout is not None:
+            rate = f"{stats['rate']:.1f}" if stats["rate"] is not None else "-"
+            self.stdout.write(
+                f"Sent batch of {sent}/{len(batch)} emails in {elapsed:.2f}s ({rate} emails/s)."
+            )
+
+    def raise_for_failures(self):
+        if self.failed:
+            message, error = self.failed[-1]
+            raise MailDispatchError(
+                f"Failed to send {len(self.failed)} email(s), the last error was for "
+                f"{', '.join(message.to)}: {type(error).__name__}: {error}"
+            ) from error
+
+
+@contextmanager
+def batch_mail(**kwargs):
+    """
+    Within this context, emails sent through send_mail_helper in the current thread are queued
+    and sent in batches over a shared connection, instead of opening a connection for each email.
+    Keyword arguments are passed to the MailDispatcher.
+
+    Queued emails are sent when the context exits, even if an exception was raised. A
+    MailDispatchError is raised afterwards if any emails could not be sent. Nested contexts
+    share the dispatcher of the outermost context.
+    """
+    dispatcher = getattr(_local, "dispatcher", None)
+    if dispatcher is not None:
+        yield dispatcher
+        return
+
+    dispatcher = MailDispatcher(**kwargs)
+    _local.dispatcher = dispatcher
+    try:
+        yield dispatcher
+    finally:
+        _local.dispatcher = None
+        dispatcher.flush()
+    dispatcher.raise_for_failures()
+
+
+@contextmanager
+def outbox_mail():
+    """
+    Within this context, emails sent through send_mail_helper in the current thread are saved to
+    the outbox in the current database transaction instead of being sent, and are delivered later
+    by "./manage.py send_outbox". Use this in request handlers that send emails, so that the
+    request does not wait for the mail server.
+    """
+    previous = getattr(_local, "outbox", False)
+    _local.outbox = True
+    try:
+        yield
+    finally:
+        _local.outbox = previous
+
+
+def use_outbox():
+    return getattr(_local, "outbox", False)
+
+
+def dispatch_mail(message):
+    """
+    Send an email message, or queue it if there is an active batch_mail context.
+    """
+    dispatcher = getattr(_local, "dispatcher", None)
+    if dispatcher is not None:
+        dispatcher.add(message)
+    else:
+        message.send(fail_silently=False)
@@ -8,6 +8,7 @@ from django.core.management.base import BaseCommand
 from django.db.models import Q
 from django.utils import timezone
 
+from clubs.mail import batch_mail
 from clubs.models import Club, ClubApplication, Membership, send_mail_helper
 
 
@@ -64,14 +65,15 @@ class Command(BaseCommand):
                 )
 
         # send out one email per user
-        for email, data in emails.items():
-            context = {"clubs": data}
-            send_mail_helper(
-                "application_deadline_reminder",
-                f"{len(data)} club(s) have application deadlines approaching",
-                [email],
-                context,
-            )
+        with batch_mail(stdout=self.stdout):
+            for email, data in emails.items():
+                context = {"clubs": data}
+                send_mail_helper(
+                    "application_deadline_reminder",
+                    f"{len(data)} club(s) have application deadlines approaching",
+                    [email],
+                    context,
+                )
 
         self.stdout.write(
             self.style.SUCCESS(f"Sent application deadline reminder to {len(emails)} user(s)")
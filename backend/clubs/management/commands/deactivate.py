@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 
+from clubs.mail import batch_mail
 from clubs.models import Club
 
 
@@ -77,21 +78,24 @@ class Command(BaseCommand):
 
         # send out renewal emails to all clubs
         if send_emails:
-            for club in clubs:
-                club.send_renewal_email()
+            with batch_mail(stdout=self.stdout):
+                for club in clubs:
+                    club.send_renewal_email()
 
             self.stdout.write(f"All {clubs.count()} emails sent out!")
 
         # send out reminder emails to all clubs
         if send_remind_emails:
             pending_clubs = clubs.filter(active=False)
-            for club in pending_clubs:
-                club.send_renewal_reminder_email()
+            with batch_mail(stdout=self.stdout):
+                for club in pending_clubs:
+                    club.send_renewal_reminder_email()
 
             self.stdout.write(f"All {pending_clubs.count()} reminder emails sent out!")
 
             rejected_clubs = clubs.filter(approved=False)
-            for club in rejected_clubs:
-                club.send_approval_email()
+            with batch_mail(stdout=self.stdout):
+                for club in rejected_clubs:
+                    club.send_approval_email()
 
             self.stdout.write(f"All {rejected_clubs.count()} rejection emails sent out!")
@@ -10,7 +10,7 @@ from django.db import transaction
 from django.template.defaultfilters import slugify
 
 from clubs.models import Club, Tag
-from clubs.utils import clean, fuzzy_lookup_club
+from clubs.utils import ClubNameMatcher, clean
 
 
 class Command(BaseCommand):
@@ -50,6 +50,7 @@ class Command(BaseCommand):
             + " Chrome/40.0.2214.85 Safari/537.36"
         )
         self.session.headers = {"User-Agent": self.agent}
+        self.matcher = ClubNameMatcher()
         if self.dry_run:
             self.stdout.write("Not actually importing anything!")
         if self.skip_tags:
@@ -109,7 +110,7 @@ class Command(BaseCommand):
 
             # create or update club
             code = slugify(slug_name)
-            club = fuzzy_lookup_club(name)
+            club = self.matcher.lookup(name)
             if club is not None:
                 code = club.code
                 flag = False
@@ -162,6 +163,8 @@ class Command(BaseCommand):
                     club.save()
                     if tag is not None and not club.tags.count():
                         club.tags.set([tag])
+                if flag:
+                    self.matcher.add(club)
 
             self.club_count += 1
             action_verb = "Created" if flag else "Updated"
@@ -2,7 +2,7 @@ import requests
 from bs4 import BeautifulSoup
 from django.core.management.base import BaseCommand
 
-from clubs.utils import clean, fuzzy_lookup_club
+from clubs.utils import ClubNameMatcher, clean
 
 
 class Command(BaseCommand):
@@ -27,6 +27,7 @@ class Command(BaseCommand):
             + " Chrome/40.0.2214.85 Safari/537.36"
         )
         self.session.headers = {"User-Agent": self.agent}
+        self.matcher = ClubNameMatcher()
         if self.dry_run:
             self.stdout.write("Not actually importing anything!")
         self.fix_clubs()
@@ -71,7 +72,7 @@ class Command(BaseCommand):
         grps, next_tag = soup.select(".grpl .grpl-grp"), soup.find(text="Next >")
         for grp in grps:
             name = grp.select_one("h3 a").text.strip()
-            club = fuzzy_lookup_club(name)
+            club = self.matcher.lookup(name)
 
             # If the club exists in the db and the description has been shortened, add it to list
             if club is not None and club.description.endswith("…"):
@@ -1,23 +1,243 @@
+import collections
+import hashlib
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
 
+import requests
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
-from clubs.models import Club
+from clubs.models import ICS_FETCH_TIMEOUT, Club
+
+
+class CalendarFetchError(Exception):
+    pass
+
+
+# the text is None if the calendar has not been modified since the last fetch
+CalendarFetchResult = collections.namedtuple(
+    "CalendarFetchResult", ["text", "etag", "last_modified", "attempts"]
+)
+
+
+class CalendarFetcher:
+    """
+    Fetches calendars over HTTP with a timeout, retries with exponential backoff for transient
+    errors, and a limit on the number of concurrent requests made to each host.
+
+    Instances are safe to share between threads and do not access the database.
+    """
+
+    def __init__(self, timeout=ICS_FETCH_TIMEOUT, retries=2, backoff=1, per_host=2):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.per_host = per_host
+        self.hosts = collections.defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        self.lock = threading.Lock()
+
+    def get_host_semaphore(self, url):
+        with self.lock:
+            return self.hosts[urlparse(url).netloc.lower()]
+
+    def fetch(self, url, etag=None, last_modified=None):
+        """
+        Return the body and cache validators of the calendar at the specified URL.
+        Raises a CalendarFetchError if the calendar could not be fetched.
+
+        If the validators from the last fetch are passed in, a conditional request is made and
+        the server can indicate that the calendar has not been modified.
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        semaphore = self.get_host_semaphore(url)
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+            try:
+                with semaphore:
+                    resp = requests.get(url, timeout=self.timeout, headers=headers)
+            except requests.exceptions.RequestException as e:
+                error = f"{type(e).__name__}: {e}"
+                continue
+
+            # only retry server errors and rate limiting, other errors will not go away
+            if resp.status_code >= 500 or resp.status_code == 429:
+                error = f"Server returned status code {resp.status_code}"
+                continue
+            if resp.status_code >= 400:
+                raise CalendarFetchError(f"Server returned status code {resp.status_code}")
+
+            # servers are allowed to omit unchanged validators from not modified responses
+            if resp.status_code == 304:
+                return CalendarFetchResult(
+                    None,
+                    resp.headers.get("ETag", etag),
+                    resp.headers.get("Last-Modified", last_modified),
+                    attempt + 1,
+                )
+
+            return CalendarFetchResult(
+                resp.text,
+                resp.headers.get("ETag", ""),
+                resp.headers.get("Last-Modified", ""),
+                attempt + 1,
+            )
+
+        raise CalendarFetchError(f"{error} (after {self.retries + 1} attempts)")
+
+
+def import_calendars(clubs, fetcher=None, workers=8, stdout=None):
+    """
+    Import the ICS calendars for the specified clubs and return a summary for each club.
+
+    Calendars are downloaded concurrently in a thread pool.
+    Parsing and saving the events happens in the calling thread as each download finishes,
+    with each club imported in its own transaction.
+
+    Calendars that the server reports as not modified, or that have the same contents as the
+    last import, are skipped without parsing them.
+    """
+    if fetcher is None:
+        fetcher = CalendarFetcher()
+
+    def fetch(club):
+        start = time.perf_counter()
+        try:
+            result = fetcher.fetch(
+                club.ics_import_url, club.ics_import_etag, club.ics_import_last_modified
+            )
+            error = None
+        except CalendarFetchError as e:
+            result, error = None, str(e)
+        return result, error, time.perf_counter() - start
+
+    summary = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch, club): club for club in clubs}
+        for future in as_completed(futures):
+            club = futures[future]
+            result, error, elapsed = future.result()
+            start = time.perf_counter()
+            row = {
+                "club": club.code,
+                "fetched": result is not None,
+                "status": "failed",
+                "attempts": result.attempts if result is not None else None,
+                "events": 0,
+                "error": error,
+            }
+
+            if result is not None:
+                metadata = {
+                    "ics_import_etag": result.etag[:255],
+                    "ics_import_last_modified": result.last_modified[:255],
+                }
+                if result.text is not None:
+                    metadata["ics_import_hash"] = hashlib.sha256(
+                        result.text.encode("utf-8")
+                    ).hexdigest()
+
+                try:
+                    with transaction.atomic():
+                        if result.text is None or (
+                            metadata["ics_import_hash"] == club.ics_import_hash
+                        ):
+                            row["status"] = "unchanged"
+                        else:
+                            row["events"] = club.add_ics_events(result.text)
+                            row["status"] = "updated"
+
+                        # update directly to avoid triggering the club change signals
+                        Club.objects.filter(pk=club.pk).update(**metadata)
+                except Exception as e:
+                    row["status"] = "failed"
+                    row["error"] = f"{type(e).__name__}: {e}"
+                    if stdout is not None:
+                        stdout.write(traceback.format_exc())
+
+            row["elapsed_ms"] = round((elapsed + time.perf_counter() - start) * 1000)
+            summary.append(row)
+
+    summary.sort(key=lambda row: row["club"])
+    return summary
 
 
 class Command(BaseCommand):
     help = "Imports ICS Calendar events for each club at a set frequency."
     web_execute = True
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            dest="workers",
+            type=int,
+            default=8,
+            help="The maximum number of calendars to download at the same time.",
+        )
+        parser.add_argument(
+            "--per-host",
+            dest="per_host",
+            type=int,
+            default=2,
+            help="The maximum number of calendars to download from the same host at the same time.",
+        )
+        parser.add_argument(
+            "--timeout",
+            dest="timeout",
+            type=float,
+            default=ICS_FETCH_TIMEOUT,
+            help="The number of seconds to wait for a calendar server to respond.",
+        )
+        parser.add_argument(
+            "--retries",
+            dest="retries",
+            type=int,
+            default=2,
+            help="The number of times to retry downloading a calendar after a transient error.",
+        )
+
     def handle(self, *args, **kwargs):
-        count = 0
-        for club in Club.objects.filter(ics_import_url__isnull=False).exclude(ics_import_url=""):
-            try:
-                club.add_ics_events()
-                count += 1
-            except Exception as e:
+        clubs = Club.objects.filter(ics_import_url__isnull=False).exclude(ics_import_url="")
+        fetcher = CalendarFetcher(
+            timeout=kwargs["timeout"], retries=kwargs["retries"], per_host=kwargs["per_host"]
+        )
+        summary = import_calendars(
+            clubs, fetcher=fetcher, workers=kwargs["workers"], stdout=self.stdout
+        )
+
+        for row in summary:
+            if row["status"] == "failed":
                 self.stdout.write(
-                    self.style.ERROR(f"Could not import ICS events for {club.code}: {e}")
+                    self.style.ERROR(
+                        f"Could not import ICS events for {row['club']}: {row['error']}"
+                    )
                 )
-                self.stdout.write(self.style.ERROR(traceback.format_exc()))
-        self.stdout.write(self.style.SUCCESS(f"Imported {count} ICS calendars!"))
+            elif row["status"] == "unchanged":
+                self.stdout.write(
+                    f"Skipped unchanged ICS calendar for {row['club']} "
+                    f"in {row['elapsed_ms']} ms."
+                )
+            else:
+                self.stdout.write(
+                    f"Imported {row['events']} ICS events for {row['club']} "
+                    f"in {row['elapsed_ms']} ms."
+                )
+
+        counts = collections.Counter(row["status"] for row in summary)
+        fetched = sum(row["fetched"] for row in summary)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {counts['updated']} ICS calendars! "
+                f"({fetched} fetched, {counts['unchanged']} unchanged, "
+                f"{counts['updated']} updated, {counts['failed']} failed)"
+            )
+        )
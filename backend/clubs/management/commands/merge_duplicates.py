@@ -11,6 +11,7 @@ from clubs.models import (
     Subscribe,
     Tag,
     Testimonial,
+    update_club_counts,
 )
 
 
@@ -191,4 +192,7 @@ def merge_clubs(one, two):
     secondary.delete()
     primary.save()
 
+    # memberships were moved with a bulk update, recompute cached counts
+    update_club_counts([primary.pk])
+
     return primary
@@ -1,12 +1,49 @@
+import collections
 import datetime
 import random
+import time
 from math import floor
 
 import bleach
 from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
 from django.utils import timezone
 
-from clubs.models import Club, ClubFair, Membership
+from clubs.models import (
+    Club,
+    ClubApplication,
+    ClubFairRegistration,
+    Event,
+    Favorite,
+    Membership,
+    Testimonial,
+)
+from clubs.utils import bump_cache_version
+
+
+SOCIAL_FIELDS = [
+    "facebook",
+    "website",
+    "twitter",
+    "instagram",
+    "linkedin",
+    "github",
+    "youtube",
+]
+
+# club fields that are used when computing the rank
+RANK_FIELDS = [
+    "active",
+    "image",
+    "subtitle",
+    "description",
+    "email",
+    "email_public",
+    "how_to_get_involved",
+    "updated_at",
+    *SOCIAL_FIELDS,
+]
 
 
 class Command(BaseCommand):
@@ -17,9 +54,25 @@ class Command(BaseCommand):
     )
     web_execute = True
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dirty",
+            dest="dirty",
+            action="store_true",
+            help="Only recompute the rankings of clubs that have changed since they were last "
+            "ranked. This is cheap enough to be run every few minutes.",
+        )
+
     def handle(self, *args, **kwargs):
-        self.set_recruiting_statuses()
-        self.rank()
+        if kwargs["dirty"]:
+            # clear the flags before ranking so that changes made while ranking are not lost
+            club_ids = list(Club.objects.filter(rank_dirty=True).values_list("id", flat=True))
+            Club.objects.filter(id__in=club_ids).update(rank_dirty=False)
+            self.rank(club_ids)
+        else:
+            self.set_recruiting_statuses()
+            Club.objects.filter(rank_dirty=True).update(rank_dirty=False)
+            self.rank()
 
     def set_recruiting_statuses(self):
         """
@@ -49,158 +102,232 @@ class Command(BaseCommand):
             )
         )
 
-    def rank(self):
-        count = 0
-        for club in Club.objects.all():
-            ranking = 0
-
-            # inactive clubs get deprioritized
-            if not club.active:
-                ranking -= 1000
-
-            # small points for favorites
-            ranking += club.favorite_set.count() / 25
-
-            # points for minimum amount of tags
-            tags = club.tags.count()
-            if tags >= 3 and tags <= 7:
-                ranking += 15
-            elif tags > 7:
-                ranking += 7
-
-            # lots of points for officers
-            officers = club.membership_set.filter(
-                active=True, role__lte=Membership.ROLE_OFFICER
-            ).count()
-            if officers >= 3:
-                ranking += 15
-
-            # ordinary members give even more points
-            members = club.membership_set.filter(
-                active=True, role__gte=Membership.ROLE_MEMBER
-            ).count()
-            if members >= 3:
-                ranking += 10
-            ranking += members / 10
+    def rank(self, club_ids=None):
+        """
+        Compute the rank for every club on the site, or only the specified clubs if club ids are
+        passed in.
 
-            # points for logo
-            if club.image is not None:
-                ranking += 15
+        All of the scoring inputs are fetched with a fixed number of aggregate queries and the
+        results are written back with a single bulk update, so the number of queries does not
+        grow with the number of clubs.
+        """
+        timings = []
+        queries = []
+        now = timezone.now()
 
-            # points for subtitle
-            subtitle = club.subtitle.strip()
-            if subtitle.lower() == "your subtitle here":
-                ranking -= 10
-            elif len(subtitle) > 3:
-                ranking += 5
+        def count_queries(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_queries):
+            start = time.monotonic()
+            clubs = Club.objects.only(*RANK_FIELDS).order_by("id")
+            if club_ids is not None:
+                clubs = clubs.filter(id__in=club_ids)
+            clubs = list(clubs)
+            timings.append(("load clubs", time.monotonic() - start))
+
+            start = time.monotonic()
+            stats = self.get_ranking_stats(now, club_ids)
+            timings.append(("aggregate", time.monotonic() - start))
+
+            start = time.monotonic()
+            for club in clubs:
+                club.rank = self.score_club(club, stats, now)
+            timings.append(("score", time.monotonic() - start))
+
+            start = time.monotonic()
+            Club.objects.bulk_update(clubs, ["rank"], batch_size=1000)
+            bump_cache_version("club")
+            timings.append(("update", time.monotonic() - start))
+
+        for phase, elapsed in timings:
+            self.stdout.write(f"{phase}: {elapsed:.3f}s")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Computed rankings for {len(clubs)} clubs using {len(queries)} queries!"
+            )
+        )
 
-            # images in description? awesome
-            if "<img" in club.description or "<iframe" in club.description:
-                ranking += 3
+    def get_ranking_stats(self, now, club_ids=None):
+        """
+        Fetch the related object information used for scoring, keyed by club id.
+        """
 
-            # points for longer descriptions
-            cleaned_description = bleach.clean(
-                club.description, tags=[], attributes={}, styles=[], strip=True
-            ).strip()
+        def for_clubs(queryset):
+            if club_ids is not None:
+                queryset = queryset.filter(club__in=club_ids)
+            return queryset
 
-            if len(cleaned_description) > 25:
-                ranking += 25
+        def grouped_count(queryset):
+            return dict(
+                for_clubs(queryset).values_list("club").annotate(count=Count("id")).order_by()
+            )
 
-            if len(cleaned_description) > 250:
-                ranking += 10
+        stats = {
+            "favorites": grouped_count(Favorite.objects.all()),
+            "tags": grouped_count(Club.tags.through.objects.all()),
+            "officers": grouped_count(
+                Membership.objects.filter(active=True, role__lte=Membership.ROLE_OFFICER)
+            ),
+            "members": grouped_count(
+                Membership.objects.filter(active=True, role__gte=Membership.ROLE_MEMBER)
+            ),
+            "testimonials": grouped_count(Testimonial.objects.all()),
+            "fairs": set(
+                for_clubs(ClubFairRegistration.objects.filter(fair__end_time__gte=now)).values_list(
+                    "club", flat=True
+                )
+            ),
+            "applications": set(
+                for_clubs(
+                    ClubApplication.objects.filter(
+                        application_start_time__lte=now, application_end_time__gte=now
+                    )
+                ).values_list("club", flat=True)
+            ),
+            "today_events": collections.defaultdict(list),
+            "close_events": collections.defaultdict(list),
+        }
+
+        # the one day window is a subset of the one week window, fetch both at once
+        events = for_clubs(
+            Event.objects.filter(
+                club__isnull=False,
+                end_time__gte=now,
+                start_time__lte=now + datetime.timedelta(weeks=1),
+            )
+        ).only("club", "start_time", "end_time", "description", "image")
+        for event in events:
+            stats["close_events"][event.club_id].append(event)
+            if event.start_time <= now + datetime.timedelta(days=1):
+                stats["today_events"][event.club_id].append(event)
 
-            if len(cleaned_description) > 1000:
-                ranking += 10
+        return stats
 
-            # points for fair
-            now = timezone.now()
-            if ClubFair.objects.filter(end_time__gte=now, participating_clubs=club).exists():
+    def score_club(self, club, stats, now):
+        """
+        Compute the rank of a single club using the precomputed statistics.
+        """
+        ranking = 0
+
+        # inactive clubs get deprioritized
+        if not club.active:
+            ranking -= 1000
+
+        # small points for favorites
+        ranking += stats["favorites"].get(club.id, 0) / 25
+
+        # points for minimum amount of tags
+        tags = stats["tags"].get(club.id, 0)
+        if tags >= 3 and tags <= 7:
+            ranking += 15
+        elif tags > 7:
+            ranking += 7
+
+        # lots of points for officers
+        officers = stats["officers"].get(club.id, 0)
+        if officers >= 3:
+            ranking += 15
+
+        # ordinary members give even more points
+        members = stats["members"].get(club.id, 0)
+        if members >= 3:
+            ranking += 10
+        ranking += members / 10
+
+        # points for logo
+        if club.image is not None:
+            ranking += 15
+
+        # points for subtitle
+        subtitle = club.subtitle.strip()
+        if subtitle.lower() == "your subtitle here":
+            ranking -= 10
+        elif len(subtitle) > 3:
+            ranking += 5
+
+        # images in description? awesome
+        if "<img" in club.description or "<iframe" in club.description:
+            ranking += 3
+
+        # points for longer descriptions
+        cleaned_description = bleach.clean(
+            club.description, tags=[], attributes={}, styles=[], strip=True
+        ).strip()
+
+        if len(cleaned_description) > 25:
+            ranking += 25
+
+        if len(cleaned_description) > 250:
+            ranking += 10
+
+        if len(cleaned_description) > 1000:
+            ranking += 10
+
+        # points for fair
+        if club.id in stats["fairs"]:
+            ranking += 10
+
+        # points for club applications
+        if club.id in stats["applications"]:
+            ranking += 25
+
+        # points for events
+        today_events = stats["today_events"].get(club.id)
+
+        if today_events:
+            short_events = [(e.end_time - e.start_time).seconds / 3600 < 16 for e in today_events]
+            if any(short_events):
                 ranking += 10
-
-            # points for club applications
-            if club.clubapplication_set.filter(
-                application_start_time__lte=now, application_end_time__gte=now
-            ).exists():
-                ranking += 25
-
-            # points for events
-            today_events = club.events.filter(
-                end_time__gte=now, start_time__lte=now + datetime.timedelta(days=1)
-            )
-
-            if today_events.exists():
-                short_events = [
-                    (e.end_time - e.start_time).seconds / 3600 < 16 for e in today_events
-                ]
-                if any(short_events):
+                if all(
+                    len(e.description) >= 3
+                    and e.description not in {"Replace this description!"}
+                    and e.image is not None
+                    for e in today_events
+                ):
                     ranking += 10
-                    if all(
-                        len(e.description) >= 3
-                        and e.description not in {"Replace this description!"}
-                        and e.image is not None
-                        for e in today_events
-                    ):
-                        ranking += 10
-
-            close_events = club.events.filter(
-                end_time__gte=now, start_time__lte=now + datetime.timedelta(weeks=1)
-            )
 
-            if close_events.exists():
-                short_events = [
-                    (e.end_time - e.start_time).seconds / 3600 < 16 for e in close_events
-                ]
-                if any(short_events):
+        close_events = stats["close_events"].get(club.id)
+
+        if close_events:
+            short_events = [(e.end_time - e.start_time).seconds / 3600 < 16 for e in close_events]
+            if any(short_events):
+                ranking += 5
+                if all(
+                    len(e.description) > 3
+                    and e.description not in {"Replace this description!"}
+                    and e.image is not None
+                    for e in close_events
+                ):
                     ranking += 5
-                    if all(
-                        len(e.description) > 3
-                        and e.description not in {"Replace this description!"}
-                        and e.image is not None
-                        for e in close_events
-                    ):
-                        ranking += 5
-
-            # points for public contact email
-            if club.email and club.email_public:
-                ranking += 10
 
-            # points for social links
-            social_fields = [
-                "facebook",
-                "website",
-                "twitter",
-                "instagram",
-                "linkedin",
-                "github",
-                "youtube",
-            ]
-            social_fields = [getattr(club, field) for field in social_fields]
-            has_fields = [field is not None and len(field) >= 3 for field in social_fields]
-            has_fields = [field for field in social_fields if field]
-            if len(has_fields) >= 2:
-                ranking += 10
+        # points for public contact email
+        if club.email and club.email_public:
+            ranking += 10
 
-            # points for how to get involved
-            if len(club.how_to_get_involved.strip()) <= 3:
-                ranking -= 30
+        # points for social links
+        social_fields = [getattr(club, field) for field in SOCIAL_FIELDS]
+        has_fields = [field for field in social_fields if field]
+        if len(has_fields) >= 2:
+            ranking += 10
 
-            # points for updated
-            if club.updated_at < now - datetime.timedelta(days=30 * 8):
-                ranking -= 10
+        # points for how to get involved
+        if len(club.how_to_get_involved.strip()) <= 3:
+            ranking -= 30
 
-            # points for testimonials
-            num_testimonials = club.testimonials.count()
-            if num_testimonials >= 1:
-                ranking += 10
-            if num_testimonials >= 3:
-                ranking += 5
+        # points for updated
+        if club.updated_at < now - datetime.timedelta(days=30 * 8):
+            ranking -= 10
 
-            # rng
-            ranking += random.random() * 10
+        # points for testimonials
+        num_testimonials = stats["testimonials"].get(club.id, 0)
+        if num_testimonials >= 1:
+            ranking += 10
+        if num_testimonials >= 3:
+            ranking += 5
 
-            club.rank = floor(ranking)
-            club.skip_history_when_saving = True
-            club.save(update_fields=["rank"])
-            count += 1
+        # rng
+        ranking += random.random() * 10
 
-        self.stdout.write(self.style.SUCCESS(f"Computed rankings for {count} clubs!"))
+        return floor(ranking)
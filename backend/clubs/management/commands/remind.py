@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from clubs.mail import batch_mail
 from clubs.models import Club, Membership, MembershipInvite, send_mail_helper
 
 
@@ -64,10 +65,13 @@ class Command(BaseCommand):
             "Found {} active club(s) to send out email invites.".format(clubs.count())
         )
 
-        for club in clubs:
-            if send_reminder_to_club(club):
-                self.stdout.write(
-                    self.style.SUCCESS("Sent {} reminder to {}".format(club.name, club.email))
-                )
-            else:
-                self.stdout.write("Skipping {} reminder, no contact email set".format(club.name))
+        with batch_mail(stdout=self.stdout):
+            for club in clubs:
+                if send_reminder_to_club(club):
+                    self.stdout.write(
+                        self.style.SUCCESS("Sent {} reminder to {}".format(club.name, club.email))
+                    )
+                else:
+                    self.stdout.write(
+                        "Skipping {} reminder, no contact email set".format(club.name)
+                    )
@@ -10,8 +10,9 @@ from django.core.management.base import BaseCommand, CommandError
 from django.db.models import Count, Q
 from django.utils import timezone
 
+from clubs.mail import batch_mail
 from clubs.models import Club, ClubFair, Event, Membership, MembershipInvite, send_mail_helper
-from clubs.utils import fuzzy_lookup_club
+from clubs.utils import ClubNameMatcher
 
 
 def send_fair_email(club, email, template="fair"):
@@ -151,6 +152,10 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **kwargs):
+        with batch_mail(stdout=self.stdout):
+            self.send_emails(*args, **kwargs)
+
+    def send_emails(self, *args, **kwargs):
         dry_run = kwargs["dry_run"]
         only_sheet = kwargs["only_sheet"]
         action = kwargs["type"]
@@ -452,6 +457,7 @@ class Command(BaseCommand):
 
         # load email file
         if email_file is not None:
+            matcher = ClubNameMatcher()
             with open(email_file, "r") as f:
                 reader = csv.reader(f)
                 for line in reader:
@@ -459,7 +465,7 @@ class Command(BaseCommand):
                         self.stdout.write(self.style.WARNING("Skipping empty line in CSV file..."))
                         continue
                     raw_name = line[0].strip()
-                    club = fuzzy_lookup_club(raw_name)
+                    club = matcher.lookup(raw_name)
 
                     if club is not None:
                         if verbosity >= 2:
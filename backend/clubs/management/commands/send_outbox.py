@@ -0,0 +1,127 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from clubs.mail import MailDispatcher, is_transient_mail_error
+from clubs.models import OutboxEmail
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends the emails that are waiting in the outbox. "
+        "Emails that fail with a transient error are retried later with exponential backoff. "
+        "Multiple workers can drain the outbox at the same time."
+    )
+    web_execute = True
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            dest="batch_size",
+            type=int,
+            default=settings.EMAIL_BATCH_SIZE,
+            help="The number of emails to send over each connection to the mail server.",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            dest="max_attempts",
+            type=int,
+            default=5,
+            help="The number of times to try sending an email before marking it as failed.",
+        )
+        parser.add_argument(
+            "--loop",
+            dest="loop",
+            action="store_true",
+            help="Keep running and send new emails as they are added to the outbox.",
+        )
+        parser.add_argument(
+            "--interval",
+            dest="interval",
+            type=float,
+            default=5,
+            help="The number of seconds to wait before checking an empty outbox again.",
+        )
+        parser.set_defaults(loop=False)
+
+    def handle(self, *args, **kwargs):
+        total = {"sent": 0, "failed": 0, "retry": 0}
+        while True:
+            # long running workers should not reuse connections that the database has closed
+            close_old_connections()
+            counts = self.send_batch(kwargs["batch_size"], kwargs["max_attempts"])
+            if counts is None:
+                if not kwargs["loop"]:
+                    break
+                time.sleep(kwargs["interval"])
+                continue
+            for key, value in counts.items():
+                total[key] += value
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Sent {total['sent']} emails from the outbox! "
+                f"({total['retry']} to retry, {total['failed']} failed)"
+            )
+        )
+
+    def send_batch(self, batch_size, max_attempts):
+        """
+        Send the next batch of pending emails over one connection and record the results.
+        Returns the number of emails that were sent, failed or will be retried,
+        or None if there are no emails ready to be sent.
+
+        The emails are locked until the batch is finished so that other workers skip them.
+        """
+        with transaction.atomic():
+            emails = list(
+                OutboxEmail.objects.select_for_update(skip_locked=True)
+                .filter(status=OutboxEmail.PENDING, send_after__lte=timezone.now())
+                .order_by("send_after", "id")[:batch_size]
+            )
+            if not emails:
+                return None
+
+            messages = [email.get_message() for email in emails]
+            # failed emails are retried later by the outbox instead of while the rows are locked
+            dispatcher = MailDispatcher(batch_size=len(emails), retries=0, stdout=self.stdout)
+            for message in messages:
+                dispatcher.add(message)
+            dispatcher.flush()
+
+            errors = {id(message): error for message, error in dispatcher.failed}
+            now = timezone.now()
+            counts = {"sent": 0, "failed": 0, "retry": 0}
+            for email, message in zip(emails, messages):
+                email.attempts += 1
+                email.updated_at = now
+                error = errors.get(id(message))
+                if error is None:
+                    email.status = OutboxEmail.SENT
+                    email.sent_at = now
+                    email.error = ""
+                    counts["sent"] += 1
+                    continue
+
+                email.error = f"{type(error).__name__}: {error}"
+                if is_transient_mail_error(error) and email.attempts < max_attempts:
+                    email.send_after = now + datetime.timedelta(minutes=2 ** email.attempts)
+                    counts["retry"] += 1
+                else:
+                    email.status = OutboxEmail.FAILED
+                    counts["failed"] += 1
+                    self.stdout.write(
+                        self.style.ERROR(
+                            f"Could not send {email.template} email to "
+                            f"{', '.join(email.get_recipients())}: {email.error}"
+                        )
+                    )
+
+            OutboxEmail.objects.bulk_update(
+                emails, ["status", "attempts", "error", "send_after", "sent_at", "updated_at"]
+            )
+            return counts
@@ -1,7 +1,8 @@
 from django.core.management.base import BaseCommand
-from django.db.models import Count
+from django.db.models import Count, F, Q
 
-from clubs.models import Badge, Club, ClubFairRegistration
+from clubs.models import Badge, Club, ClubFairRegistration, Event, get_club_count_subqueries
+from clubs.utils import bump_cache_version, get_short_description, get_zoom_meeting_id, html_to_text
 
 
 class Command(BaseCommand):
@@ -9,6 +10,9 @@ class Command(BaseCommand):
         "Executes various operations to ensure that the database is in a consistent state. "
         "Synchronizes badges based on parent and child org relationships. "
         "Removes duplicate club fair registration entries, keeping the latest. "
+        "Repairs cached favorite and membership counts for clubs. "
+        "Computes missing or outdated plain text descriptions for clubs and events. "
+        "Computes missing or outdated Zoom meeting ids for events. "
         "There should be no issues with repeatedly running this script. "
     )
     web_execute = True
@@ -61,6 +65,8 @@ class Command(BaseCommand):
 
         self.sync_badges()
         self.sync_club_fairs()
+        self.sync_club_counts()
+        self.sync_derived_fields()
 
     def sync_club_fairs(self):
         """
@@ -89,6 +95,65 @@ class Command(BaseCommand):
             else:
                 self.stdout.write(f"Would have deleted {len(dups)} duplicate entries!")
 
+    def sync_club_counts(self):
+        """
+        Fix the cached favorite and membership counts for clubs where they have drifted
+        from the actual number of favorites and active memberships.
+        """
+        counts = get_club_count_subqueries()
+        drifted = list(
+            Club.objects.annotate(**{f"actual_{k}": v for k, v in counts.items()})
+            .filter(
+                ~Q(favorite_count=F("actual_favorite_count"))
+                | ~Q(membership_count=F("actual_membership_count"))
+            )
+            .values_list("id", "code", "actual_favorite_count", "actual_membership_count")
+        )
+
+        count = 0
+        for pk, code, favorite_count, membership_count in drifted:
+            if not self.dry_run:
+                Club.objects.filter(pk=pk).update(
+                    favorite_count=favorite_count, membership_count=membership_count
+                )
+                self.stdout.write(f"Fixed counts for club '{code}'.")
+            else:
+                self.stdout.write(f"Would have fixed counts for club '{code}'.")
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Fixed counts for {count} clubs."))
+
+    def sync_derived_fields(self):
+        """
+        Fill in the fields that are normally computed from other fields when the object is saved,
+        such as the plain text versions of club and event descriptions and the Zoom meeting ids
+        of events, for objects created before these fields existed or modified without sending
+        signals.
+        """
+        for model, source, field, func in [
+            (Club, "description", "short_description", get_short_description),
+            (Event, "description", "description_text", html_to_text),
+            (Event, "url", "zoom_meeting_id", get_zoom_meeting_id),
+        ]:
+            changed = []
+            for obj in model.objects.only("id", source, field).iterator():
+                value = func(getattr(obj, source))
+                if value != getattr(obj, field):
+                    setattr(obj, field, value)
+                    changed.append(obj)
+
+            if not self.dry_run:
+                model.objects.bulk_update(changed, [field], batch_size=1000)
+                # cached calendar events are rendered from the plain text event descriptions
+                if field == "description_text" and changed:
+                    bump_cache_version("calendar")
+                self.stdout.write(
+                    self.style.SUCCESS(f"Updated {field} for {len(changed)} {model.__name__} rows.")
+                )
+            else:
+                self.stdout.write(
+                    f"Would have updated {field} for {len(changed)} {model.__name__} rows."
+                )
+
     def sync_badges(self):
         """
         Synchronizes badges based on parent child relationships.
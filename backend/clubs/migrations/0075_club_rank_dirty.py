@@ -0,0 +1,18 @@
+# Generated by Django 3.1.5 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0074_auto_20210120_1208"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="club",
+            name="rank_dirty",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.1.5 on 2026-10-18 20:04
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_club_counts(apps, schema_editor):
+    Club = apps.get_model("clubs", "Club")
+    Favorite = apps.get_model("clubs", "Favorite")
+    Membership = apps.get_model("clubs", "Membership")
+
+    def count(queryset):
+        return Coalesce(
+            Subquery(
+                queryset.filter(club=OuterRef("pk"))
+                .order_by()
+                .values("club")
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            0,
+        )
+
+    Club.objects.update(
+        favorite_count=count(Favorite.objects.all()),
+        membership_count=count(Membership.objects.filter(active=True)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0075_club_rank_dirty"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="club", name="favorite_count", field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="club", name="membership_count", field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_club_counts, migrations.RunPython.noop),
+    ]
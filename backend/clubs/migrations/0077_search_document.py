@@ -0,0 +1,64 @@
+# Generated by Django 3.1.5 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+def get_search_document(*values):
+    return "\n".join(value.lower() for value in values if value)
+
+
+def populate_search_documents(apps, schema_editor):
+    Club = apps.get_model("clubs", "Club")
+    Event = apps.get_model("clubs", "Event")
+
+    clubs = {}
+    for club in Club.objects.only("name", "subtitle", "code", "terms"):
+        club.search_document = get_search_document(club.name, club.subtitle, club.code, club.terms)
+        clubs[club.pk] = club
+    Club.objects.bulk_update(clubs.values(), ["search_document"], batch_size=1000)
+
+    events = list(Event.objects.only("club", "name", "description"))
+    for event in events:
+        club = clubs.get(event.club_id)
+        values = [event.name, event.description]
+        if club is not None:
+            values += [club.name, club.subtitle, club.code]
+        event.search_document = get_search_document(*values)
+    Event.objects.bulk_update(events, ["search_document"], batch_size=1000)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # substring searches can use trigram indexes on postgres
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table in ["clubs_club", "clubs_event"]:
+        schema_editor.execute(
+            f"CREATE INDEX {table}_search_document_trgm ON {table} "
+            "USING gin (search_document gin_trgm_ops)"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table in ["clubs_club", "clubs_event"]:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_document_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0076_club_counts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="club", name="search_document", field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="event", name="search_document", field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(populate_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.5 on 2026-10-18 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0077_search_document"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="club",
+            name="ics_import_etag",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="club",
+            name="ics_import_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="club",
+            name="ics_import_last_modified",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.1.5 on 2026-10-18 20:52
+
+from django.db import migrations, models
+
+from clubs.utils import bump_cache_version, get_short_description, html_to_text
+
+
+def populate_description_text(apps, schema_editor):
+    Club = apps.get_model("clubs", "Club")
+    Event = apps.get_model("clubs", "Event")
+
+    for model, field, func in [
+        (Club, "short_description", get_short_description),
+        (Event, "description_text", html_to_text),
+    ]:
+        objs = list(model.objects.only("description"))
+        for obj in objs:
+            setattr(obj, field, func(obj.description))
+        model.objects.bulk_update(objs, [field], batch_size=1000)
+
+    # cached calendar events may have been rendered without the event descriptions
+    bump_cache_version("calendar")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0078_club_ics_import_metadata"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="club", name="short_description", field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="event", name="description_text", field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(populate_description_text, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.5 on 2026-10-18 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0079_description_text"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="event",
+            index=models.Index(fields=["start_time", "end_time"], name="event_start_end_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="event",
+            index=models.Index(fields=["club", "start_time"], name="event_club_start_idx"),
+        ),
+    ]
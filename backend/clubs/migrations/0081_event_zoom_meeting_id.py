@@ -0,0 +1,24 @@
+# Generated by Django 3.1.5 on 2026-10-18 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0080_event_time_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="event",
+            name="zoom_meeting_id",
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="zoommeetingvisit",
+            index=models.Index(
+                fields=["meeting_id", "participant_id"], name="zoom_visit_participant_idx"
+            ),
+        ),
+    ]
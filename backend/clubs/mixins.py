@@ -1,10 +1,17 @@
+import csv
+import tempfile
 from collections import OrderedDict
 
 import dateutil.parser
 from django.core.exceptions import FieldDoesNotExist, MultipleObjectsReturned, ObjectDoesNotExist
 from django.db.models import BooleanField, DateTimeField, ManyToManyField
 from django.db.models.fields.reverse_related import ManyToOneRel
+from django.http import FileResponse, StreamingHttpResponse
 from django.utils import timezone
+from drf_renderer_xlsx.renderers import get_style_from_dict
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
 from rest_framework import serializers
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
@@ -100,6 +107,16 @@ class ManyToManySaveMixin(object):
         return obj
 
 
+class Echo(object):
+    """
+    A file-like object that returns the value that was written instead of storing it.
+    Used to turn the output of a CSV writer into chunks of a streaming response.
+    """
+
+    def write(self, value):
+        return value
+
+
 class XLSXFormatterMixin(object):
     """
     Mixin for views that formats xlsx output to a more readable format.
@@ -110,8 +127,16 @@ class XLSXFormatterMixin(object):
 
     Changes the default filename to include the date and time of creation.
     Changes the default column header to be bolded.
+
+    Large spreadsheets can be exported by adding the "stream" GET parameter to a list request,
+    set to "true" or "xlsx" for an Excel spreadsheet and "csv" for a CSV file. The queryset is
+    serialized in chunks and each row is written out as soon as it is formatted, instead of
+    building the entire report in memory.
     """
 
+    # the number of objects that are fetched from the database at a time for streaming exports
+    stream_chunk_size = 500
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -256,6 +281,112 @@ class XLSXFormatterMixin(object):
         """
         return "report-{}.xlsx".format(timezone.now().strftime("%Y%m%d-%H%M"))
 
+    def get_stream_format(self):
+        """
+        Return the format of the streaming export that was requested, or None if the response
+        should not be streamed.
+        """
+        if self.request.accepted_renderer.format != "xlsx":
+            return None
+        return {"true": "xlsx", "xlsx": "xlsx", "csv": "csv"}.get(
+            self.request.query_params.get("stream", "").lower()
+        )
+
+    def list(self, request, *args, **kwargs):
+        stream_format = self.get_stream_format()
+        if stream_format is not None:
+            return self.get_streaming_response(stream_format)
+        return super().list(request, *args, **kwargs)
+
+    def iter_objects(self, queryset):
+        """
+        Yield the objects in the queryset in order, fetching them in chunks so that
+        only one chunk is in memory at a time.
+        Prefetches on the queryset are performed once for each chunk.
+        """
+        pks = list(dict.fromkeys(queryset.values_list("pk", flat=True)))
+        for i in range(0, len(pks), self.stream_chunk_size):
+            end = i + self.stream_chunk_size
+            chunk = pks[i:end]
+            objects = {obj.pk: obj for obj in queryset.filter(pk__in=chunk)}
+            for pk in chunk:
+                if pk in objects:
+                    yield objects[pk]
+
+    def iter_spreadsheet_rows(self):
+        """
+        Yield the column headers and then the formatted cell values for each object in the
+        queryset. The columns are determined by the first row, in the same way as the
+        Excel renderer.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer()
+        flatten = self.request.accepted_renderer._flatten
+
+        columns = None
+        for obj in self.iter_objects(queryset):
+            data = serializer.to_representation(obj)
+            first = columns is None
+            if first:
+                columns = [
+                    (key, self.get_xlsx_column_name(key), self._lookup_field_formatter(key))
+                    for key in data.keys()
+                ]
+
+            row = flatten(
+                OrderedDict((name, formatter(data.get(key))) for key, name, formatter in columns)
+            )
+            row.pop("row_color", None)
+            if first:
+                yield list(row.keys())
+            yield list(row.values())
+
+    def get_streaming_response(self, stream_format):
+        """
+        Return a response that writes out the spreadsheet for the queryset row by row.
+        """
+        filename = self.get_filename()
+        rows = self.iter_spreadsheet_rows()
+
+        if stream_format == "csv":
+            writer = csv.writer(Echo())
+            response = StreamingHttpResponse(
+                (writer.writerow(row) for row in rows), content_type="text/csv"
+            )
+            response["Content-Disposition"] = "attachment; filename={}".format(
+                "{}.csv".format(filename.rsplit(".", 1)[0])
+            )
+            return response
+
+        # the spreadsheet is a zip file that can only be finished once all rows are known,
+        # write-only workbooks keep the rows on disk until then
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet("Report")
+        header_style = get_style_from_dict(
+            self.get_column_header().get("style"), "column_header_style"
+        )
+        for i, row in enumerate(rows):
+            if i == 0:
+                for column in range(1, len(row) + 1):
+                    worksheet.column_dimensions[get_column_letter(column)].width = 20
+                cells = []
+                for value in row:
+                    cell = WriteOnlyCell(worksheet, value=value)
+                    cell.style = header_style
+                    cells.append(cell)
+                row = cells
+            worksheet.append(row)
+
+        output = tempfile.TemporaryFile()
+        workbook.save(output)
+        output.seek(0)
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=filename,
+            content_type=self.request.accepted_renderer.media_type,
+        )
+
     def get_column_header(self):
         """
         Return the style of the column header for an Excel export.
@@ -1,21 +1,24 @@
+import collections
 import datetime
 import os
 import re
+import threading
 import uuid
 import warnings
 from urllib.parse import urlparse
 
 import pytz
 import requests
-import yaml
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.mail import EmailMultiAlternatives
 from django.core.validators import validate_email
 from django.db import models, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.dispatch import receiver
-from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 from ics import Calendar
@@ -23,32 +26,41 @@ from phonenumber_field.modelfields import PhoneNumberField
 from simple_history.models import HistoricalRecords
 from urlextract import URLExtract
 
-from clubs.utils import clean, get_django_minified_image, get_domain, html_to_text
+from clubs.mail import dispatch_mail, get_email_template, use_outbox
+from clubs.utils import (
+    bump_cache_version,
+    clean,
+    get_cache_versions,
+    get_django_minified_image,
+    get_domain,
+    get_short_description,
+    get_zoom_meeting_id,
+    get_zoom_participant_cache_key,
+    html_to_text,
+)
 
 
-subject_regex = re.compile(r"\s*<!--\s*SUBJECT:\s*(.*?)\s*-->", re.I)
-types_regex = re.compile(r"\s*<!--\s*TYPES:\s*(.*?)\s*-->", re.DOTALL)
+# number of seconds to wait for a club calendar server before giving up
+ICS_FETCH_TIMEOUT = 10
 
 
 def get_mail_type_annotation(name):
     """
     Given a template name, return the type annotation metadata.
     """
-    prefix = {"fyh": "fyh_emails"}.get(settings.BRANDING, "emails")
-    path = os.path.join(settings.BASE_DIR, "templates", prefix, f"{name}.html")
-    with open(path, "r") as f:
-        contents = f.read()
-    match = types_regex.search(contents)
-    if match is not None:
-        return yaml.safe_load(match.group(1).strip())
-    return None
+    return get_email_template(name).types
 
 
-def send_mail_helper(name, subject, emails, context):
+def send_mail_helper(name, subject, emails, context, invite=None):
     """
     A helper to send out an email given the template name, subject, to emails, and context.
     Returns true if an email was sent out, or false if no emails were sent out.
 
+    Inside of a batch_mail context, the email is queued and sent along with the rest of the batch.
+    Inside of an outbox_mail context, the rendered email is saved to the outbox instead and sent
+    later by "./manage.py send_outbox". The invite, if specified, is recorded with the outbox
+    email so that its delivery status can be looked up.
+
     All emails should go through this function.
     """
     if not all(isinstance(email, str) for email in emails):
@@ -59,22 +71,13 @@ def send_mail_helper(name, subject, emails, context):
     if not emails:
         return False
 
-    # load email template
-    prefix = {"fyh": "fyh_emails"}.get(settings.BRANDING, "emails")
-    html_content = render_to_string(f"{prefix}/{name}.html", context)
-
-    # use subject from template if it exists
-    # subject should match: <!-- SUBJECT: (subject) --> and be the first line
-    match = subject_regex.search(html_content)
-    if match is not None:
-        subject = match.group(1)
-        html_content = subject_regex.sub("", html_content, count=1)
-
-    # remove type annotation comment
-    match = types_regex.search(html_content)
-    if match is not None:
-        html_content = types_regex.sub("", html_content, count=1)
-    else:
+    # render email template, using the subject from the template if it exists
+    template = get_email_template(name)
+    template_subject, html_content = template.render(context)
+    if template_subject is not None:
+        subject = template_subject
+
+    if template.types is None:
         warnings.warn(
             f"There is no type annotation information for the template '{name}'! "
             "Email previews may work incorrectly without type information.",
@@ -87,13 +90,23 @@ def send_mail_helper(name, subject, emails, context):
             f"The following output was generated from the template:\n\n{html_content}"
         )
 
+    if use_outbox():
+        OutboxEmail.objects.create(
+            template=name,
+            subject=subject,
+            recipients="\n".join(sorted(set(emails))),
+            html_content=html_content,
+            invite=invite,
+        )
+        return True
+
     # generate text alternative
     text_content = html_to_text(html_content)
 
     msg = EmailMultiAlternatives(subject, text_content, settings.FROM_EMAIL, list(set(emails)))
 
     msg.attach_alternative(html_content, "text/html")
-    msg.send(fail_silently=False)
+    dispatch_mail(msg)
     return True
 
 
@@ -273,12 +286,40 @@ class Club(models.Model):
 
     # cache club rankings
     rank = models.IntegerField(default=0)
+    # set when information used to compute the ranking changes
+    rank_dirty = models.BooleanField(default=False)
+
+    # cache counts of related objects, see update_club_counts
+    favorite_count = models.IntegerField(default=0)
+    membership_count = models.IntegerField(default=0)
+
+    # lowercase combination of the searchable fields, see get_search_document
+    search_document = models.TextField(blank=True)
+    # plain text summary of the description, see club_description_text
+    short_description = models.TextField(blank=True)
+
+    # response metadata from the last calendar import, used to skip unchanged calendars
+    ics_import_etag = models.CharField(max_length=255, blank=True)
+    ics_import_last_modified = models.CharField(max_length=255, blank=True)
+    ics_import_hash = models.CharField(max_length=64, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     ghost = models.BooleanField(default=False)
-    history = HistoricalRecords(cascade_delete_history=True)
+    history = HistoricalRecords(
+        cascade_delete_history=True,
+        excluded_fields=[
+            "rank_dirty",
+            "favorite_count",
+            "membership_count",
+            "search_document",
+            "short_description",
+            "ics_import_etag",
+            "ics_import_last_modified",
+            "ics_import_hash",
+        ],
+    )
 
     def __str__(self):
         return self.name
@@ -286,9 +327,11 @@ class Club(models.Model):
     def create_thumbnail(self, request=None):
         return create_thumbnail_helper(self, request, 200)
 
-    def add_ics_events(self):
+    def add_ics_events(self, text=None):
         """
         Fetch the ICS events from the club's calendar URL and return the number of modified events.
+
+        If the contents of the calendar have already been fetched, they can be passed in instead.
         """
         # random but consistent uuid used to generate uuid5s from invalid uuids
         ics_import_uuid_namespace = uuid.UUID("8f37c140-3775-42e8-91d4-fda7a2e44152")
@@ -297,31 +340,89 @@ class Club(models.Model):
 
         url = self.ics_import_url
         if url:
-            calendar = Calendar(requests.get(url).text)
-            event_list = Event.objects.filter(is_ics_event=True, club=self)
-            modified_events = []
-            for event in calendar.events:
-                tries = [
-                    Event.objects.filter(
-                        club=self, start_time=event.begin.datetime, end_time=event.end.datetime
-                    ).first(),
-                    Event(),
-                ]
+            if text is None:
+                text = requests.get(url, timeout=ICS_FETCH_TIMEOUT).text
+            calendar_events = list(Calendar(text).events)
 
-                # try matching using uuid if it is valid
+            # uuids used to match events, if they are valid
+            event_uuids = []
+            for event in calendar_events:
                 if event.uid:
                     try:
                         event_uuid = uuid.UUID(event.uid[:36])
                     except ValueError:
                         # generate uuid from malformed/invalid uuids
                         event_uuid = uuid.uuid5(ics_import_uuid_namespace, event.uid)
-
-                    tries.insert(0, Event.objects.filter(ics_uuid=event_uuid).first())
                 else:
                     event_uuid = None
+                event_uuids.append(event_uuid)
+
+            # load all events that can be matched by uuid or time at once, events are matched
+            # in memory in the same order as they would be fetched from the database
+            existing_events = list(
+                Event.objects.filter(
+                    models.Q(club=self)
+                    | models.Q(ics_uuid__in=[u for u in event_uuids if u is not None])
+                ).order_by("pk")
+            )
+            positions = {}
+            by_uuid = collections.defaultdict(list)
+            by_time = collections.defaultdict(list)
+
+            def index(ev):
+                by_uuid[ev.ics_uuid].append(ev)
+                if ev.club_id == self.pk:
+                    by_time[(ev.start_time, ev.end_time)].append(ev)
+
+            def unindex(ev):
+                by_uuid[ev.ics_uuid].remove(ev)
+                if ev.club_id == self.pk:
+                    by_time[(ev.start_time, ev.end_time)].remove(ev)
+
+            def first(evs):
+                return min(evs, key=lambda ev: positions[id(ev)], default=None)
+
+            update_fields = [
+                "club",
+                "name",
+                "start_time",
+                "end_time",
+                "description",
+                "location",
+                "is_ics_event",
+                "type",
+                "url",
+                "ics_uuid",
+                "code",
+                "search_document",
+                "description_text",
+                "zoom_meeting_id",
+            ]
+            attnames = [Event._meta.get_field(field).attname for field in update_fields]
+            original_values = {}
+            for ev in existing_events:
+                positions[id(ev)] = len(positions)
+                original_values[ev.pk] = [getattr(ev, attname) for attname in attnames]
+                index(ev)
+
+            modified_events = []
+            new_events = []
+            for event, event_uuid in zip(calendar_events, event_uuids):
+                tries = [
+                    first(by_time[(event.begin.datetime, event.end.datetime)]),
+                    Event(),
+                ]
+                if event_uuid:
+                    tries.insert(0, first(by_uuid[event_uuid]))
 
                 for ev in tries:
                     if ev:
+                        if id(ev) in positions:
+                            unindex(ev)
+                        else:
+                            positions[id(ev)] = len(positions)
+                            new_events.append(ev)
+
                         ev.club = self
                         ev.name = event.name.strip()
                         ev.start_time = event.begin.datetime
@@ -331,7 +432,7 @@ class Club(models.Model):
                         ev.is_ics_event = True
 
                         # very simple type detection, only perform on first time
-                        if ev.pk is None:
+                        if ev is tries[-1]:
                             ev.type = Event.OTHER
                             for val, lbl in Event.TYPES:
                                 if val in {Event.FAIR}:
@@ -391,11 +492,41 @@ class Club(models.Model):
                         if ev.url:
                             ev.url = ev.url[:2048]
 
-                        ev.save()
+                        ev.search_document = get_event_search_document(ev, self)
+                        ev.description_text = html_to_text(ev.description)
+                        ev.zoom_meeting_id = get_zoom_meeting_id(ev.url)
+                        index(ev)
                         modified_events.append(ev)
                         break
 
-            event_list.exclude(pk__in=[e.pk for e in modified_events]).delete()
+            # only write the events that have changed, signals are not sent for bulk operations
+            now = timezone.now()
+            changed_events = []
+            for ev in existing_events:
+                if [getattr(ev, attname) for attname in attnames] != original_values[ev.pk]:
+                    ev.updated_at = now
+                    changed_events.append(ev)
+            modified_ids = {id(ev) for ev in modified_events}
+            stale_events = [
+                ev.pk
+                for ev in existing_events
+                if ev.club_id == self.pk and ev.is_ics_event and id(ev) not in modified_ids
+            ]
+
+            with transaction.atomic():
+                Event.objects.bulk_update(changed_events, [*update_fields, "updated_at"])
+                Event.objects.bulk_create(new_events)
+                Event.objects.filter(pk__in=stale_events).delete()
+
+                # events may have been moved here from other clubs by uuid
+                if changed_events or new_events:
+                    club_ids = {self.pk} | {original_values[ev.pk][0] for ev in changed_events}
+                    invalidate_fair_directories(get_club_fair_ids(club_ids))
+
+            if changed_events or new_events:
+                mark_clubs_rank_dirty([self.pk])
+                bump_cache_version("event")
+
             return len(modified_events)
         return 0
 
@@ -769,9 +900,13 @@ class Event(models.Model):
     end_time = models.DateTimeField()
     location = models.CharField(max_length=255, null=True, blank=True)
     url = models.URLField(max_length=2048, null=True, blank=True)
+    # meeting id if the url is a Zoom meeting link, see event_zoom_meeting_id
+    zoom_meeting_id = models.CharField(max_length=255, null=True, blank=True, db_index=True)
     image = models.ImageField(upload_to=get_event_file_name, null=True, blank=True)
     image_small = models.ImageField(upload_to=get_event_small_file_name, null=True, blank=True)
     description = models.TextField(blank=True)  # rich html
+    # plain text version of the description, see event_description_text
+    description_text = models.TextField(blank=True)
     ics_uuid = models.UUIDField(default=uuid.uuid4)
     is_ics_event = models.BooleanField(default=False, blank=True)
     parent_recurring_event = models.ForeignKey(
@@ -798,6 +933,9 @@ class Event(models.Model):
     type = models.IntegerField(choices=TYPES, default=RECRUITMENT)
     pinned = models.BooleanField(default=False)
 
+    # lowercase combination of the searchable fields, see get_search_document
+    search_document = models.TextField(blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -807,6 +945,14 @@ class Event(models.Model):
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            # calendar views filter on a time range and order by start time
+            models.Index(fields=["start_time", "end_time"], name="event_start_end_idx"),
+            # club pages list the events for a single club ordered by start time
+            models.Index(fields=["club", "start_time"], name="event_club_start_idx"),
+        ]
+
 
 class Favorite(models.Model):
     """
@@ -899,6 +1045,14 @@ class ZoomMeetingVisit(models.Model):
             self.meeting_id,
         )
 
+    class Meta:
+        indexes = [
+            # the Zoom webhook looks up the open visit for a participant when they leave
+            models.Index(
+                fields=["meeting_id", "participant_id"], name="zoom_visit_participant_idx"
+            ),
+        ]
+
 
 class MembershipRequest(models.Model):
     """
@@ -1146,6 +1300,7 @@ class MembershipInvite(models.Model):
             subject="Invitation to {}".format(self.club.name),
             emails=[self.email],
             context=context,
+            invite=self,
         )
 
     def send_owner_invite(self, request=None):
@@ -1172,6 +1327,7 @@ class MembershipInvite(models.Model):
             subject=f"Welcome to {settings.BRANDING_SITE_NAME}!",
             emails=[self.email],
             context=context,
+            invite=self,
         )
 
 
@@ -1340,6 +1496,62 @@ class ClubApplication(models.Model):
         )
 
 
+class OutboxEmail(models.Model):
+    """
+    Represents a rendered email waiting to be sent by "./manage.py send_outbox".
+    Emails triggered by request handlers are saved here so that the request does not have to
+    wait for the mail server.
+    """
+
+    PENDING = 1
+    SENT = 2
+    FAILED = 3
+    STATUS_CHOICES = ((PENDING, "Pending"), (SENT, "Sent"), (FAILED, "Failed"))
+
+    template = models.CharField(max_length=255)
+    subject = models.TextField()
+    recipients = models.TextField()  # one email address per line
+    html_content = models.TextField()
+    invite = models.ForeignKey(
+        MembershipInvite,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="outbox_emails",
+    )
+
+    status = models.IntegerField(choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    send_after = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "<OutboxEmail: {} to {}>".format(self.template, ", ".join(self.get_recipients()))
+
+    def get_recipients(self):
+        return [email for email in self.recipients.split("\n") if email]
+
+    def get_message(self):
+        msg = EmailMultiAlternatives(
+            self.subject,
+            html_to_text(self.html_content),
+            settings.FROM_EMAIL,
+            self.get_recipients(),
+        )
+        msg.attach_alternative(self.html_content, "text/html")
+        return msg
+
+    class Meta:
+        indexes = [
+            # the outbox worker looks for pending emails that are ready to be sent
+            models.Index(fields=["status", "send_after"], name="outbox_email_pending_idx"),
+        ]
+
+
 @receiver(models.signals.pre_delete, sender=Asset)
 def asset_delete_cleanup(sender, instance, **kwargs):
     if instance.file:
@@ -1366,7 +1578,501 @@ def user_create(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
 
 
+@receiver(models.signals.pre_save, sender=get_user_model())
+def user_zoom_participant_previous(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Remember the username of the user before it is saved, so that Zoom participants are not
+    matched to the user by its old username.
+    """
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and "username" not in update_fields:
+        return
+    instance._zoom_participant_previous = (
+        sender.objects.filter(pk=instance.pk).values_list("username", flat=True).first()
+    )
+
+
+@receiver(models.signals.post_save, sender=get_user_model())
+@receiver(models.signals.post_delete, sender=get_user_model())
+def user_zoom_participant_invalidate(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Remove the cached Zoom participant matches for the old and the new username of the user,
+    so that visits are not recorded for deleted users or for the wrong person.
+    """
+    if raw or (update_fields is not None and "username" not in update_fields):
+        return
+    usernames = {instance.username, getattr(instance, "_zoom_participant_previous", None)}
+    keys = [get_zoom_participant_cache_key(username) for username in usernames if username]
+
+    # also remove the matches once committed, in case they were cached again in the meantime
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
 @receiver(models.signals.post_delete, sender=Profile)
 def profile_delete_cleanup(sender, instance, **kwargs):
     if instance.image:
         instance.image.delete(save=False)
+
+
+# process local cache of the club hierarchy, see get_club_hierarchy
+_club_hierarchy = {"version": None, "local_version": 0, "changes": []}
+_club_hierarchy_lock = threading.Lock()
+
+
+class ClubHierarchyChange:
+    """
+    A modification of the club hierarchy in a transaction that has not been committed yet.
+    Bumps the shared hierarchy version when the transaction is committed.
+    """
+
+    def __init__(self):
+        self.connection = transaction.get_connection()
+        self.committed = False
+
+    def __call__(self):
+        self.committed = True
+        bump_cache_version("hierarchy")
+
+    def is_pending(self):
+        """
+        Return true if the transaction is still open. The commit hook is discarded if the
+        transaction or the savepoint that made the change is rolled back.
+        """
+        return any(func is self for _, func in self.connection.run_on_commit)
+
+
+def load_club_hierarchy():
+    parents = collections.defaultdict(set)
+    children = collections.defaultdict(set)
+    for child, parent in Club.parent_orgs.through.objects.values_list("from_club", "to_club"):
+        parents[child].add(parent)
+        children[parent].add(child)
+    return parents, children
+
+
+def get_club_hierarchy():
+    """
+    Return a pair of dictionaries mapping each club id to the set of ids of its direct
+    parents and the set of ids of its direct children.
+
+    The hierarchy is loaded with a single query and kept in process memory until the
+    parent_orgs relationship is modified in any process.
+
+    A hierarchy that was loaded after an uncommitted change is discarded if that change is
+    rolled back, and is not used by other database connections until the change is committed.
+    """
+    connection = transaction.get_connection()
+    other_changes = False
+    with _club_hierarchy_lock:
+        for change in list(_club_hierarchy["changes"]):
+            if change.committed:
+                _club_hierarchy["changes"].remove(change)
+            elif not change.is_pending():
+                _club_hierarchy["changes"].remove(change)
+                _club_hierarchy["local_version"] += 1
+            elif change.connection is not connection:
+                other_changes = True
+
+    if other_changes:
+        return load_club_hierarchy()
+
+    version = (get_cache_versions(["hierarchy"])["hierarchy"], _club_hierarchy["local_version"])
+    if _club_hierarchy["version"] != version:
+        parents, children = load_club_hierarchy()
+        _club_hierarchy.update(
+            {"version": version, "parents": parents, "children": children, "ancestors": {}}
+        )
+    return _club_hierarchy["parents"], _club_hierarchy["children"]
+
+
+def get_club_ancestors(club_id):
+    """
+    Return the set of ids of the specified club and all clubs above it in the hierarchy.
+    """
+    parents, _ = get_club_hierarchy()
+    if parents is _club_hierarchy["parents"]:
+        ancestors = _club_hierarchy["ancestors"]
+    else:
+        ancestors = {}
+    if club_id not in ancestors:
+        found = {club_id}
+        queue = [club_id]
+        while queue:
+            for parent in parents.get(queue.pop(), ()):
+                if parent not in found:
+                    found.add(parent)
+                    queue.append(parent)
+        ancestors[club_id] = frozenset(found)
+    return ancestors[club_id]
+
+
+def invalidate_club_hierarchy():
+    change = ClubHierarchyChange()
+    with _club_hierarchy_lock:
+        _club_hierarchy["local_version"] += 1
+        _club_hierarchy["changes"].append(change)
+    transaction.on_commit(change)
+
+
+@receiver(models.signals.m2m_changed, sender=Club.parent_orgs.through)
+def club_hierarchy_m2m_invalidate(sender, action, **kwargs):
+    if action in {"post_add", "post_remove", "post_clear"}:
+        invalidate_club_hierarchy()
+
+
+@receiver(models.signals.post_delete, sender=Club)
+def club_hierarchy_delete_invalidate(sender, instance, **kwargs):
+    invalidate_club_hierarchy()
+
+
+# cached counts of related objects that are only written using subqueries
+CLUB_COUNT_FIELDS = ["favorite_count", "membership_count"]
+
+
+def get_club_count_subqueries():
+    """
+    Return the expressions that compute the favorite and membership counts of a club.
+    The stored counters on the club model should always be equal to these values.
+    """
+
+    def count(queryset):
+        return Coalesce(
+            Subquery(
+                queryset.filter(club=OuterRef("pk"))
+                .order_by()
+                .values("club")
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            0,
+        )
+
+    return {
+        "favorite_count": count(Favorite.objects.all()),
+        "membership_count": count(Membership.objects.filter(active=True)),
+    }
+
+
+def update_club_counts(club_ids):
+    """
+    Recompute the stored favorite and membership counts for the specified clubs.
+    """
+    club_ids = [pk for pk in club_ids if pk is not None]
+    if club_ids:
+        Club.objects.filter(pk__in=club_ids).update(**get_club_count_subqueries())
+
+
+@receiver(models.signals.post_save, sender=Favorite)
+@receiver(models.signals.post_save, sender=Membership)
+@receiver(models.signals.post_delete, sender=Favorite)
+@receiver(models.signals.post_delete, sender=Membership)
+def club_counts_update(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    update_club_counts([instance.club_id])
+
+
+@receiver(models.signals.post_save, sender=Club)
+def club_counts_restore(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """
+    Saving every field of an outdated club instance writes the counts that were loaded with it,
+    overwriting favorites and memberships added since then, so recompute them from the database.
+    """
+    if raw or created:
+        return
+    if update_fields is not None and not set(update_fields) & set(CLUB_COUNT_FIELDS):
+        return
+    update_club_counts([instance.pk])
+
+
+# fields that are included in the search documents for clubs and events
+CLUB_SEARCH_FIELDS = ["name", "subtitle", "code", "terms"]
+EVENT_SEARCH_FIELDS = ["name", "description"]
+
+
+def get_search_document(*values):
+    """
+    Combine the specified field values into a lowercase document that is used for searching.
+    """
+    return "\n".join(value.lower() for value in values if value)
+
+
+def get_event_search_document(event, club):
+    values = [getattr(event, field) for field in EVENT_SEARCH_FIELDS]
+    if club is not None:
+        values += [club.name, club.subtitle, club.code]
+    return get_search_document(*values)
+
+
+@receiver(models.signals.pre_save, sender=Club)
+def club_search_document(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(CLUB_SEARCH_FIELDS):
+        return
+    document = get_search_document(*(getattr(instance, field) for field in CLUB_SEARCH_FIELDS))
+    instance._search_document_changed = document != instance.search_document
+    instance.search_document = document
+
+
+@receiver(models.signals.post_save, sender=Club)
+def club_search_document_update(sender, instance, created, update_fields=None, **kwargs):
+    if not getattr(instance, "_search_document_changed", False):
+        return
+    instance._search_document_changed = False
+
+    if update_fields is not None:
+        Club.objects.filter(pk=instance.pk).update(search_document=instance.search_document)
+
+    if created:
+        return
+
+    # the search documents for events include information about the club
+    events = list(instance.events.only("club", *EVENT_SEARCH_FIELDS))
+    for event in events:
+        event.search_document = get_event_search_document(event, instance)
+    Event.objects.bulk_update(events, ["search_document"])
+
+
+@receiver(models.signals.pre_save, sender=Event)
+def event_search_document(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & {"club", *EVENT_SEARCH_FIELDS}:
+        return
+    document = get_event_search_document(instance, instance.club)
+    if update_fields is not None and document != instance.search_document:
+        instance._search_document_changed = True
+    instance.search_document = document
+
+
+@receiver(models.signals.post_save, sender=Event)
+def event_search_document_update(sender, instance, **kwargs):
+    if getattr(instance, "_search_document_changed", False):
+        instance._search_document_changed = False
+        Event.objects.filter(pk=instance.pk).update(search_document=instance.search_document)
+
+
+@receiver(models.signals.pre_save, sender=Club)
+def club_description_text(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and "description" not in update_fields:
+        return
+    instance.short_description = get_short_description(instance.description)
+    if update_fields is not None:
+        instance._description_text_changed = True
+
+
+@receiver(models.signals.pre_save, sender=Event)
+def event_description_text(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and "description" not in update_fields:
+        return
+    instance.description_text = html_to_text(instance.description)
+    if update_fields is not None:
+        instance._description_text_changed = True
+
+
+@receiver(models.signals.pre_save, sender=Event)
+def event_zoom_meeting_id(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and "url" not in update_fields:
+        return
+    instance.zoom_meeting_id = get_zoom_meeting_id(instance.url)
+    if update_fields is not None:
+        instance._zoom_meeting_id_changed = True
+
+
+@receiver(models.signals.post_save, sender=Club)
+def club_description_text_update(sender, instance, **kwargs):
+    if getattr(instance, "_description_text_changed", False):
+        instance._description_text_changed = False
+        Club.objects.filter(pk=instance.pk).update(short_description=instance.short_description)
+
+
+@receiver(models.signals.post_save, sender=Event)
+def event_description_text_update(sender, instance, **kwargs):
+    if getattr(instance, "_description_text_changed", False):
+        instance._description_text_changed = False
+        Event.objects.filter(pk=instance.pk).update(description_text=instance.description_text)
+
+
+@receiver(models.signals.post_save, sender=Event)
+def event_zoom_meeting_id_update(sender, instance, **kwargs):
+    if getattr(instance, "_zoom_meeting_id_changed", False):
+        instance._zoom_meeting_id_changed = False
+        Event.objects.filter(pk=instance.pk).update(zoom_meeting_id=instance.zoom_meeting_id)
+
+
+def mark_clubs_rank_dirty(club_ids):
+    """
+    Flag the specified clubs so that their ranking is recomputed by "./manage.py rank --dirty".
+    """
+    club_ids = [pk for pk in club_ids if pk is not None]
+    if club_ids:
+        Club.objects.filter(pk__in=club_ids, rank_dirty=False).update(rank_dirty=True)
+
+
+@receiver(models.signals.post_save, sender=Club)
+def club_rank_dirty(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and set(update_fields) <= {"rank", "rank_dirty"}):
+        return
+    mark_clubs_rank_dirty([instance.pk])
+
+
+@receiver(models.signals.post_save, sender=ClubApplication)
+@receiver(models.signals.post_save, sender=ClubFairRegistration)
+@receiver(models.signals.post_save, sender=Event)
+@receiver(models.signals.post_save, sender=Favorite)
+@receiver(models.signals.post_save, sender=Membership)
+@receiver(models.signals.post_save, sender=Testimonial)
+@receiver(models.signals.post_delete, sender=ClubApplication)
+@receiver(models.signals.post_delete, sender=ClubFairRegistration)
+@receiver(models.signals.post_delete, sender=Event)
+@receiver(models.signals.post_delete, sender=Favorite)
+@receiver(models.signals.post_delete, sender=Membership)
+@receiver(models.signals.post_delete, sender=Testimonial)
+def club_item_rank_dirty(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    mark_clubs_rank_dirty([instance.club_id])
+
+
+@receiver(models.signals.m2m_changed, sender=Club.tags.through)
+def club_tags_rank_dirty(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in {"post_add", "post_remove", "post_clear"}:
+        return
+    if not reverse:
+        mark_clubs_rank_dirty([instance.pk])
+    elif pk_set:
+        mark_clubs_rank_dirty(pk_set)
+
+
+# cache version counters for models that are displayed on the club list and detail pages
+# a write to any of these models invalidates the cached club responses
+CLUB_CACHE_MODELS = [
+    "advisor",
+    "badge",
+    "club",
+    "event",
+    "favorite",
+    "membership",
+    "tag",
+    "testimonial",
+]
+
+
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Advisor)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Badge)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Club)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Event)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Favorite)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Membership)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Tag)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Testimonial)
+def club_cache_invalidate(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_cache_version(sender._meta.model_name)
+
+
+@receiver(models.signals.m2m_changed, sender=Club.tags.through)
+@receiver(models.signals.m2m_changed, sender=Club.badges.through)
+def club_m2m_cache_invalidate(sender, action, **kwargs):
+    if action in {"post_add", "post_remove", "post_clear"}:
+        bump_cache_version("club")
+
+
+def invalidate_fair_directories(fair_ids):
+    """
+    Mark the cached fair directories for the specified fairs as outdated once the current
+    transaction commits, so that they are regenerated on the next request.
+    """
+    names = {f"fair-directory:{pk}" for pk in fair_ids if pk is not None}
+    if names:
+        transaction.on_commit(lambda: [bump_cache_version(name) for name in names])
+
+
+def get_club_fair_ids(club_ids):
+    return set(
+        Badge.objects.filter(purpose="fair", club__in=club_ids, fair__isnull=False).values_list(
+            "fair", flat=True
+        )
+    )
+
+
+@receiver(models.signals.pre_save, sender=Event)
+def event_fair_directory_previous(sender, instance, raw=False, **kwargs):
+    """
+    Remember the type and club of the event before it is saved, so that the fair directory is
+    updated when an event stops being a fair event or moves to another club.
+    """
+    if raw or instance.pk is None:
+        return
+    instance._fair_directory_previous = (
+        Event.objects.filter(pk=instance.pk).values_list("type", "club_id").first()
+    )
+
+
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Event)
+def event_fair_directory_invalidate(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    states = [(instance.type, instance.club_id)]
+    previous = getattr(instance, "_fair_directory_previous", None)
+    if previous is not None:
+        states.append(previous)
+
+    # deleted events are removed regardless of the type of the stale instance
+    deleted = kwargs.get("signal") is models.signals.post_delete
+    club_ids = {club_id for event_type, club_id in states if deleted or event_type == Event.FAIR}
+    club_ids.discard(None)
+    if club_ids:
+        invalidate_fair_directories(get_club_fair_ids(club_ids))
+
+
+@receiver(models.signals.post_save, sender=Club)
+def club_fair_directory_invalidate(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not {"name", "code"} & set(update_fields)):
+        return
+    invalidate_fair_directories(get_club_fair_ids([instance.pk]))
+
+
+@receiver(models.signals.pre_save, sender=Badge)
+@receiver(models.signals.pre_save, sender=ClubFairRegistration)
+def fair_item_directory_previous(sender, instance, raw=False, **kwargs):
+    """
+    Remember the fair of the object before it is saved, so that the directories of both the old
+    and the new fair are updated when it moves between fairs.
+    """
+    if raw or instance.pk is None:
+        return
+    instance._fair_directory_previous = (
+        sender.objects.filter(pk=instance.pk).values_list("fair_id", flat=True).first()
+    )
+
+
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Badge)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=ClubFairRegistration)
+def fair_item_directory_invalidate(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_fair_directories(
+        [instance.fair_id, getattr(instance, "_fair_directory_previous", None)]
+    )
+
+
+@receiver(models.signals.post_save, sender=ClubFair)
+def fair_directory_invalidate(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_fair_directories([instance.pk])
+
+
+@receiver(models.signals.m2m_changed, sender=Club.badges.through)
+def club_badges_fair_directory_invalidate(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in {"post_add", "post_remove", "pre_clear"}:
+        return
+    if reverse:
+        invalidate_fair_directories([instance.fair_id])
+    elif action == "pre_clear":
+        invalidate_fair_directories(get_club_fair_ids([instance.pk]))
+    elif pk_set:
+        invalidate_fair_directories(
+            Badge.objects.filter(pk__in=pk_set, purpose="fair").values_list("fair", flat=True)
+        )
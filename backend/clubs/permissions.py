@@ -1,29 +1,6 @@
 from rest_framework import permissions
 
-from clubs.models import Club, Membership
-
-
-def codes_extract_helper(obj, key):
-    """
-    Traverses parent tree and returns
-    flattened list of parent club codes
-    """
-    arr = []
-
-    def extract(obj, arr, key):
-        if isinstance(obj, dict):
-            for k, v in obj.items():
-                if isinstance(v, (dict, list)):
-                    extract(v, arr, key)
-                elif k == key:
-                    arr.append(v)
-        elif isinstance(obj, list):
-            for item in obj:
-                extract(item, arr, key)
-        return arr
-
-    values = extract(obj, arr, key)
-    return values
+from clubs.models import Club, Membership, get_club_ancestors
 
 
 def find_membership_helper(user, obj):
@@ -33,13 +10,8 @@ def find_membership_helper(user, obj):
 
     Returns None if there is no membership between the specified club and user.
     """
-    from clubs.views import find_relationship_helper
-
-    related_codes = codes_extract_helper(
-        find_relationship_helper("parent_orgs", obj, {obj.code}), "code"
-    )
     membership_instance = (
-        Membership.objects.filter(person=user, club__code__in=related_codes)
+        Membership.objects.filter(person=user, club__in=get_club_ancestors(obj.pk))
         .order_by("role")
         .first()
     )
@@ -6,13 +6,14 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.validators import URLValidator
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Prefetch
 from django.template.defaultfilters import slugify
 from django.utils import timezone
 from rest_framework import serializers, validators
 from simple_history.utils import update_change_reason
 
+from clubs.mail import outbox_mail
 from clubs.mixins import ManyToManySaveMixin
 from clubs.models import (
     Advisor,
@@ -204,9 +205,12 @@ class QuestionAnswerSerializer(ClubRouteMixin, serializers.ModelSerializer):
         """
         validated_data["author"] = self.context["request"].user
 
-        obj = super().create(validated_data)
+        # the email is queued in the same transaction as the question
+        with transaction.atomic():
+            obj = super().create(validated_data)
 
-        obj.send_question_mail(self.context["request"])
+            with outbox_mail():
+                obj.send_question_mail(self.context["request"])
 
         return obj
 
@@ -483,6 +487,18 @@ class MembershipInviteSerializer(serializers.ModelSerializer):
     token = serializers.CharField(max_length=128, write_only=True)
     name = serializers.CharField(source="club.name", read_only=True)
     public = serializers.BooleanField(write_only=True, required=False)
+    email_status = serializers.SerializerMethodField("get_email_status")
+
+    def get_email_status(self, obj):
+        """
+        Return the delivery status of the latest invitation email for this invite,
+        or None if no email has been queued in the outbox.
+        """
+        if not hasattr(obj, "email_status"):
+            obj.email_status = (
+                obj.outbox_emails.order_by("-created_at").values_list("status", flat=True).first()
+            )
+        return obj.email_status
 
     def create(self, validated_data):
         validated_data.pop("public", None)
@@ -527,6 +543,7 @@ class MembershipInviteSerializer(serializers.ModelSerializer):
         model = MembershipInvite
         fields = [
             "email",
+            "email_status",
             "id",
             "name",
             "public",
@@ -742,19 +759,8 @@ class ClubListSerializer(serializers.ModelSerializer):
         if obj.subtitle:
             return obj.subtitle
 
-        # return first sentence of description without html tags
-        desc = obj.description.lstrip()[:1000]
-        cleaned_desc = re.sub(r"<[^>]+>", "", desc)
-        return (
-            "".join(re.split(r"(\.|\n|!)", cleaned_desc)[:2])
-            .replace("&amp;", "&")
-            .replace("&lt;", "<")
-            .replace("&gt;", ">")
-            .replace("&ndash;", "-")
-            .replace("&mdash;", "-")
-            .replace("&nbsp;", " ")
-            .strip()
-        )
+        # first sentence of description without html tags, computed when the club is saved
+        return obj.short_description
 
     def get_is_favorite(self, obj):
         user = self.context["request"].user
@@ -837,9 +843,12 @@ class ClubListSerializer(serializers.ModelSerializer):
             can_see_pending = user.has_perm("clubs.see_pending_clubs") or user.has_perm(
                 "clubs.manage_club"
             )
-            is_member = (
-                user.is_authenticated and instance.membership_set.filter(person=user).exists()
-            )
+            if not user.is_authenticated:
+                is_member = False
+            elif hasattr(instance, "user_membership_set"):
+                is_member = bool(instance.user_membership_set)
+            else:
+                is_member = instance.membership_set.filter(person=user).exists()
             if not can_see_pending and not is_member:
                 historical_club = (
                     instance.history.filter(approved=True).order_by("-approved_on").first()
@@ -989,16 +998,17 @@ class ClubSerializer(ManyToManySaveMixin, ClubListSerializer):
     youtube = serializers.CharField(required=False, allow_null=True, allow_blank=True)
 
     def get_fairs(self, obj):
+        if hasattr(obj, "prefetched_fairs"):
+            return [fair.id for fair in obj.prefetched_fairs]
         return list(obj.clubfair_set.values_list("id", flat=True))
 
     def get_events(self, obj):
-        now = timezone.now()
-        return ClubEventSerializer(
-            obj.events.filter(end_time__gte=now).order_by("start_time"),
-            many=True,
-            read_only=True,
-            context=self.context,
-        ).data
+        if hasattr(obj, "upcoming_events"):
+            events = obj.upcoming_events
+        else:
+            now = timezone.now()
+            events = obj.events.filter(end_time__gte=now).order_by("start_time")
+        return ClubEventSerializer(events, many=True, read_only=True, context=self.context,).data
 
     def get_is_ghost(self, obj):
         if obj.ghost:
@@ -1027,6 +1037,8 @@ class ClubSerializer(ManyToManySaveMixin, ClubListSerializer):
         user = self.context["request"].user
         if not user.is_authenticated:
             return False
+        if hasattr(obj, "user_membershiprequest_set"):
+            return bool(obj.user_membershiprequest_set)
         return obj.membershiprequest_set.filter(person=user, withdrew=False).exists()
 
     def create(self, validated_data):
@@ -1045,7 +1057,8 @@ class ClubSerializer(ManyToManySaveMixin, ClubListSerializer):
 
         if not settings.BRANDING == "fyh":
             # send a renewal email prompting the user to apply for approval for their club
-            obj.send_renewal_email()
+            with outbox_mail():
+                obj.send_renewal_email()
 
         return obj
 
@@ -1246,24 +1259,29 @@ class ClubSerializer(ManyToManySaveMixin, ClubListSerializer):
             if new_approval_status is True:
                 self.validated_data["ghost"] = False
 
-        obj = super().save()
-
-        # remove small version if large one is gone
-        if not obj.image and obj.image_small:
-            obj.image_small.delete()
-
-        # if we queued for approval, send a confirmation email
-        if not was_active and obj.active:
-            obj.send_confirmation_email()
-
-        # if accepted or rejected, send email with reason
-        if approval_email_required:
-            obj.send_approval_email(change=has_approved_version)
-            update_change_reason(obj, "{} club".format("Approve" if obj.approved else "Reject"))
-        elif needs_reapproval:
-            update_change_reason(obj, "Edit club through UI (reapproval required)")
-        else:
-            update_change_reason(obj, "Edit club through UI")
+        # the emails are queued in the same transaction as the changes to the club,
+        # which includes creating the club and its owner membership in create
+        with transaction.atomic():
+            obj = super().save()
+
+            # remove small version if large one is gone
+            if not obj.image and obj.image_small:
+                obj.image_small.delete()
+
+            # if we queued for approval, send a confirmation email
+            if not was_active and obj.active:
+                with outbox_mail():
+                    obj.send_confirmation_email()
+
+            # if accepted or rejected, send email with reason
+            if approval_email_required:
+                with outbox_mail():
+                    obj.send_approval_email(change=has_approved_version)
+                update_change_reason(obj, "{} club".format("Approve" if obj.approved else "Reject"))
+            elif needs_reapproval:
+                update_change_reason(obj, "Edit club through UI (reapproval required)")
+            else:
+                update_change_reason(obj, "Edit club through UI")
 
         return obj
 
@@ -1521,9 +1539,12 @@ class UserMembershipRequestSerializer(serializers.ModelSerializer):
         """
         Send an email when a membership request is created.
         """
-        obj = super().create(validated_data)
+        # the email is queued in the same transaction as the request
+        with transaction.atomic():
+            obj = super().create(validated_data)
 
-        obj.send_request(self.context["request"])
+            with outbox_mail():
+                obj.send_request(self.context["request"])
 
         return obj
 
@@ -1855,6 +1876,65 @@ class ReportClubSerializer(AuthenticatedClubSerializer):
                     return f"[{fair.name}] {label}"
                 return f"Registered for {fair.name}"
 
+    @classmethod
+    def get_report_queryset(cls, queryset, request):
+        """
+        Fetch the related objects for the report columns requested in the "fields" GET parameter
+        ahead of time, so that the number of queries does not depend on the number of clubs.
+        All columns are fetched if no valid columns are requested, matching `get_fields`.
+        """
+        requested = [field for field in request.GET.get("fields", "").split(",") if field]
+        if not any(
+            field in cls.Meta.fields or field.startswith("custom_fair_") for field in requested
+        ):
+            requested = cls.Meta.fields
+
+        now = timezone.now()
+        user = request.user if request.user.is_authenticated else None
+        select_related = {"approved_by": ["approved_by"]}
+        prefetch_related = {
+            "advisor_set": ["advisor_set"],
+            "badges": ["badges"],
+            "events": [
+                Prefetch(
+                    "events",
+                    queryset=Event.objects.filter(end_time__gte=now).order_by("start_time"),
+                    to_attr="upcoming_events",
+                )
+            ],
+            "fairs": [
+                Prefetch(
+                    "clubfair_set", queryset=ClubFair.objects.only("id"), to_attr="prefetched_fairs"
+                )
+            ],
+            "files": ["asset_set"],
+            "is_request": [
+                Prefetch(
+                    "membershiprequest_set",
+                    queryset=MembershipRequest.objects.filter(person=user, withdrew=False),
+                    to_attr="user_membershiprequest_set",
+                )
+            ],
+            "members": [
+                Prefetch(
+                    "membership_set",
+                    queryset=Membership.objects.select_related("person", "person__profile"),
+                )
+            ],
+            "student_types": ["student_types"],
+            "target_majors": ["target_majors"],
+            "target_schools": ["target_schools"],
+            "target_years": ["target_years"],
+            "testimonials": ["testimonials"],
+        }
+
+        for field in requested:
+            if field in select_related:
+                queryset = queryset.select_related(*select_related[field])
+            if field in prefetch_related:
+                queryset = queryset.prefetch_related(*prefetch_related[field])
+        return queryset
+
     class Meta(AuthenticatedClubSerializer.Meta):
         pass
 
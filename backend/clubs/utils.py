@@ -1,11 +1,14 @@
+import collections
 import io
 import re
+import time
 from urllib.parse import urlparse
 
 import bleach
 import requests
 from bs4 import BeautifulSoup, Comment, NavigableString
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.images import ImageFile
 from django.db.models import CharField, F, Q, Value
 from django.template.defaultfilters import slugify
@@ -90,6 +93,50 @@ def html_to_text(html):
     return traverse(soup.children).strip()
 
 
+def get_short_description(html):
+    """
+    Return the first sentence of the HTML description without any HTML tags.
+
+    Used as the summary for clubs without a subtitle.
+    """
+    desc = html.lstrip()[:1000]
+    cleaned_desc = re.sub(r"<[^>]+>", "", desc)
+    return (
+        "".join(re.split(r"(\.|\n|!)", cleaned_desc)[:2])
+        .replace("&amp;", "&")
+        .replace("&lt;", "<")
+        .replace("&gt;", ">")
+        .replace("&ndash;", "-")
+        .replace("&mdash;", "-")
+        .replace("&nbsp;", " ")
+        .strip()
+    )
+
+
+def get_zoom_meeting_id(url):
+    """
+    Return the meeting id from a Zoom meeting link, or None if the URL is not a Zoom meeting link.
+    """
+    if not url:
+        return None
+
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    if host != "zoom.us" and not host.endswith(".zoom.us"):
+        return None
+
+    match = re.match(r"/[^/]*/(\d+)", parsed.path)
+    return match[1] if match is not None else None
+
+
+def get_zoom_participant_cache_key(username):
+    """
+    Return the cache key for the id of the user that Zoom participants with the specified
+    username are matched to.
+    """
+    return f"zoom:participant:{username}"
+
+
 # a list of allowed domains for embedding iframes
 IFRAME_EMBED_WHITELIST = {
     "calendar.google.com",
@@ -167,26 +214,263 @@ def min_edit(s1, s2):
     """
     Return the Levenshtein distance between two strings.
     """
-    if len(s1) > len(s2):
-        s1, s2 = s2, s1
-    distances = range(len(s1) + 1)
-    for index2, char2 in enumerate(s2):
-        newDistances = [index2 + 1]
-        for index1, char1 in enumerate(s1):
-            if char1 == char2:
-                newDistances.append(distances[index1])
+    return edit_distances(s1, [s2])[0]
+
+
+def edit_distances(query, candidates, max_distance=None):
+    """
+    Return a list with the Levenshtein distance between the query and each of the candidates.
+
+    If max_distance is specified, any distance greater than max_distance is reported as
+    max_distance + 1. This allows most candidates to be rejected without computing the full
+    distance, so specify it whenever you only care about close matches.
+
+    Uses the bit-parallel algorithm from Myers (1999), which processes one column of the
+    dynamic programming table at a time using integer operations.
+    """
+    length = len(query)
+
+    # precompute the positions of each character in the query
+    peq = collections.defaultdict(int)
+    for i, char in enumerate(query):
+        peq[char] |= 1 << i
+    mask = (1 << length) - 1
+    last = 1 << (length - 1) if length else 0
+
+    distances = []
+    for candidate in candidates:
+        remaining = len(candidate)
+
+        # the distance is at least the difference in length
+        if max_distance is not None and abs(remaining - length) > max_distance:
+            distances.append(max_distance + 1)
+            continue
+        if not length:
+            distances.append(remaining)
+            continue
+
+        pv, mv, score = mask, 0, length
+        for char in candidate:
+            eq = peq.get(char, 0)
+            xv = eq | mv
+            xh = (((eq & pv) + pv) ^ pv) | eq
+            ph = mv | (~(xh | pv) & mask)
+            mh = pv & xh
+            if ph & last:
+                score += 1
+            elif mh & last:
+                score -= 1
+            ph = ((ph << 1) | 1) & mask
+            mh = (mh << 1) & mask
+            pv = mh | (~(xv | ph) & mask)
+            mv = ph & xv
+
+            # each remaining character can lower the distance by at most one
+            remaining -= 1
+            if max_distance is not None and score - remaining > max_distance:
+                score = max_distance + 1
+                break
+
+        distances.append(score)
+    return distances
+
+
+def get_ngrams(text, n=3):
+    """
+    Return the set of character n-grams in the given string.
+    """
+    return {text[i:][:n] for i in range(len(text) - n + 1)}
+
+
+class ClubNameMatcher:
+    """
+    Matches club names against the names, subtitles and codes of all clubs.
+
+    All of the club information is loaded from the database once and stored in lookup tables,
+    along with a trigram index for substring searches. Reuse the same matcher when looking up
+    many names to avoid querying the database for each name.
+    """
+
+    def __init__(self, queryset=None):
+        from clubs.models import Club
+
+        if queryset is None:
+            queryset = Club.objects.all()
+
+        self.clubs = []
+        self.names = {}
+        self.codes = {}
+        self.subtitles = {}
+        self.ngrams = {
+            "name": collections.defaultdict(set),
+            "subtitle": collections.defaultdict(set),
+        }
+
+        for club in sorted(queryset, key=lambda c: (c.name, c.pk)):
+            self.add(club)
+
+    def add(self, club):
+        """
+        Add a club to the lookup tables, for example after it has been created.
+        """
+        index = len(self.clubs)
+        self.clubs.append(club)
+        self.names.setdefault(club.name.lower(), []).append(index)
+        self.codes[club.code] = index
+        self.subtitles.setdefault((club.subtitle or "").lower(), []).append(index)
+        for field in self.ngrams:
+            for ngram in get_ngrams((getattr(club, field) or "").lower()):
+                self.ngrams[field][ngram].add(index)
+
+    def _contains(self, field, text):
+        """
+        Return the clubs where the specified field contains the text, ignoring case.
+        """
+        text = text.lower()
+        ngrams = get_ngrams(text)
+        if ngrams:
+            candidates = set.intersection(*(self.ngrams[field].get(n, set()) for n in ngrams))
+        else:
+            candidates = range(len(self.clubs))
+        return [
+            self.clubs[i]
+            for i in sorted(candidates)
+            if text in (getattr(self.clubs[i], field) or "").lower()
+        ]
+
+    def _closest(self, clubs, name):
+        distances = edit_distances(name.lower(), [c.name.lower() for c in clubs])
+        return clubs[distances.index(min(distances))]
+
+    def lookup_many(self, names):
+        """
+        Return a list with the matching club for each of the provided names, or None if no club
+        could be found for that name.
+        """
+        return [self.lookup(name) for name in names]
+
+    def lookup(self, name):
+        """
+        Aggressively attempt to find a club matching the provided name.
+        Returns None if the club with that name could not be found.
+        """
+        name = name.strip()
+
+        # empty string should match no club
+        if not name:
+            return None
+
+        # lookup club by case insensitive name
+        club = [self.clubs[i] for i in self.names.get(name.lower(), [])]
+        if club:
+            # lookup club by case sensitive name
+            if len(club) > 1:
+                club = [c for c in club if c.name == name]
+                if club:
+                    return club[0]
             else:
-                newDistances.append(
-                    1 + min((distances[index1], distances[index1 + 1], newDistances[-1]))
-                )
-        distances = newDistances
-    return distances[-1]
+                return club[0]
+
+        # lookup club by slug
+        code = slugify(re.sub(r"\(.+?\)$", "", name).strip())
+        if code in self.codes:
+            return self.clubs[self.codes[code]]
+
+        # lookup club by ampersand
+        for old, new in [("and", "&"), ("&", "and")]:
+            if old in name:
+                mod_name = name.replace(old, new)
+                club = self._contains("name", mod_name)
+                if club:
+                    if len(club) == 1:
+                        return club[0]
+                    club = self.names.get(mod_name.lower())
+                    if club:
+                        return self.clubs[club[0]]
+
+        # lookup club by subtitle
+        club = [self.clubs[i] for i in self.subtitles.get(name.lower(), [])]
+        if club:
+            return self._closest(club, name)
+
+        # lookup club by subtitle contains
+        club = self._contains("subtitle", name)
+        if len(club) == 1:
+            return club[0]
+
+        # lookup by reverse subtitle contains
+        club = [
+            c
+            for c in self.clubs
+            if c.subtitle
+            and re.search(".......", c.subtitle)
+            and c.subtitle.lower() in name.lower()
+        ]
+        if len(club) == 1:
+            return club[0]
+
+        # lookup club without dashes
+        regex = "^{}$".format(re.escape(name.replace("-", " ").strip()).replace("\\ ", r"[\s-]"))
+        club = [c for c in self.clubs if re.search(regex, c.name, re.I)]
+        if club:
+            return self._closest(club, name)
+
+        # lookup clubs without space considerations
+        regex = r" ?".join(re.sub(r"\W+", "", name))
+        club = [c for c in self.clubs if re.search(regex, c.name, re.I)]
+        if club:
+            return self._closest(club, name)
+
+        # strip out parentheses
+        name = re.sub(r"\(.+?\)$", "", name).strip()
+        club = self._contains("name", name)
+        if club:
+            return self._closest(club, name)
+
+        # look up clubs with names inside the passed name
+        club = [c for c in self.clubs if c.name.lower() in name.lower()]
+        if club:
+            return self._closest(club, name)
+
+        # strip out common words to see if we can get match
+        modified_name = re.sub(r"university of pennsylvania", "", name, flags=re.I).strip()
+        modified_name = re.sub(r"upenn|the|club|penn", "", modified_name, flags=re.I).strip()
+        club = self._contains("name", modified_name)
+        if club:
+            return self._closest(club, name)
+
+        # try to get somewhat related club names and perform a distance comparison
+        close_clubs = set()
+        for word in name.split(" "):
+            if word not in {"the", "of", "penn", "club"}:
+                close_clubs.update(id(c) for c in self._contains("name", word.strip()))
+        close_clubs = [c for c in self.clubs if id(c) in close_clubs]
+
+        if close_clubs:
+            close_names = [c.name.lower() for c in close_clubs]
+
+            # try distance match unmodified
+            distances = edit_distances(name.lower(), close_names, max_distance=2)
+            distance = min(distances)
+            if distance <= 2:
+                return close_clubs[distances.index(distance)]
+
+            # try distance match with removing prefix
+            no_prefix_name = re.sub(r"^\w+\s?-", "", name, flags=re.I).strip().lower()
+            distances = edit_distances(no_prefix_name, close_names, max_distance=2)
+            distance = min(distances)
+            if distance <= 2:
+                return close_clubs[distances.index(distance)]
+
+        return None
 
 
 def fuzzy_lookup_club(name):
     """
     Aggressively attempt to find a club matching the provided name.
     Returns None if the club with that name could not be found.
+
+    Each lookup runs several queries, when looking up many names use a ClubNameMatcher instead.
     """
     from clubs.models import Club
 
@@ -348,3 +632,68 @@ def get_django_minified_image(url, **kwargs):
     resp = requests.get(url)
     new_image = resize_image(resp.content, **kwargs)
     return ImageFile(io.BytesIO(new_image), name="image.png")
+
+
+def get_cache_versions(names):
+    """
+    Return a dictionary of the current cache version counters for the specified model names.
+    Cache keys for objects that depend on these models should include these versions.
+
+    Versions that are missing from the cache are initialized using the current time,
+    so that an evicted counter never reverts to a value that has been used before.
+    """
+    keys = {f"cache:version:{name}": name for name in names}
+    versions = cache.get_many(keys.keys())
+    for key in keys:
+        if key not in versions:
+            cache.add(key, int(time.time() * 1000), None)
+            versions[key] = cache.get(key, 0)
+    return {name: versions[key] for key, name in keys.items()}
+
+
+def bump_cache_version(name):
+    """
+    Increment the cache version counter for the specified model name,
+    invalidating everything that was cached using the old version.
+    """
+    key = f"cache:version:{name}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), None)
+
+
+def get_or_build_cached(key, version, build, timeout=None, lock_timeout=60, wait=10):
+    """
+    Return the value cached under the specified key if it was built for the current version.
+    Otherwise, call the build function to regenerate the value and cache it for the specified
+    number of seconds, or without expiry if no timeout is specified.
+
+    Only one caller at a time rebuilds a value. Other callers receive the outdated value while
+    it is being rebuilt, or wait for the rebuild to finish if there is no outdated value.
+    """
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, True, lock_timeout):
+        try:
+            value = build()
+            cache.set(key, (version, value), timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    if cached is not None:
+        return cached[1]
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached[1]
+
+    # the caller holding the lock is taking too long, build the value without caching it
+    return build()
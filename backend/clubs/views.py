@@ -2,13 +2,15 @@ import argparse
 import collections
 import datetime
 import functools
+import hashlib
 import io
+import itertools
 import json
 import os
 import re
 import secrets
 import string
-from urllib.parse import urlparse
+from urllib.parse import urlencode, urlparse
 
 import pytz
 import qrcode
@@ -24,13 +26,15 @@ from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import UploadedFile
 from django.core.management import call_command, get_commands, load_command_class
 from django.core.validators import validate_email
-from django.db.models import Count, DurationField, ExpressionWrapper, F, Prefetch, Q
+from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
 from django.db.models.functions import Lower, Trunc
 from django.db.models.query import prefetch_related_objects
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
-from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_etags, quote_etag
 from django.utils.text import slugify
 from ics import Calendar as ICSCal
 from ics import Event as ICSEvent
@@ -42,14 +46,18 @@ from rest_framework.exceptions import PermissionDenied
 from rest_framework.exceptions import ValidationError as DRFValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.utils.serializer_helpers import ReturnList
 from rest_framework.views import APIView
 from social_django.utils import load_strategy
 from tatsu.exceptions import FailedParse
 
-from clubs.filters import RandomOrderingFilter, RandomPageNumberPagination
+from clubs.attendance import get_live_stats, record_visit
+from clubs.filters import RandomOrderingFilter, RandomPageNumberPagination, SearchDocumentFilter
+from clubs.mail import get_email_template, get_email_template_names, outbox_mail
 from clubs.mixins import XLSXFormatterMixin
 from clubs.models import (
+    CLUB_CACHE_MODELS,
     Advisor,
     Asset,
     Badge,
@@ -65,6 +73,7 @@ from clubs.models import (
     MembershipInvite,
     MembershipRequest,
     Note,
+    OutboxEmail,
     QuestionAnswer,
     RecurringEvent,
     Report,
@@ -75,7 +84,7 @@ from clubs.models import (
     Testimonial,
     Year,
     ZoomMeetingVisit,
-    get_mail_type_annotation,
+    get_club_hierarchy,
 )
 from clubs.permissions import (
     AssetPermission,
@@ -139,7 +148,13 @@ from clubs.serializers import (
     WritableClubFairSerializer,
     YearSerializer,
 )
-from clubs.utils import fuzzy_lookup_club, html_to_text
+from clubs.utils import (
+    ClubNameMatcher,
+    get_cache_versions,
+    get_or_build_cached,
+    get_zoom_participant_cache_key,
+    html_to_text,
+)
 
 
 def file_upload_endpoint_helper(request, code):
@@ -190,22 +205,101 @@ def upload_endpoint_helper(request, cls, field, save=True, **kwargs):
 def find_relationship_helper(relationship, club_object, found):
     """
     Format and retrieve all parents or children of a club into tree.
+
+    The relationship must be either "parent_orgs" or "children_orgs".
+    The tree is assembled in memory from the cached club hierarchy, using a constant number of
+    queries regardless of the size of the tree.
     """
-    children = getattr(club_object, relationship).all().prefetch_related(relationship)
-    children_recurse = []
-    for child in children:
-        if child.code not in found:
-            found.add(child.code)
-            children_recurse.append(find_relationship_helper(relationship, child, found))
-            found.remove(child.code)
-        else:
-            children_recurse.append({"name": child.name, "code": child.code})
+    parents, children = get_club_hierarchy()
+    edges = parents if relationship == "parent_orgs" else children
+
+    # find all clubs that can appear in the tree
+    reachable = {club_object.pk}
+    queue = [club_object.pk]
+    while queue:
+        for pk in edges.get(queue.pop(), ()):
+            if pk not in reachable:
+                reachable.add(pk)
+                queue.append(pk)
+
+    # use the default club ordering for the children of each node
+    clubs = {}
+    for index, (pk, name, code) in enumerate(
+        Club.objects.filter(pk__in=reachable).values_list("pk", "name", "code")
+    ):
+        clubs[pk] = (index, name, code)
+
+    def build(pk, name, code):
+        children_recurse = []
+        related = [child for child in edges.get(pk, ()) if child in clubs]
+        for child in sorted(related, key=lambda child: clubs[child][0]):
+            _, child_name, child_code = clubs[child]
+            if child_code not in found:
+                found.add(child_code)
+                children_recurse.append(build(child, child_name, child_code))
+                found.remove(child_code)
+            else:
+                children_recurse.append({"name": child_name, "code": child_code})
 
-    return {
-        "name": club_object.name,
-        "code": club_object.code,
-        "children": children_recurse,
-    }
+        return {
+            "name": name,
+            "code": code,
+            "children": children_recurse,
+        }
+
+    return build(club_object.pk, club_object.name, club_object.code)
+
+
+def fair_directory_helper(fair, now):
+    """
+    Return the fair directory listing for the events of the specified fair.
+    If there is no fair, show the events around the specified date.
+    """
+    events = Event.objects.filter(
+        type=Event.FAIR, club__badges__purpose="fair", club__badges__fair=fair
+    )
+
+    # filter event range based on the fair times or provide a reasonable fallback
+    if fair is None:
+        events = events.filter(
+            start_time__lte=now + datetime.timedelta(days=7),
+            end_time__gte=now - datetime.timedelta(days=1),
+        )
+    else:
+        events = events.filter(start_time__lte=fair.end_time, end_time__gte=fair.start_time)
+
+    events = events.values_list(
+        "start_time", "end_time", "club__name", "club__code", "club__badges__label"
+    ).distinct()
+    output = {}
+    for event in events:
+        # group by start date
+        ts = int(event[0].replace(second=0, microsecond=0).timestamp())
+        if ts not in output:
+            output[ts] = {
+                "start_time": event[0],
+                "end_time": event[1],
+                "events": {},
+            }
+
+        # group by category
+        category = event[4]
+        if category not in output[ts]["events"]:
+            output[ts]["events"][category] = {
+                "category": category,
+                "events": [],
+            }
+
+        output[ts]["events"][category]["events"].append({"name": event[2], "code": event[3]})
+    for item in output.values():
+        item["events"] = list(sorted(item["events"].values(), key=lambda cat: cat["category"]))
+        for category in item["events"]:
+            category["events"] = list(
+                sorted(category["events"], key=lambda e: e["name"].casefold())
+            )
+
+    output = list(sorted(output.values(), key=lambda cat: cat["start_time"]))
+    return {"events": output, "fair": ClubFairSerializer(instance=fair).data}
 
 
 def filter_note_permission(queryset, club, user):
@@ -471,7 +565,14 @@ class ClubsOrderingFilter(RandomOrderingFilter):
         if not ordering and hasattr(view, "ordering"):
             ordering = [view.ordering]
 
-        if "featured" in ordering:
+        if "relevance" in ordering and "search_rank" in queryset.query.annotations:
+            if queryset.model == Club:
+                return queryset.order_by("-search_rank", "-rank", "-favorite_count", "-id")
+            return queryset.order_by(
+                "-search_rank", "-club__rank", "-club__favorite_count", "-club__id"
+            )
+
+        if "featured" in ordering or "relevance" in ordering:
             if queryset.model == Club:
                 return queryset.order_by("-rank", "-favorite_count", "-id")
             return queryset.order_by("-club__rank", "-club__favorite_count", "-club__id")
@@ -555,7 +656,8 @@ class ClubFairViewSet(viewsets.ModelViewSet):
         """
         Returns all events, grouped by id, with the number of participants currently in the meeting,
         the officers or owners in the meeting, and the number of participants
-        who have already attended the meeting.
+        who have already attended the meeting. Zoom participants that do not match a user are
+        counted separately by their participant id.
         ---
         responses:
             "200":
@@ -579,51 +681,22 @@ class ClubFairViewSet(viewsets.ModelViewSet):
         ---
         """
         fair = self.get_object()
-        clubs = fair.participating_clubs.all()
-        events = (
+        event_ids = list(
             Event.objects.filter(
-                club__in=clubs,
+                club__in=fair.participating_clubs.all(),
                 type=Event.FAIR,
                 start_time__gte=fair.start_time,
                 end_time__lte=fair.end_time,
-            )
-            .annotate(
-                participant_count=Count(
-                    "visits__person", distinct=True, filter=Q(visits__leave_time__isnull=True)
-                )
-            )
-            .annotate(
-                already_attended=Count(
-                    "visits__person", distinct=True, filter=Q(visits__leave_time__isnull=False),
-                )
-            )
-            .filter(visits__leave_time__isnull=False)
-            .annotate(
-                durations=ExpressionWrapper(
-                    F("visits__leave_time") - F("visits__join_time"), output_field=DurationField()
-                )
-            )
+            ).values_list("id", flat=True)
         )
 
-        median_list = collections.defaultdict(list)
-        for event_id, duration in events.values_list("id", "durations").order_by("durations"):
-            median_list[event_id].append(duration.total_seconds())
-        median_list = {k: v[len(v) // 2] if v else 0 for k, v in median_list.items()}
-
-        event_list = events.values_list("id", "participant_count", "already_attended")
-        officer_mapping = collections.defaultdict(list)
-        for k, v in events.filter(
-            club__in=clubs, club__membership__role__lte=10, visits__leave_time__isnull=True
-        ).values_list("id", "club__membership__person__username"):
-            officer_mapping[k].append(v)
-
         formatted = {}
-        for event_id, particpant_count, already_attended in event_list:
+        for event_id, stats in get_live_stats(event_ids).items():
             formatted[event_id] = {
-                "participant_count": particpant_count,
-                "already_attended": already_attended,
-                "officers": officer_mapping.get(event_id, []),
-                "median": median_list.get(event_id, 0),
+                "participant_count": stats["attending"],
+                "already_attended": stats["attended"],
+                "officers": stats["officers"],
+                "median": stats["median"],
             }
         return Response(formatted)
 
@@ -912,18 +985,9 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
     Delete a club. Consider marking the club as inactive instead of deleting the club.
     """
 
-    queryset = (
-        Club.objects.all()
-        .annotate(
-            favorite_count=Count("favorite", distinct=True),
-            membership_count=Count("membership", distinct=True, filter=Q(active=True)),
-        )
-        .prefetch_related("tags")
-        .order_by("-favorite_count", "name")
-    )
+    queryset = Club.objects.all().prefetch_related("tags").order_by("-favorite_count", "name")
     permission_classes = [ClubPermission | IsSuperuser]
-    filter_backends = [filters.SearchFilter, ClubsSearchFilter, ClubsOrderingFilter]
-    search_fields = ["name", "subtitle", "code", "terms"]
+    filter_backends = [SearchDocumentFilter, ClubsSearchFilter, ClubsOrderingFilter]
     ordering_fields = ["favorite_count", "name"]
     ordering = "featured"
 
@@ -981,6 +1045,10 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
             subset = [x.strip() for x in subset.strip().split(",")]
             queryset = queryset.filter(code__in=subset)
 
+        # prefetch the related objects for the requested report columns
+        if self.action == "list" and self.get_serializer_class() is ReportClubSerializer:
+            queryset = ReportClubSerializer.get_report_queryset(queryset, self.request)
+
         # filter by approved clubs
         if (
             self.request.user.has_perm("clubs.see_pending_clubs")
@@ -1497,19 +1565,12 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
             name: code
             for name, code in Club.objects.filter(name__in=clubs).values_list("name", "code")
         }
-        output = []
-        for name in clubs:
-            if name in simple:
-                output.append(simple[name])
-            elif name:
-                fuzzy = fuzzy_lookup_club(name)
-                if fuzzy is None:
-                    fuzzy = "None"
-                else:
-                    fuzzy = fuzzy.code
-                output.append(fuzzy)
-            else:
-                output.append(name)
+        missing = [name for name in clubs if name not in simple]
+        if missing:
+            matcher = ClubNameMatcher(Club.objects.only("code", "name", "subtitle"))
+            for name, club in zip(missing, matcher.lookup_many(missing)):
+                simple[name] = "None" if club is None else club.code
+        output = [simple[name] for name in clubs]
         return Response({"output": "\n".join(output).strip()})
 
     @action(detail=False, methods=["post"])
@@ -1696,12 +1757,53 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
         self.check_approval_permission(request)
         return super().update(request, *args, **kwargs)
 
+    def get_cached_response(self, request, func):
+        """
+        Cache successful JSON responses for anonymous users for 5 minutes or until one of the
+        models displayed on the club pages is modified. The cache key is based on the normalized
+        query string and the current version counters of these models.
+
+        Also supports revalidation using the ETag and If-None-Match headers.
+        """
+        if request.user.is_authenticated or request.accepted_renderer.format != "json":
+            return func()
+
+        versions = get_cache_versions(CLUB_CACHE_MODELS)
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        digest = hashlib.sha1(f"{sorted(versions.items())}:{query}".encode("utf-8")).hexdigest()
+        key = f"clubs:{self.action}:{self.kwargs.get(self.lookup_field, '')}:{digest}"
+
+        cached = cache.get(key)
+        if cached is None:
+            response = func()
+            if response.status_code != 200:
+                return response
+            content = json.dumps(response.data, cls=JSONEncoder, sort_keys=True)
+            etag = '"{}"'.format(hashlib.sha1(content.encode("utf-8")).hexdigest())
+            cached = (response.data, etag)
+            cache.set(key, cached, 5 * 60)
+
+        data, etag = cached
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if if_none_match:
+            etags = [tag[2:] if tag.startswith("W/") else tag for tag in parse_etags(if_none_match)]
+            if "*" in etags or etag in etags:
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(data, headers={"ETag": etag})
+
     def list(self, request, *args, **kwargs):
         """
         Return a list of all clubs.
         Note that some fields are removed in order to improve response time.
         """
-        return super().list(request, *args, **kwargs)
+        return self.get_cached_response(
+            request, lambda: super(ClubViewSet, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, lambda: super(ClubViewSet, self).retrieve(request, *args, **kwargs)
+        )
 
     def perform_destroy(self, instance):
         """
@@ -1956,14 +2058,7 @@ class ClubEventViewSet(viewsets.ModelViewSet):
     """
 
     permission_classes = [EventPermission | IsSuperuser]
-    filter_backends = [filters.SearchFilter, ClubsSearchFilter, ClubsOrderingFilter]
-    search_fields = [
-        "name",
-        "club__name",
-        "club__subtitle",
-        "description",
-        "club__code",
-    ]
+    filter_backends = [SearchDocumentFilter, ClubsSearchFilter, ClubsOrderingFilter]
     lookup_field = "id"
     http_method_names = ["get", "post", "put", "patch", "delete"]
     pagination_class = RandomPageNumberPagination
@@ -2112,17 +2207,18 @@ class ClubEventViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         qs = Event.objects.all()
+
+        # check the club conditions in a subquery instead of an outer join,
+        # so that the database can use the indexes on the event table
+        visible = Q(type=Event.FAIR) | Q(
+            club__in=Club.objects.filter(Q(approved=True) | Q(ghost=True)).values("pk")
+        )
         is_club_specific = self.kwargs.get("club_code") is not None
         if is_club_specific:
             qs = qs.filter(club__code=self.kwargs["club_code"])
-            qs = qs.filter(Q(club__approved=True) | Q(type=Event.FAIR) | Q(club__ghost=True))
+            qs = qs.filter(visible)
         else:
-            qs = qs.filter(
-                Q(club__approved=True)
-                | Q(type=Event.FAIR)
-                | Q(club__ghost=True)
-                | Q(club__isnull=True)
-            )
+            qs = qs.filter(visible | Q(club__isnull=True))
 
         return (
             qs.select_related("club", "creator")
@@ -2228,15 +2324,6 @@ class EventViewSet(ClubEventViewSet):
         if fair:
             fair = int(re.sub(r"\D", "", fair))
 
-        # cache the response for this endpoint with short timeout
-        if date is None:
-            key = f"events:fair:directory:{request.user.is_authenticated}:{fair}"
-            cached = cache.get(key)
-            if cached:
-                return Response(cached)
-        else:
-            key = None
-
         # lookup fair from id
         if fair:
             fair = get_object_or_404(ClubFair, id=fair)
@@ -2248,59 +2335,22 @@ class EventViewSet(ClubEventViewSet):
                 .order_by("start_time")
                 .first()
             )
-        if not date:
-            date = fair.start_time.date()
 
-        now = date or timezone.now()
-        events = Event.objects.filter(
-            type=Event.FAIR, club__badges__purpose="fair", club__badges__fair=fair
-        )
-
-        # filter event range based on the fair times or provide a reasonable fallback
-        if fair is None:
-            events = events.filter(
-                start_time__lte=now + datetime.timedelta(days=7),
-                end_time__gte=now - datetime.timedelta(days=1),
-            )
-        else:
-            events = events.filter(start_time__lte=fair.end_time, end_time__gte=fair.start_time)
-
-        events = events.values_list(
-            "start_time", "end_time", "club__name", "club__code", "club__badges__label"
-        ).distinct()
-        output = {}
-        for event in events:
-            # group by start date
-            ts = int(event[0].replace(second=0, microsecond=0).timestamp())
-            if ts not in output:
-                output[ts] = {
-                    "start_time": event[0],
-                    "end_time": event[1],
-                    "events": {},
-                }
-
-            # group by category
-            category = event[4]
-            if category not in output[ts]["events"]:
-                output[ts]["events"][category] = {
-                    "category": category,
-                    "events": [],
-                }
-
-            output[ts]["events"][category]["events"].append({"name": event[2], "code": event[3]})
-        for item in output.values():
-            item["events"] = list(sorted(item["events"].values(), key=lambda cat: cat["category"]))
-            for category in item["events"]:
-                category["events"] = list(
-                    sorted(category["events"], key=lambda e: e["name"].casefold())
+        # the directory for a fair is cached until one of the objects that it depends on changes,
+        # the timeout only catches changes that are not covered by the invalidation signals
+        if date is None:
+            name = f"fair-directory:{fair.id}"
+            version = get_cache_versions([name])[name]
+            return Response(
+                get_or_build_cached(
+                    f"events:fair:directory:{fair.id}",
+                    version,
+                    lambda: fair_directory_helper(fair, fair.start_time.date()),
+                    timeout=60 * 60,
                 )
+            )
 
-        output = list(sorted(output.values(), key=lambda cat: cat["start_time"]))
-        final_output = {"events": output, "fair": ClubFairSerializer(instance=fair).data}
-        if key:
-            cache.set(key, final_output, 60 * 5)
-
-        return Response(final_output)
+        return Response(fair_directory_helper(fair, date))
 
     @action(detail=False, methods=["get"])
     def owned(self, request, *args, **kwargs):
@@ -2795,6 +2845,77 @@ def parse_boolean(inpt):
     return None
 
 
+def get_ics_event_cache_key(version, pk, updated_at, club_updated_at):
+    """
+    Return the cache key for the rendered VEVENT block of an event. The version is bumped when
+    fields that are rendered into the block are changed without modifying updated_at.
+    """
+    club_version = club_updated_at.timestamp() if club_updated_at is not None else None
+    return f"calendar:event:{version}:{pk}:{updated_at.timestamp()}:{club_version}"
+
+
+def render_ics_event(event):
+    """
+    Render an event as a VEVENT block for the favorite events calendar.
+    """
+    e = ICSEvent()
+    e.name = "{} - {}".format(event.club.name, event.name)
+    e.begin = event.start_time
+
+    # ensure event is at least 15 minutes for display purposes
+    e.end = (
+        (event.start_time + datetime.timedelta(minutes=15))
+        if event.start_time >= event.end_time
+        else event.end_time
+    )
+
+    # put url in location if location does not exist, otherwise put url in body
+    if event.location:
+        e.location = event.location
+    else:
+        e.location = event.url
+    e.url = event.url
+    e.description = "{}\n\n{}".format(
+        event.url or "" if not event.location else "", event.description_text
+    ).strip()
+    e.uid = f"{event.ics_uuid}@{settings.DOMAIN}"
+    e.created = event.created_at
+    e.last_modified = event.updated_at
+    e.categories = [event.club.name]
+
+    return str(e)
+
+
+def get_ics_event_blocks(calendar_version, versions):
+    """
+    Yield the rendered VEVENT blocks for the events with the specified primary keys and versions.
+
+    Rendered blocks are cached until the event or its club is modified,
+    so only new or modified events are fetched from the database and rendered.
+    """
+    keys = [get_ics_event_cache_key(calendar_version, *version) for version in versions]
+    cached = cache.get_many(keys)
+
+    blocks = {version[0]: cached[key] for version, key in zip(versions, keys) if key in cached}
+    missing = [version[0] for version in versions if version[0] not in blocks]
+    if missing:
+        rendered = {}
+        for event in Event.objects.filter(pk__in=missing).select_related("club"):
+            key = get_ics_event_cache_key(
+                calendar_version,
+                event.pk,
+                event.updated_at,
+                event.club.updated_at if event.club else None,
+            )
+            rendered[key] = blocks[event.pk] = render_ics_event(event)
+        cache.set_many(rendered, 7 * 24 * 60 * 60)
+
+    for pk, *_ in versions:
+        # skip events that were deleted after the versions were fetched
+        if pk in blocks:
+            yield f"{blocks[pk]}\r\n"
+
+
 class FavoriteCalendarAPIView(APIView):
     def get(self, request, *args, **kwargs):
         """
@@ -2843,38 +2964,32 @@ class FavoriteCalendarAPIView(APIView):
         elif not is_all:
             all_events = all_events.filter(q)
 
-        all_events = all_events.distinct().select_related("club")
-
-        for event in all_events:
-            e = ICSEvent()
-            e.name = "{} - {}".format(event.club.name, event.name)
-            e.begin = event.start_time
-
-            # ensure event is at least 15 minutes for display purposes
-            e.end = (
-                (event.start_time + datetime.timedelta(minutes=15))
-                if event.start_time >= event.end_time
-                else event.end_time
+        # the rendered calendar only depends on the events and their clubs
+        calendar_version = get_cache_versions(["calendar"])["calendar"]
+        versions = list(
+            all_events.distinct()
+            .order_by("start_time", "pk")
+            .values_list("pk", "updated_at", "club__updated_at")
+        )
+        etag = hashlib.sha1(
+            "\n".join(
+                get_ics_event_cache_key(calendar_version, *version) for version in versions
+            ).encode("utf-8")
+        ).hexdigest()
+
+        # there is no last modified time, the event set also changes when favorites are added
+        # or events drop out of the time range, which the etag covers but timestamps do not
+        response = get_conditional_response(request, etag=quote_etag(etag))
+        if response is None:
+            # the calendar is streamed as the header, one block per event, and the footer
+            header, footer = str(calendar).rsplit("\r\n", 1)
+            blocks = get_ics_event_blocks(calendar_version, versions)
+            response = StreamingHttpResponse(
+                itertools.chain([f"{header}\r\n"], blocks, [footer]), content_type="text/calendar",
             )
+            response["Content-Disposition"] = "attachment; filename=favorite_events.ics"
 
-            # put url in location if location does not exist, otherwise put url in body
-            if event.location:
-                e.location = event.location
-            else:
-                e.location = event.url
-            e.url = event.url
-            e.description = "{}\n\n{}".format(
-                event.url or "" if not event.location else "", html_to_text(event.description)
-            ).strip()
-            e.uid = f"{event.ics_uuid}@{settings.DOMAIN}"
-            e.created = event.created_at
-            e.last_modified = event.updated_at
-            e.categories = [event.club.name]
-
-            calendar.events.add(e)
-
-        response = HttpResponse(calendar, content_type="text/calendar")
-        response["Content-Disposition"] = "attachment; filename=favorite_events.ics"
+        response["ETag"] = quote_etag(etag)
         return response
 
 
@@ -3070,6 +3185,36 @@ def zoom_api_call(user, verb, url, *args, **kwargs):
     return out
 
 
+def get_zoom_participant_user_id(email):
+    """
+    Return the id of the user with the username in the email address of a Zoom participant,
+    or None if there is no such user. Lookups are cached because the Zoom webhook receives
+    many requests for the same participants during a fair.
+    """
+    username = email.split("@")[0]
+    key = get_zoom_participant_cache_key(username)
+    user_id = cache.get(key)
+    if user_id is None:
+        user_id = (
+            get_user_model().objects.filter(username=username).values_list("id", flat=True).first()
+        )
+        # remember missing users for a shorter time, since they may log in for the first time
+        cache.set(key, user_id or 0, 60 * 60 if user_id else 60)
+    return user_id or None
+
+
+def format_live_stats(stats):
+    """
+    Format the live statistics for an event in the format returned by the Zoom webhook endpoint.
+    """
+    return {
+        "attending": stats["attending"],
+        "attended": stats["attended"],
+        "officers": len(stats["officers"]),
+        "time": stats["median"],
+    }
+
+
 def generate_zoom_password():
     """
     Create a secure Zoom password for the meeting.
@@ -3105,12 +3250,16 @@ class MeetingZoomWebhookAPIView(APIView):
                                     description: Number of users currently attending the meeting.
                                 officers:
                                     type: integer
-                                    description: Number of officers attending the meeting.
+                                    description: >
+                                        Number of officers and owners of the club attending the
+                                        meeting. Other members of the club are not included.
                                 attended:
                                     type: integer
                                     description: >
                                         Number of users that attended the meeting before.
                                         Does not include currently attending users.
+                                        Zoom participants that do not match a user are
+                                        counted separately by their participant id.
                                 time:
                                     type: number
                                     description:
@@ -3118,41 +3267,11 @@ class MeetingZoomWebhookAPIView(APIView):
         ---
         """
         event_id = request.query_params.get("event")
+        if not event_id or not event_id.isdigit():
+            return Response({"attending": 0, "attended": 0, "officers": 0, "time": 0})
 
-        time_query = (
-            ZoomMeetingVisit.objects.filter(event__id=event_id, leave_time__isnull=False)
-            .annotate(time=ExpressionWrapper(F("leave_time") - F("join_time"), DurationField()))
-            .order_by("time")
-        )
-        time_index = time_query.count()
-        if time_index > 0:
-            time_index //= 2
-            median_time = time_query[time_index].time
-        else:
-            median_time = 0
-
-        return Response(
-            {
-                "attending": ZoomMeetingVisit.objects.filter(
-                    event__id=event_id, leave_time__isnull=True
-                ).count(),
-                "attended": ZoomMeetingVisit.objects.filter(
-                    event__id=event_id, leave_time__isnull=False
-                )
-                .values("person")
-                .distinct()
-                .count(),
-                "officers": ZoomMeetingVisit.objects.filter(
-                    event__id=event_id,
-                    leave_time__isnull=True,
-                    person=F("event__club__membership__person"),
-                )
-                .values("person")
-                .distinct()
-                .count(),
-                "time": median_time,
-            }
-        )
+        event_id = int(event_id)
+        return Response(format_live_stats(get_live_stats([event_id])[event_id]))
 
     def post(self, request):
         # security check to make sure request contains zoom provided token
@@ -3165,7 +3284,7 @@ class MeetingZoomWebhookAPIView(APIView):
                 )
 
         action = request.data.get("event")
-        event_id = None
+        stats = None
         if action == "meeting.participant_joined":
             email = (
                 request.data.get("payload", {})
@@ -3174,15 +3293,10 @@ class MeetingZoomWebhookAPIView(APIView):
                 .get("email", None)
             )
 
-            if email:
-                username = email.split("@")[0]
-                person = get_user_model().objects.filter(username=username).first()
-            else:
-                person = None
+            person_id = get_zoom_participant_user_id(email) if email else None
 
             meeting_id = request.data.get("payload", {}).get("object", {}).get("id", None)
-            regex = rf"https?:\/\/([A-z]*.)?zoom.us/[^\/]*\/{meeting_id}(\?pwd=[A-z,0-9]*)?"
-            event = Event.objects.filter(url__regex=regex).first()
+            event = Event.objects.filter(zoom_meeting_id=str(meeting_id)).first()
 
             participant_id = (
                 request.data.get("payload", {})
@@ -3198,14 +3312,14 @@ class MeetingZoomWebhookAPIView(APIView):
             )
 
             if event:
-                ZoomMeetingVisit.objects.create(
-                    person=person,
+                visit = ZoomMeetingVisit.objects.create(
+                    person_id=person_id,
                     event=event,
                     meeting_id=meeting_id,
                     participant_id=participant_id,
                     join_time=join_time,
                 )
-                event_id = event.id
+                stats = record_visit(visit, joined=True)
         elif action == "meeting.participant_left":
             meeting_id = request.data.get("payload", {}).get("object", {}).get("id", None)
             participant_id = (
@@ -3221,23 +3335,26 @@ class MeetingZoomWebhookAPIView(APIView):
                 .get("leave_time", None)
             )
 
-            meeting = (
+            visit = (
                 ZoomMeetingVisit.objects.filter(
                     meeting_id=meeting_id, participant_id=participant_id, leave_time__isnull=True
                 )
+                .select_related("event")
                 .order_by("-created_at")
                 .first()
             )
-            if meeting is not None:
-                meeting.leave_time = leave_time
-                meeting.save()
-                event_id = meeting.event.id
+            if visit is not None:
+                visit.leave_time = leave_time
+                visit.save()
+                stats = record_visit(visit, joined=False)
 
-        if event_id is not None:
+        # push the new statistics so that clients do not need to fetch them again
+        if stats is not None:
             channel_layer = get_channel_layer()
             if channel_layer is not None:
                 async_to_sync(channel_layer.group_send)(
-                    f"events-live-{event_id}", {"type": "join_leave", "event": action}
+                    f"events-live-{visit.event_id}",
+                    {"type": "join_leave", "event": action, "stats": format_live_stats(stats)},
                 )
 
         return Response({"success": True})
@@ -3721,14 +3838,18 @@ class MemberInviteViewSet(viewsets.ModelViewSet):
         ---
         """
         invite = self.get_object()
-        invite.send_mail(request)
+        with outbox_mail():
+            invite.send_mail(request)
         invite.updated_at = timezone.now()
         invite.save(update_fields=["updated_at"])
 
         return Response({"detail": "Resent email invitation to {}!".format(invite.email)})
 
     def get_queryset(self):
-        return MembershipInvite.objects.filter(club__code=self.kwargs["club_code"], active=True)
+        latest_email = OutboxEmail.objects.filter(invite=OuterRef("pk")).order_by("-created_at")
+        return MembershipInvite.objects.filter(
+            club__code=self.kwargs["club_code"], active=True
+        ).annotate(email_status=Subquery(latest_email.values("status")[:1]))
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -3785,6 +3906,9 @@ class ClubApplicationViewSet(viewsets.ModelViewSet):
 class MassInviteAPIView(APIView):
     """
     Send out invites and add invite objects given a list of comma or newline separated emails.
+
+    The invite emails are queued in the outbox and delivered by "./manage.py send_outbox",
+    so the "sent" count in the response is the number of invite emails that were queued.
     """
 
     permission_classes = [IsAuthenticated]
@@ -3849,15 +3973,16 @@ class MassInviteAPIView(APIView):
                 {"detail": "The email address '{}' is not valid!".format(email), "success": False}
             )
 
-        # send invites to all emails
-        for email in emails:
-            invite = MembershipInvite.objects.create(
-                email=email, club=club, creator=request.user, role=role, title=title
-            )
-            if role <= Membership.ROLE_OWNER and not mem:
-                invite.send_owner_invite(request)
-            else:
-                invite.send_mail(request)
+        # create invites for all emails, the invite emails are sent by the outbox worker
+        with transaction.atomic(), outbox_mail():
+            for email in emails:
+                invite = MembershipInvite.objects.create(
+                    email=email, club=club, creator=request.user, role=role, title=title
+                )
+                if role <= Membership.ROLE_OWNER and not mem:
+                    invite.send_owner_invite(request)
+                else:
+                    invite.send_mail(request)
 
         sent_emails = len(emails)
         skipped_emails = original_count - len(emails)
@@ -4159,9 +4284,7 @@ def email_preview(request):
     """
     Debug endpoint used for previewing how email templates will look.
     """
-    prefix = "fyh_emails" if settings.BRANDING == "fyh" else "emails"
-    email_templates = os.listdir(os.path.join(settings.BASE_DIR, "templates", prefix))
-    email_templates = [e.rsplit(".", 1)[0] for e in email_templates if e.endswith(".html")]
+    email_templates = get_email_template_names()
 
     email = None
     text_email = None
@@ -4171,16 +4294,16 @@ def email_preview(request):
         email_path = os.path.basename(request.GET.get("email"))
 
         # initial values
-        types = get_mail_type_annotation(email_path)
-        if types is not None:
-            initial_context = get_initial_context_from_types(types)
+        template = get_email_template(email_path)
+        if template.types is not None:
+            initial_context = get_initial_context_from_types(template.types)
 
         # set specified values
         variables = request.GET.get("variables")
         if variables is not None:
             initial_context.update(json.loads(variables))
 
-        email = render_to_string(f"{prefix}/{email_path}.html", initial_context)
+        _, email = template.render(initial_context)
         text_email = html_to_text(email)
 
     return render(
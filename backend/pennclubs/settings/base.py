@@ -173,6 +173,10 @@ FROM_EMAIL = (
     else f"Penn Clubs <{BRANDING_SITE_EMAIL}>"
 )
 EMAIL_SUBJECT_PREFIX = f"[{BRANDING_SITE_NAME}] "
+
+# Batched email sending, see clubs.mail.MailDispatcher
+EMAIL_BATCH_SIZE = 100
+EMAIL_RATE_LIMIT = None  # maximum number of emails sent per second, or None for no limit
 INVITE_URL = "https://{domain}/invite/{club}/{id}/{token}"
 DEFAULT_DOMAIN = "hub.provost.upenn.edu" if BRANDING == "fyh" else "pennclubs.com"
 DOMAIN = os.environ.get("DOMAIN", DEFAULT_DOMAIN)
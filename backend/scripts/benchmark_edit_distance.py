@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Compares the performance of the edit distance routine used for club name matching against the
+# original pure Python dynamic programming implementation.
+# Uses a randomly generated corpus of realistic club names and prints the timings to stdout.
+# Run this from the backend folder with "python scripts/benchmark_edit_distance.py".
+
+import os
+import random
+import sys
+import time
+
+
+PREFIXES = ["Penn", "UPenn", "Wharton", "The", "Penn Undergraduate", "Graduate", "Penn Student"]
+SUBJECTS = [
+    "African",
+    "Asian American",
+    "Chess",
+    "Chinese",
+    "Dance",
+    "Debate",
+    "Dental",
+    "Economics",
+    "Engineering",
+    "Entrepreneurship",
+    "Film",
+    "Finance",
+    "Italian",
+    "Korean",
+    "Law",
+    "Medical",
+    "Music",
+    "Photography",
+    "Quizbowl",
+    "Robotics",
+    "Sailing",
+    "Theatre",
+    "Volunteers",
+    "Women in Computer Science",
+]
+SUFFIXES = ["Club", "Society", "Association", "Students Association", "Collective", "Team"]
+
+
+def original_min_edit(s1, s2):
+    """
+    The original implementation of the Levenshtein distance, used as the baseline.
+    """
+    if len(s1) > len(s2):
+        s1, s2 = s2, s1
+    distances = range(len(s1) + 1)
+    for index2, char2 in enumerate(s2):
+        newDistances = [index2 + 1]
+        for index1, char1 in enumerate(s1):
+            if char1 == char2:
+                newDistances.append(distances[index1])
+            else:
+                newDistances.append(
+                    1 + min((distances[index1], distances[index1 + 1], newDistances[-1]))
+                )
+        distances = newDistances
+    return distances[-1]
+
+
+def generate_names(rng, count):
+    names = set()
+    while len(names) < count:
+        parts = [rng.choice(SUBJECTS), rng.choice(SUFFIXES)]
+        if rng.random() < 0.6:
+            parts.insert(0, rng.choice(PREFIXES))
+        if rng.random() < 0.2:
+            parts.append(f"({rng.choice(SUBJECTS)[:3].upper()})")
+        names.add(" ".join(parts).lower())
+    return sorted(names)
+
+
+def mutate(rng, name):
+    chars = list(name)
+    for _ in range(rng.randint(0, 3)):
+        index = rng.randrange(len(chars))
+        operation = rng.choice(["insert", "delete", "replace"])
+        if operation == "insert":
+            chars.insert(index, rng.choice("abcdefghijklmnopqrstuvwxyz "))
+        elif operation == "delete" and len(chars) > 1:
+            del chars[index]
+        else:
+            chars[index] = rng.choice("abcdefghijklmnopqrstuvwxyz ")
+    return "".join(chars)
+
+
+def benchmark(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:>8.3f}s")
+    return result, elapsed
+
+
+def main():
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    from clubs.utils import edit_distances
+
+    rng = random.Random(1234)
+    corpus = generate_names(rng, 1000)
+    queries = [mutate(rng, rng.choice(corpus)) for _ in range(20)]
+    print(f"Scoring {len(queries)} queries against {len(corpus)} club names.\n")
+
+    baseline, baseline_time = benchmark(
+        "original min_edit",
+        lambda: [[original_min_edit(c, q) for c in corpus] for q in queries],
+    )
+    exact, exact_time = benchmark(
+        "edit_distances", lambda: [edit_distances(q, corpus) for q in queries]
+    )
+    bounded, bounded_time = benchmark(
+        "edit_distances (max_distance=2)",
+        lambda: [edit_distances(q, corpus, max_distance=2) for q in queries],
+    )
+
+    # ensure that the results are the same
+    assert baseline == exact
+    assert [[d if d <= 2 else 3 for d in row] for row in baseline] == bounded
+
+    print(f"\nSpeedup without cutoff: {baseline_time / exact_time:.1f}x")
+    print(f"Speedup with cutoff: {baseline_time / bounded_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# Measures the latency of the calendar week view on a large events table.
+# Creates a temporary test database with 100,000 events spread across two years, then times the
+# events endpoint with and without the event time indexes and prints the query plans.
+# Exits with a non-zero status if the week view is slower than the target latency.
+# Run this from the backend folder with "python scripts/benchmark_event_queries.py".
+# Set DATABASE_URL to benchmark against a PostgreSQL server instead of SQLite.
+
+import datetime
+import os
+import random
+import statistics
+import sys
+import time
+
+
+NUM_CLUBS = 1000
+NUM_EVENTS = 100000
+REPEAT = 10
+
+# target latency for the week view query, in milliseconds
+TARGET_MS = 100
+
+
+def populate(rng, now):
+    from clubs.models import Club, Event
+
+    Club.objects.bulk_create(
+        [
+            Club(
+                code=f"club-{i}",
+                name=f"Club #{i}",
+                approved=rng.random() < 0.8 or None,
+                ghost=rng.random() < 0.05,
+            )
+            for i in range(NUM_CLUBS)
+        ],
+        batch_size=1000,
+    )
+    club_ids = list(Club.objects.values_list("id", flat=True))
+
+    events = []
+    for i in range(NUM_EVENTS):
+        start = now + datetime.timedelta(minutes=rng.randrange(-365 * 24 * 60, 365 * 24 * 60))
+        events.append(
+            Event(
+                code=f"event-{i}",
+                name=f"Event #{i}",
+                club_id=rng.choice(club_ids) if rng.random() < 0.98 else None,
+                type=rng.choice([Event.OTHER, Event.GBM, Event.SOCIAL, Event.FAIR]),
+                start_time=start,
+                end_time=start + datetime.timedelta(minutes=rng.choice([30, 60, 90, 120])),
+            )
+        )
+    Event.objects.bulk_create(events, batch_size=1000)
+
+
+def get_week_queryset(start, end):
+    from clubs.views import EventViewSet
+
+    class FakeRequest:
+        query_params = {}
+
+    view = EventViewSet(kwargs={}, request=FakeRequest())
+    return view.get_queryset().filter(start_time__gte=start, end_time__lte=end)
+
+
+def measure(func):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def benchmark(label, client, start, end):
+    queryset = get_week_queryset(start, end)
+    count = queryset.count()
+    query_ms = measure(lambda: list(queryset.values_list("id", flat=True)))
+    params = {"start_time__gte": start.isoformat(), "end_time__lte": end.isoformat()}
+    request_ms = measure(lambda: client.get("/api/events/", params))
+
+    print(f"{label}:")
+    print(f"  events in week: {count}")
+    print(f"  week view query: {query_ms:.1f} ms (median of {REPEAT})")
+    print(f"  week view request: {request_ms:.1f} ms (median of {REPEAT})")
+    print("  query plan:")
+    for line in queryset.values_list("id", flat=True).explain().split("\n"):
+        print(f"    {line}")
+    print()
+    return query_ms
+
+
+def main():
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pennclubs.settings.development")
+
+    import django
+
+    django.setup()
+
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    from django.utils import timezone
+
+    from clubs.models import Event
+
+    setup_test_environment()
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        rng = random.Random(1234)
+        now = timezone.now()
+        print(f"Creating {NUM_EVENTS} events for {NUM_CLUBS} clubs on {connection.vendor}.\n")
+        populate(rng, now)
+
+        client = Client()
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = start + datetime.timedelta(days=7)
+
+        indexes = Event._meta.indexes
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.remove_index(Event, index)
+        benchmark("Without event time indexes", client, start, end)
+
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.add_index(Event, index)
+        query_ms = benchmark("With event time indexes", client, start, end)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    if query_ms > TARGET_MS:
+        print(f"Week view query took {query_ms:.1f} ms, over the target of {TARGET_MS} ms!")
+        sys.exit(1)
+    print(f"Week view query took {query_ms:.1f} ms, under the target of {TARGET_MS} ms.")
+
+
+if __name__ == "__main__":
+    main()
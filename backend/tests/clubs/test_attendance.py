@@ -0,0 +1,62 @@
+"""
+Test cases related to the live attendance statistics in the clubs attendance.py.
+"""
+
+import random
+
+from django.test import TestCase
+
+from clubs.attendance import DurationHistogram
+
+
+class DurationHistogramTestCase(TestCase):
+    def test_empty_histogram(self):
+        histogram = DurationHistogram()
+        self.assertEqual(histogram.percentile(50), 0)
+        self.assertEqual(histogram.get_percentiles(), {25: 0, 50: 0, 75: 0, 90: 0})
+
+    def test_exact_percentiles(self):
+        """
+        Durations that do not share a bucket with other durations are reported exactly,
+        using the same median as sorting the durations and indexing into the middle.
+        """
+        histogram = DurationHistogram()
+        for seconds in [0, 60, 120, 180, 240]:
+            histogram.add(seconds)
+        self.assertEqual(histogram.percentile(50), 120)
+        self.assertEqual(histogram.percentile(0), 0)
+        self.assertEqual(histogram.percentile(100), 240)
+
+        histogram.add(300)
+        self.assertEqual(histogram.percentile(50), 180)
+
+    def test_merge(self):
+        first = DurationHistogram()
+        second = DurationHistogram()
+        for seconds in range(0, 3600, 7):
+            (first if seconds % 2 else second).add(seconds)
+
+        combined = DurationHistogram()
+        for seconds in range(0, 3600, 7):
+            combined.add(seconds)
+
+        first.merge(second)
+        self.assertEqual(first.counts, combined.counts)
+        self.assertEqual(first.get_percentiles(), combined.get_percentiles())
+
+    def test_percentile_error(self):
+        """
+        Estimated percentiles are within the bucket growth factor of the actual percentiles.
+        """
+        rng = random.Random(1234)
+        durations = [round(rng.expovariate(1 / 600)) for _ in range(5000)]
+        histogram = DurationHistogram()
+        for seconds in durations:
+            histogram.add(seconds)
+
+        durations.sort()
+        for percent in [10, 25, 50, 75, 90, 99]:
+            actual = durations[len(durations) * percent // 100]
+            estimate = histogram.percentile(percent)
+            self.assertLessEqual(estimate, actual * DurationHistogram.GROWTH)
+            self.assertGreaterEqual(estimate, actual / DurationHistogram.GROWTH)
@@ -3,12 +3,17 @@ Test management commands that are under the clubs app here.
 These management commands can be executed with "./manage.py <command>".
 """
 
+import collections
 import csv
 import datetime
 import io
 import os
+import smtplib
 import tempfile
+import threading
+import time
 import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import mock
 
 from django.conf import settings
@@ -17,11 +22,15 @@ from django.contrib.auth.models import Group
 from django.core import mail
 from django.core.management import call_command
 from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Count
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from ics import Calendar
 from ics import Event as ICSEvent
 
+from clubs.management.commands.import_calendar_events import CalendarFetcher, import_calendars
 from clubs.models import (
     Club,
     ClubApplication,
@@ -30,11 +39,12 @@ from clubs.models import (
     Favorite,
     Membership,
     MembershipInvite,
+    OutboxEmail,
     Subscribe,
     Tag,
     get_mail_type_annotation,
 )
-from clubs.utils import fuzzy_lookup_club
+from clubs.utils import ClubNameMatcher, fuzzy_lookup_club
 
 
 def mocked_requests_get(time):
@@ -42,11 +52,12 @@ def mocked_requests_get(time):
     Mock an ICS calendar http request with a single event, starting at the specified start time.
     """
 
-    def fake_request(url, *args):
+    def fake_request(url, *args, **kwargs):
         class MockResponse:
             def __init__(self, content, status_code):
                 self.text = str(content)
                 self.status_code = status_code
+                self.headers = {}
 
             def text(self):
                 return self.text
@@ -103,6 +114,66 @@ END:VCALENDAR
 """
 
 
+class CalendarServer:
+    """
+    A local HTTP server that serves ICS calendars with different failure modes.
+    """
+
+    def __init__(self):
+        self.requests = collections.Counter()
+        self.not_modified = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests[self.path] += 1
+
+                # give each calendar a different event uid
+                uid = uuid.uuid5(uuid.NAMESPACE_URL, self.path).hex[:8]
+                status, body = 200, SAMPLE_ICS.replace("20f78720", uid)
+                headers = {"Content-Type": "text/calendar"}
+                if self.path == "/etag.ics":
+                    headers["ETag"] = '"v1"'
+                    if self.headers.get("If-None-Match") == '"v1"':
+                        status, body = 304, ""
+                        server.not_modified += 1
+                elif self.path == "/flaky.ics" and server.requests[self.path] == 1:
+                    status = 503
+                elif self.path == "/missing.ics":
+                    status = 404
+                elif self.path == "/slow.ics":
+                    time.sleep(1)
+                elif self.path == "/broken.ics":
+                    body = "This is not a calendar."
+
+                try:
+                    self.send_response(status)
+                    for key, value in headers.items():
+                        self.send_header(key, value)
+                    self.end_headers()
+                    self.wfile.write(body.encode("utf-8"))
+                except (BrokenPipeError, ConnectionResetError):
+                    # client gave up waiting for a slow response
+                    pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_port}{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
 class ImportCalendarTestCase(TestCase):
     def setUp(self):
         self.club1 = Club.objects.create(
@@ -124,11 +195,150 @@ class ImportCalendarTestCase(TestCase):
 
         self.assertGreaterEqual(self.club1.events.count(), 25)
 
+    def test_import_calendar_server(self):
+        """
+        Test importing calendars concurrently from a local server with transient and permanent
+        failures.
+        """
+        paths = ["good", "flaky", "missing", "slow", "broken"]
+        with CalendarServer() as server:
+            clubs = [
+                Club.objects.create(
+                    code=path, name=f"Club {path}", ics_import_url=server.url(f"/{path}.ics")
+                )
+                for path in paths
+            ]
+            fetcher = CalendarFetcher(timeout=0.3, retries=1, backoff=0)
+            summary = import_calendars(clubs, fetcher=fetcher, workers=4)
+
+        rows = {row["club"]: row for row in summary}
+        self.assertEqual(set(rows), set(paths))
+
+        for path in ["good", "flaky"]:
+            self.assertTrue(rows[path]["fetched"])
+            self.assertEqual(rows[path]["status"], "updated")
+            self.assertEqual(rows[path]["events"], 1)
+            self.assertIsNone(rows[path]["error"])
+        self.assertEqual(rows["good"]["attempts"], 1)
+        self.assertEqual(rows["flaky"]["attempts"], 2)
+
+        # permanent errors are not retried
+        self.assertFalse(rows["missing"]["fetched"])
+        self.assertEqual(rows["missing"]["status"], "failed")
+        self.assertEqual(server.requests["/missing.ics"], 1)
+
+        # timeouts are retried
+        self.assertFalse(rows["slow"]["fetched"])
+        self.assertEqual(rows["slow"]["status"], "failed")
+        self.assertEqual(server.requests["/slow.ics"], 2)
+
+        # parse errors do not affect other clubs
+        self.assertTrue(rows["broken"]["fetched"])
+        self.assertEqual(rows["broken"]["status"], "failed")
+
+        for row in summary:
+            self.assertGreaterEqual(row["elapsed_ms"], 0)
+
+        self.assertEqual(
+            dict(Event.objects.values_list("club__code").annotate(count=Count("id"))),
+            {"good": 1, "flaky": 1},
+        )
+
+    def test_import_calendar_unchanged(self):
+        """
+        Test that calendars are not imported again if they have not changed.
+        """
+        with CalendarServer() as server:
+            clubs = [
+                Club.objects.create(
+                    code=path, name=f"Club {path}", ics_import_url=server.url(f"/{path}.ics")
+                )
+                for path in ["etag", "good"]
+            ]
+            fetcher = CalendarFetcher(timeout=1, retries=0, backoff=0)
+            summary = import_calendars(clubs, fetcher=fetcher)
+            self.assertEqual([row["status"] for row in summary], ["updated", "updated"])
+
+            clubs = Club.objects.filter(code__in=["etag", "good"]).order_by("code")
+            self.assertEqual(clubs[0].ics_import_etag, '"v1"')
+            self.assertEqual(len(clubs[1].ics_import_hash), 64)
+
+            # remove the events to ensure that nothing is imported again
+            Event.objects.all().delete()
+            with CaptureQueriesContext(connection) as context:
+                summary = import_calendars(clubs, fetcher=fetcher)
+
+        self.assertEqual([row["status"] for row in summary], ["unchanged", "unchanged"])
+        self.assertEqual(server.not_modified, 1)
+        self.assertEqual([row["fetched"] for row in summary], [True, True])
+        self.assertFalse(Event.objects.exists())
+        self.assertFalse(
+            any("clubs_event" in query["sql"] for query in context.captured_queries),
+            context.captured_queries,
+        )
+
+        # a changed calendar is imported again
+        Club.objects.filter(code="good").update(ics_import_hash="")
+        with CalendarServer() as server:
+            Club.objects.filter(code="good").update(ics_import_url=server.url("/good.ics"))
+            summary = import_calendars(Club.objects.filter(code="good"), fetcher=fetcher)
+
+        self.assertEqual(summary[0]["status"], "updated")
+        self.assertEqual(Event.objects.filter(club__code="good").count(), 1)
+
+    def test_import_calendar_queries(self):
+        """
+        Test that importing a calendar uses a constant number of queries and only writes the
+        events that have changed.
+        """
+        now = timezone.now().replace(microsecond=0)
+        cal = Calendar()
+        for i in range(30):
+            event = ICSEvent()
+            event.name = f"Event #{i}"
+            event.description = "A test description"
+            event.begin = now + datetime.timedelta(days=i)
+            event.end = now + datetime.timedelta(days=i, hours=1)
+            event.uid = str(uuid.uuid4())
+            cal.events.add(event)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.club1.add_ics_events(str(cal)), 30)
+        self.assertLessEqual(len(context.captured_queries), 10)
+        self.assertEqual(self.club1.events.count(), 30)
+
+        # importing the same calendar again does not write anything
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.club1.add_ics_events(str(cal)), 30)
+        self.assertFalse(
+            any(
+                query["sql"].startswith(("INSERT", "UPDATE", "DELETE"))
+                for query in context.captured_queries
+            ),
+            context.captured_queries,
+        )
+
+        # only the changed event is updated
+        event = next(iter(cal.events))
+        event.name = "Renamed Event"
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.club1.add_ics_events(str(cal)), 30)
+        updates = [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith('UPDATE "clubs_event"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertTrue(self.club1.events.filter(name="Renamed Event").exists())
+        self.assertEqual(self.club1.events.count(), 30)
+
     def test_import_nonstandard_ics(self):
         """
         Test importing a random nonstandard ICS file from a file downloaded from the internet.
         """
-        with mock.patch("requests.get", return_value=mock.Mock(text=SAMPLE_ICS, status_code=200)):
+        with mock.patch(
+            "requests.get", return_value=mock.Mock(text=SAMPLE_ICS, status_code=200, headers={})
+        ):
             call_command("import_calendar_events")
 
         ev = self.club1.events.first()
@@ -145,7 +355,7 @@ class ImportCalendarTestCase(TestCase):
         with mock.patch("requests.get", side_effect=mocked_requests_get(now)) as m:
             call_command("import_calendar_events")
 
-            m.assert_called_with(self.club1.ics_import_url)
+            m.assert_called_with(self.club1.ics_import_url, timeout=mock.ANY, headers=mock.ANY)
 
         desired = self.club1.events.first()
 
@@ -164,7 +374,7 @@ class ImportCalendarTestCase(TestCase):
         with mock.patch("requests.get", side_effect=mocked_requests_get(now)) as m:
             call_command("import_calendar_events")
 
-            m.assert_called_with(self.club1.ics_import_url)
+            m.assert_called_with(self.club1.ics_import_url, timeout=mock.ANY, headers=mock.ANY)
 
         # ensure that only one event exists
         self.assertEqual(self.club1.events.count(), 1)
@@ -176,7 +386,7 @@ class ImportCalendarTestCase(TestCase):
         with mock.patch("requests.get", side_effect=mocked_requests_get(now)) as m:
             call_command("import_calendar_events")
 
-            m.assert_called_with(self.club1.ics_import_url)
+            m.assert_called_with(self.club1.ics_import_url, timeout=mock.ANY, headers=mock.ANY)
 
         # ensure that only one event exists
         self.assertEqual(self.club1.events.count(), 1)
@@ -427,6 +637,119 @@ class SendInvitesTestCase(TestCase):
         Club.objects.create(code="dental-6", name="Penn-In Face")
         self.assertEqual(fuzzy_lookup_club("Penn In-Face").code, "dental-6")
 
+        # batch lookups should give the same results as the query based individual lookups
+        expected = {
+            "league of legends": "league",
+            "Penn Counterparts": "counterparts",
+            "PASA - Penn African Students Association": "pasa",
+            "Korean Students Dental Association": None,
+            "Arab Student Dental Society": None,
+            "Chinese Christian Fellowship": None,
+            subtitle: "dental-4",
+            "Penn-In-Hand": "dental-5",
+            "Penn In-Face": "dental-6",
+            "": None,
+        }
+        matcher = ClubNameMatcher()
+        for lookup in [matcher.lookup_many, lambda names: map(fuzzy_lookup_club, names)]:
+            codes = [club and club.code for club in lookup(list(expected))]
+            self.assertEqual(codes, list(expected.values()))
+        self.assertIn(matcher.lookup("italian").code, ["italian-1", "italian-2", "italian-3"])
+
+        # newly added clubs should be found by the matcher
+        self.assertIsNone(matcher.lookup("Penn Quizbowl"))
+        matcher.add(Club.objects.create(code="quizbowl", name="Penn Quizbowl"))
+        self.assertEqual(matcher.lookup("Penn Quizbowl").code, "quizbowl")
+
+
+class SendOutboxTestCase(TestCase):
+    def setUp(self):
+        self.emails = [
+            OutboxEmail.objects.create(
+                template="test",
+                subject=f"Subject {i}",
+                recipients=f"user{i}@example.com",
+                html_content=f"<p>Email {i}</p>",
+            )
+            for i in range(3)
+        ]
+
+    def test_send_outbox(self):
+        OutboxEmail.objects.filter(id=self.emails[2].id).update(
+            send_after=timezone.now() + datetime.timedelta(hours=1)
+        )
+        call_command("send_outbox", stdout=io.StringIO())
+
+        self.assertEqual(
+            [m.to for m in mail.outbox], [["user0@example.com"], ["user1@example.com"]]
+        )
+        self.assertEqual(mail.outbox[0].subject, "Subject 0")
+        self.assertEqual(mail.outbox[0].alternatives, [("<p>Email 0</p>", "text/html")])
+
+        statuses = dict(OutboxEmail.objects.values_list("id", "status"))
+        self.assertEqual(statuses[self.emails[0].id], OutboxEmail.SENT)
+        self.assertEqual(statuses[self.emails[1].id], OutboxEmail.SENT)
+        self.assertEqual(statuses[self.emails[2].id], OutboxEmail.PENDING)
+
+        # sent emails are not sent again
+        call_command("send_outbox", stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_send_outbox_errors(self):
+        """
+        Transient errors are retried later with backoff, permanent errors are marked as failed.
+        """
+        errors = {
+            "user0@example.com": smtplib.SMTPResponseException(451, b"Try again later"),
+            "user1@example.com": smtplib.SMTPRecipientsRefused(
+                {"user1@example.com": (550, b"No such user")}
+            ),
+        }
+
+        tried = []
+
+        def send_messages(messages):
+            for message in messages:
+                tried.append(message.to[0])
+                if message.to[0] in errors:
+                    raise errors[message.to[0]]
+                mail.outbox.append(message)
+            return len(messages)
+
+        stdout = io.StringIO()
+        with mock.patch("clubs.mail.get_connection") as connect, mock.patch(
+            "clubs.mail.time.sleep"
+        ) as sleep:
+            connect.return_value.send_messages.side_effect = send_messages
+            call_command("send_outbox", "--max-attempts=2", stdout=stdout)
+
+            # each email is only tried once per run, without waiting while the rows are locked
+            self.assertEqual(tried.count("user0@example.com"), 1)
+            sleep.assert_not_called()
+
+            self.assertIn(
+                "Sent 1 emails from the outbox! (1 to retry, 1 failed)", stdout.getvalue()
+            )
+            self.assertEqual([m.to for m in mail.outbox], [["user2@example.com"]])
+
+            retry = OutboxEmail.objects.get(id=self.emails[0].id)
+            self.assertEqual(retry.status, OutboxEmail.PENDING)
+            self.assertEqual(retry.attempts, 1)
+            self.assertIn("Try again later", retry.error)
+            self.assertGreater(retry.send_after, timezone.now())
+
+            failed = OutboxEmail.objects.get(id=self.emails[1].id)
+            self.assertEqual(failed.status, OutboxEmail.FAILED)
+            self.assertEqual(failed.attempts, 1)
+
+            # the email is retried once it is ready, and fails after reaching the maximum attempts
+            OutboxEmail.objects.filter(id=retry.id).update(send_after=timezone.now())
+            call_command("send_outbox", "--max-attempts=2", stdout=io.StringIO())
+
+        retry.refresh_from_db()
+        self.assertEqual(retry.status, OutboxEmail.FAILED)
+        self.assertEqual(retry.attempts, 2)
+
 
 class SendReminderTestCase(TestCase):
     def setUp(self):
@@ -515,6 +838,71 @@ class RankTestCase(TestCase):
         for club in Club.objects.all():
             self.assertGreater(club.rank, 0)
 
+    def test_rank_query_count(self):
+        """
+        Ensure that the number of queries used for ranking does not depend on the number of clubs.
+        """
+        tag = Tag.objects.create(name="Undergraduate")
+        now = timezone.now()
+
+        def add_clubs(start, end):
+            for i in range(start, end):
+                club = Club.objects.create(code=f"club-{i}", name=f"Test Club #{i}", active=True)
+                club.tags.add(tag)
+                Event.objects.create(
+                    code=f"test-event-{i}",
+                    name=f"Test Event {i}",
+                    club=club,
+                    start_time=now,
+                    end_time=now + datetime.timedelta(hours=2),
+                )
+
+        add_clubs(0, 5)
+        with CaptureQueriesContext(connection) as small:
+            call_command("rank", stdout=io.StringIO())
+
+        add_clubs(5, 50)
+        with CaptureQueriesContext(connection) as large:
+            call_command("rank", stdout=io.StringIO())
+
+        self.assertEqual(len(small), len(large))
+        for club in Club.objects.all():
+            self.assertIsNotNone(club.rank)
+
+    def test_rank_dirty(self):
+        """
+        Ensure that changes to related objects mark clubs as dirty and that only dirty clubs are
+        reranked when the dirty flag is passed.
+        """
+        user = get_user_model().objects.create_user("bfranklin", "bfranklin@upenn.edu", "test")
+        tag = Tag.objects.create(name="Undergraduate")
+        club1 = Club.objects.create(code="club-1", name="Test Club #1", active=True)
+        club2 = Club.objects.create(code="club-2", name="Test Club #2", active=True)
+
+        call_command("rank", stdout=io.StringIO())
+        self.assertFalse(Club.objects.filter(rank_dirty=True).exists())
+        Club.objects.update(rank=-1)
+
+        # changes to related objects should mark the club as dirty
+        Favorite.objects.create(person=user, club=club1)
+        club1.refresh_from_db()
+        club2.refresh_from_db()
+        self.assertTrue(club1.rank_dirty)
+        self.assertFalse(club2.rank_dirty)
+
+        tag.club_set.add(club2)
+        club2.refresh_from_db()
+        self.assertTrue(club2.rank_dirty)
+
+        # only dirty clubs should be reranked
+        Club.objects.filter(pk=club2.pk).update(rank_dirty=False)
+        call_command("rank", "--dirty", stdout=io.StringIO())
+        club1.refresh_from_db()
+        club2.refresh_from_db()
+        self.assertNotEqual(club1.rank, -1)
+        self.assertFalse(club1.rank_dirty)
+        self.assertEqual(club2.rank, -1)
+
 
 class RenewalTestCase(TestCase):
     def test_renewal(self):
@@ -0,0 +1,195 @@
+"""
+Test cases related to rendering emails and sending them in batches with the clubs mail.py.
+"""
+
+import io
+import smtplib
+from unittest.mock import patch
+
+from django.core import mail
+from django.core.mail import EmailMessage, get_connection
+from django.template import engines
+from django.test import TestCase
+
+from clubs.mail import (
+    MailDispatcher,
+    MailDispatchError,
+    batch_mail,
+    dispatch_mail,
+    get_email_template,
+    get_email_template_names,
+)
+
+
+class FlakyConnection:
+    """
+    An email backend stand-in that fails to send each message a fixed number of times.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.opened = 0
+        self.sent = []
+
+    def open(self):
+        self.opened += 1
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        for message in messages:
+            errors = self.errors.get(message.to[0], [])
+            if errors:
+                raise errors.pop(0)
+            self.sent.append(message)
+        return len(messages)
+
+
+def make_messages(count):
+    return [
+        EmailMessage(f"Subject {i}", "Body", "from@example.com", [f"user{i}@example.com"])
+        for i in range(count)
+    ]
+
+
+class MailDispatcherTestCase(TestCase):
+    def test_dispatch_without_batch(self):
+        for message in make_messages(2):
+            dispatch_mail(message)
+            self.assertEqual(mail.outbox[-1], message)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_batch_mail(self):
+        """
+        Emails inside of a batch are sent over one connection per batch when the batch fills up
+        or when the context exits.
+        """
+        connections = []
+
+        def connect(*args, **kwargs):
+            connection = get_connection(*args, **kwargs)
+            connections.append(connection)
+            return connection
+
+        stdout = io.StringIO()
+        with patch("clubs.mail.get_connection", side_effect=connect):
+            with batch_mail(batch_size=2, stdout=stdout) as dispatcher:
+                for message in make_messages(5):
+                    dispatch_mail(message)
+
+                # nested batches share the outer dispatcher
+                with batch_mail() as inner:
+                    self.assertIs(inner, dispatcher)
+
+                self.assertEqual(len(mail.outbox), 4)
+
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(len(connections), 3)
+        self.assertEqual([batch["sent"] for batch in dispatcher.batches], [2, 2, 1])
+        self.assertEqual(dispatcher.sent, 5)
+        self.assertEqual(stdout.getvalue().count("Sent batch of"), 3)
+
+    def test_retry_transient_errors(self):
+        connection = FlakyConnection(
+            {
+                "user1@example.com": [
+                    smtplib.SMTPServerDisconnected("Connection unexpectedly closed"),
+                    smtplib.SMTPResponseException(421, b"Too many connections"),
+                ]
+            }
+        )
+        dispatcher = MailDispatcher(connection=connection, backoff=0)
+        for message in make_messages(3):
+            dispatcher.add(message)
+        dispatcher.flush()
+
+        self.assertEqual(
+            [m.to[0] for m in connection.sent], [f"user{i}@example.com" for i in range(3)]
+        )
+        self.assertEqual(connection.errors["user1@example.com"], [])
+        self.assertEqual(dispatcher.failed, [])
+        dispatcher.raise_for_failures()
+
+    def test_permanent_errors(self):
+        """
+        Permanent errors are not retried and do not stop the rest of the batch from being sent.
+        """
+        connection = FlakyConnection(
+            {
+                "user0@example.com": [
+                    smtplib.SMTPRecipientsRefused({"user0@example.com": (550, b"No such user")})
+                ],
+                "user1@example.com": [smtplib.SMTPResponseException(451, b"Try again later")] * 5,
+            }
+        )
+        with self.assertRaises(MailDispatchError):
+            with batch_mail(connection=connection, backoff=0, retries=2) as dispatcher:
+                for message in make_messages(3):
+                    dispatch_mail(message)
+
+        self.assertEqual([m.to[0] for m in connection.sent], ["user2@example.com"])
+        self.assertEqual(len(dispatcher.failed), 2)
+        self.assertEqual(len(connection.errors["user0@example.com"]), 0)
+        self.assertEqual(len(connection.errors["user1@example.com"]), 2)
+
+    def test_rate_limit(self):
+        with patch("clubs.mail.time.sleep") as sleep:
+            with batch_mail(rate_limit=10):
+                for message in make_messages(3):
+                    dispatch_mail(message)
+
+        self.assertEqual(len(mail.outbox), 3)
+
+        # the last email waits until two tenths of a second after the first one,
+        # sleep is mocked out so no time passes between sending the emails
+        self.assertEqual(sleep.call_count, 2)
+        self.assertAlmostEqual(sleep.call_args_list[-1].args[0], 0.2, places=2)
+
+
+class EmailTemplateTestCase(TestCase):
+    def test_template_annotations(self):
+        """
+        The subject and type annotations are extracted from the template source when it is
+        loaded and do not appear in the rendered email.
+        """
+        template = get_email_template("fair_info")
+        self.assertIn("fair_url", template.types)
+
+        subject, html = template.render({"prefix": "Penn Clubs", "fair": {"name": "SAC Fair"}})
+        self.assertEqual(subject, "[Penn Clubs] SAC Fair Setup and Information")
+        self.assertNotIn("SUBJECT:", html)
+        self.assertNotIn("TYPES:", html)
+        self.assertIn("SAC Fair", html)
+
+        subject, html = get_email_template("invite").render({"name": "Test Club"})
+        self.assertIsNone(subject)
+        self.assertIn("Test Club", html)
+
+    def test_template_cache(self):
+        """
+        Each template is only loaded once, even if it is rendered for many emails.
+        """
+        engine = engines["django"]
+        with patch.dict("clubs.mail._email_templates", clear=True), patch.object(
+            engine, "get_template", wraps=engine.get_template
+        ) as get_template:
+            for _ in range(3):
+                get_email_template("invite").render({"name": "Test Club"})
+            get_email_template("renew")
+        self.assertEqual(
+            [call.args[0] for call in get_template.call_args_list],
+            ["emails/invite.html", "emails/renew.html"],
+        )
+
+        for site, prefix in [("clubs", "emails"), ("fyh", "fyh_emails")]:
+            with self.settings(BRANDING=site):
+                for name in get_email_template_names():
+                    template = get_email_template(name)
+                    self.assertEqual(template.path, f"{prefix}/{name}.html")
+                    self.assertIs(get_email_template(name), template)
+
+        # templates are loaded again when debugging so that edits show up in previews
+        with self.settings(DEBUG=True):
+            template = get_email_template("invite")
+            self.assertIsNot(get_email_template("invite"), template)
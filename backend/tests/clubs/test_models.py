@@ -3,12 +3,28 @@ Test cases related to models and their fields in the clubs models.py.
 """
 
 import datetime
+import io
 
 import pytz
 from django.contrib.auth import get_user_model
-from django.test import TestCase
-
-from clubs.models import Advisor, Badge, Club, Event, Favorite, Membership, Note, Tag, Year
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from clubs.models import (
+    Advisor,
+    Badge,
+    Club,
+    Event,
+    Favorite,
+    Membership,
+    Note,
+    Tag,
+    Year,
+    get_club_ancestors,
+)
+from clubs.permissions import find_membership_helper
 
 
 class YearTestCase(TestCase):
@@ -43,6 +59,164 @@ class ClubTestCase(TestCase):
         self.assertEqual(self.club2.parent_orgs.first(), self.club1)
         self.assertEqual(self.club1.children_orgs.first(), self.club2)
 
+    def test_ancestors(self):
+        """
+        Ensure that the cached club hierarchy is updated when parent clubs change.
+        """
+        club3 = Club.objects.create(code="c", name="c")
+        self.assertEqual(get_club_ancestors(club3.pk), {club3.pk})
+        self.assertEqual(get_club_ancestors(self.club2.pk), {self.club1.pk, self.club2.pk})
+
+        # cycles should not cause issues
+        club3.parent_orgs.add(self.club2)
+        self.club1.parent_orgs.add(club3)
+        self.assertEqual(
+            get_club_ancestors(club3.pk), {self.club1.pk, self.club2.pk, club3.pk},
+        )
+
+        # membership lookups use the hierarchy
+        user = get_user_model().objects.create_user("bfranklin", "bfranklin@upenn.edu", "test")
+        membership = Membership.objects.create(
+            person=user, club=self.club1, role=Membership.ROLE_OFFICER
+        )
+        self.assertEqual(find_membership_helper(user, club3), membership)
+        with self.assertNumQueries(1):
+            find_membership_helper(user, club3)
+
+        self.club1.parent_orgs.remove(club3)
+        club3.parent_orgs.clear()
+        self.assertEqual(get_club_ancestors(club3.pk), {club3.pk})
+        self.assertIsNone(find_membership_helper(user, club3))
+
+    def test_counts(self):
+        """
+        Ensure that the cached favorite and membership counts are kept up to date.
+        """
+        user1 = get_user_model().objects.create_user("bfranklin", "bfranklin@upenn.edu", "test")
+        user2 = get_user_model().objects.create_user("tjefferson", "tjefferson@upenn.edu", "test")
+
+        favorite = Favorite.objects.create(person=user1, club=self.club1)
+        Favorite.objects.create(person=user2, club=self.club1)
+        membership = Membership.objects.create(person=user1, club=self.club1)
+        self.club1.refresh_from_db()
+        self.assertEqual(self.club1.favorite_count, 2)
+        self.assertEqual(self.club1.membership_count, 1)
+
+        # inactive memberships are not counted
+        membership.active = False
+        membership.save()
+        favorite.delete()
+        self.club1.refresh_from_db()
+        self.assertEqual(self.club1.favorite_count, 1)
+        self.assertEqual(self.club1.membership_count, 0)
+
+        # sync command repairs drifted counts
+        Club.objects.update(favorite_count=10, membership_count=10)
+        call_command("sync", stdout=io.StringIO())
+        self.club1.refresh_from_db()
+        self.club2.refresh_from_db()
+        self.assertEqual(self.club1.favorite_count, 1)
+        self.assertEqual(self.club1.membership_count, 0)
+        self.assertEqual(self.club2.favorite_count, 0)
+
+    def test_counts_outdated_save(self):
+        """
+        Ensure that saving a club instance loaded before a favorite or membership was added
+        does not overwrite the cached counts, and that saves still behave as usual otherwise.
+        """
+        user = get_user_model().objects.create_user("bfranklin", "bfranklin@upenn.edu", "test")
+        stale = Club.objects.get(pk=self.club1.pk)
+        other = Club.objects.get(pk=self.club1.pk)
+
+        # a favorite and a membership are added while the instances are being edited
+        Favorite.objects.create(person=user, club=self.club1)
+        Membership.objects.create(person=user, club=self.club1)
+
+        stale.name = "Renamed Club"
+        stale.save()
+        other.save(update_fields=["favorite_count", "membership_count"])
+        self.club1.refresh_from_db()
+        self.assertEqual(self.club1.name, "Renamed Club")
+        self.assertEqual(self.club1.favorite_count, 1)
+        self.assertEqual(self.club1.membership_count, 1)
+
+        # clubs can still be copied and saved again after being deleted
+        stale.pk = None
+        stale.code = "copied-club"
+        stale.save()
+        self.assertEqual(Club.objects.get(code="copied-club").favorite_count, 0)
+        Club.objects.filter(pk=stale.pk).delete()
+        stale.save()
+        self.assertTrue(Club.objects.filter(pk=stale.pk).exists())
+
+    def test_short_description(self):
+        """
+        Ensure that the short description is computed when the club description is saved.
+        """
+        self.club1.description = "<p>First sentence &amp; more. Second sentence.</p>"
+        self.club1.save()
+        self.club1.refresh_from_db()
+        self.assertEqual(self.club1.short_description, "First sentence & more.")
+
+        self.club1.description = "<b>Updated</b>! Description."
+        self.club1.save(update_fields=["description"])
+        self.club1.refresh_from_db()
+        self.assertEqual(self.club1.short_description, "Updated!")
+
+        # sync command fills in missing short descriptions without marking the clubs as updated
+        updated_at = timezone.now() - datetime.timedelta(days=1)
+        Club.objects.update(short_description="", updated_at=updated_at)
+        call_command("sync", stdout=io.StringIO())
+        self.club1.refresh_from_db()
+        self.club2.refresh_from_db()
+        self.assertEqual(self.club1.short_description, "Updated!")
+        self.assertEqual(self.club2.short_description, "b")
+        self.assertEqual(self.club1.updated_at, updated_at)
+
+
+class ClubHierarchyTransactionTestCase(TransactionTestCase):
+    def setUp(self):
+        self.parent = Club.objects.create(code="parent", name="Parent")
+        self.child = Club.objects.create(code="child", name="Child")
+        self.user = get_user_model().objects.create_user("bfranklin", "bfranklin@upenn.edu", "test")
+        self.membership = Membership.objects.create(
+            person=self.user, club=self.parent, role=Membership.ROLE_OWNER
+        )
+
+    def test_rollback(self):
+        """
+        Ensure that a hierarchy change from a transaction that was rolled back is not cached.
+        """
+        self.assertIsNone(find_membership_helper(self.user, self.child))
+
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.child.parent_orgs.add(self.parent)
+                self.assertEqual(get_club_ancestors(self.child.pk), {self.child.pk, self.parent.pk})
+                self.assertEqual(find_membership_helper(self.user, self.child), self.membership)
+                raise ValueError
+
+        self.assertEqual(get_club_ancestors(self.child.pk), {self.child.pk})
+        self.assertIsNone(find_membership_helper(self.user, self.child))
+
+        # rolling back a savepoint also discards the change
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    self.child.parent_orgs.add(self.parent)
+                    self.assertEqual(find_membership_helper(self.user, self.child), self.membership)
+                    raise ValueError
+            except ValueError:
+                pass
+            self.assertIsNone(find_membership_helper(self.user, self.child))
+
+    def test_commit(self):
+        self.assertEqual(get_club_ancestors(self.child.pk), {self.child.pk})
+        with transaction.atomic():
+            self.child.parent_orgs.add(self.parent)
+        self.assertEqual(get_club_ancestors(self.child.pk), {self.child.pk, self.parent.pk})
+        self.assertEqual(find_membership_helper(self.user, self.child), self.membership)
+
 
 class ProfileTestCase(TestCase):
     def test_profile_creation(self):
@@ -66,6 +240,45 @@ class EventTestCase(TestCase):
     def test_str(self):
         self.assertEqual(str(self.event), self.event.name)
 
+    def test_description_text(self):
+        """
+        Ensure that the plain text description is computed when the event description is saved.
+        """
+        self.assertEqual(self.event.description_text, "a")
+
+        self.event.description = '<p>Join us <a href="https://example.com">here</a>!</p>'
+        self.event.save()
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.description_text, "Join us at https://example.com!")
+
+        # sync command fills in missing plain text descriptions
+        Event.objects.update(description_text="")
+        call_command("sync", stdout=io.StringIO())
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.description_text, "Join us at https://example.com!")
+
+    def test_zoom_meeting_id(self):
+        """
+        Ensure that the Zoom meeting id is extracted when the event url is saved.
+        """
+        self.assertIsNone(self.event.zoom_meeting_id)
+
+        self.event.url = "https://upenn.zoom.us/j/123456789?pwd=abc"
+        self.event.save(update_fields=["url"])
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.zoom_meeting_id, "123456789")
+
+        self.event.url = "https://example.com/j/123456789"
+        self.event.save()
+        self.event.refresh_from_db()
+        self.assertIsNone(self.event.zoom_meeting_id)
+
+        # sync command fills in missing meeting ids
+        Event.objects.update(url="https://zoom.us/j/4880003126", zoom_meeting_id=None)
+        call_command("sync", stdout=io.StringIO())
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.zoom_meeting_id, "4880003126")
+
 
 class FavoriteTestCase(TestCase):
     def setUp(self):
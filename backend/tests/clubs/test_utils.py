@@ -0,0 +1,45 @@
+"""
+Test cases related to the helper functions in the clubs utils.py.
+"""
+
+from django.test import TestCase
+
+from clubs.utils import edit_distances, get_zoom_meeting_id, min_edit
+
+
+class EditDistanceTestCase(TestCase):
+    def test_min_edit(self):
+        self.assertEqual(min_edit("", ""), 0)
+        self.assertEqual(min_edit("", "club"), 4)
+        self.assertEqual(min_edit("club", ""), 4)
+        self.assertEqual(min_edit("kitten", "sitting"), 3)
+        self.assertEqual(min_edit("sitting", "kitten"), 3)
+        self.assertEqual(min_edit("penn chess club", "penn chess club"), 0)
+
+    def test_edit_distances(self):
+        candidates = ["penn chess club", "penn chess team", "chess", "penn chess clubs", ""]
+        self.assertEqual(
+            edit_distances("penn chess club", candidates),
+            [min_edit("penn chess club", c) for c in candidates],
+        )
+
+        # distances over the cutoff are reported as one more than the cutoff
+        self.assertEqual(
+            edit_distances("penn chess club", candidates, max_distance=2), [0, 3, 3, 1, 3]
+        )
+        self.assertEqual(edit_distances("", candidates, max_distance=4), [5, 5, 5, 5, 0])
+
+
+class ZoomMeetingIdTestCase(TestCase):
+    def test_get_zoom_meeting_id(self):
+        self.assertEqual(get_zoom_meeting_id("https://zoom.us/j/4880003126"), "4880003126")
+        self.assertEqual(
+            get_zoom_meeting_id("https://upenn.zoom.us/j/123456789?pwd=abc123"), "123456789"
+        )
+        self.assertEqual(get_zoom_meeting_id("http://UPenn.Zoom.us/s/123456789"), "123456789")
+        self.assertIsNone(get_zoom_meeting_id("https://zoom.us/"))
+        self.assertIsNone(get_zoom_meeting_id("https://notzoom.us/j/123456789"))
+        self.assertIsNone(get_zoom_meeting_id("https://zoom.us.example.com/j/123456789"))
+        self.assertIsNone(get_zoom_meeting_id("https://example.com/?q=https://zoom.us/j/1"))
+        self.assertIsNone(get_zoom_meeting_id(""))
+        self.assertIsNone(get_zoom_meeting_id(None))
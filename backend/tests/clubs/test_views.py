@@ -1,3 +1,4 @@
+import csv
 import datetime
 import io
 import json
@@ -5,15 +6,23 @@ import os
 from collections import Counter
 from unittest.mock import MagicMock, patch
 
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.core import mail
+from django.core.cache import cache
 from django.core.management import call_command
-from django.test import Client, TestCase
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.http import http_date
 from ics import Calendar
+from ics import Event as ICSEvent
+from openpyxl import load_workbook
 
 from clubs.filters import DEFAULT_PAGE_SIZE
 from clubs.models import (
@@ -26,12 +35,14 @@ from clubs.models import (
     Favorite,
     Membership,
     MembershipInvite,
+    OutboxEmail,
     QuestionAnswer,
     School,
     Tag,
     Testimonial,
     ZoomMeetingVisit,
 )
+from clubs.views import ClubViewSet, get_zoom_participant_user_id
 
 
 class SearchTestCase(TestCase):
@@ -59,6 +70,36 @@ class SearchTestCase(TestCase):
     def test_alphabetical_listing(self):
         self.perform_random_fetch(DEFAULT_PAGE_SIZE, ordering="name")
 
+    def test_random_listing_seed(self):
+        def fetch(seed):
+            resp = self.client.get(
+                reverse("clubs-list"), {"ordering": "random", "page": "1", "seed": seed}
+            )
+            self.assertIn(resp.status_code, [200, 201], resp.content)
+            return [club["code"] for club in resp.json()["results"]]
+
+        # same seed gives the same order, different seeds give different orders
+        first = fetch("1234")
+        self.assertEqual(len(first), DEFAULT_PAGE_SIZE)
+        self.assertEqual(first, fetch("1234"))
+        self.assertNotEqual(first, fetch("5678"))
+        self.assertNotEqual(first, sorted(first))
+
+    def test_random_listing_filtered_count(self):
+        for club in Club.objects.all():
+            club.save()
+
+        # count should reflect the filtered queryset
+        resp = self.client.get(
+            reverse("clubs-list"), {"ordering": "random", "page": "1", "search": "Club #1"}
+        )
+        self.assertIn(resp.status_code, [200, 201], resp.content)
+        data = resp.json()
+        codes = {f"club-{i}" for i in [1, *range(10, 20)]}
+        self.assertEqual(data["count"], len(codes))
+        self.assertIsNone(data["next"])
+        self.assertEqual({club["code"] for club in data["results"]}, codes)
+
     def perform_random_fetch(self, page_size, ordering="random"):
         # fetch clubs using specified ordering
         resp = self.client.get(
@@ -234,6 +275,43 @@ class ClubTestCase(TestCase):
         # ensure cleanup doesn't throw error
         self.club1.delete()
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_club_anonymous_cache(self):
+        """
+        Test that anonymous club responses are cached, invalidated on writes,
+        and can be revalidated using the ETag header.
+        """
+        cache.clear()
+
+        for url in [reverse("clubs-list"), reverse("clubs-detail", args=(self.club1.code,))]:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200, resp.content)
+            etag = resp["ETag"]
+
+            # matching etag results in not modified response
+            resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, 304, resp.content)
+            self.assertEqual(resp["ETag"], etag)
+
+            # writes should invalidate the cached response
+            self.club1.subtitle = "A brand new subtitle."
+            self.club1.save()
+            resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, 200, resp.content)
+            self.assertNotEqual(resp["ETag"], etag)
+            self.assertIn("A brand new subtitle.", resp.content.decode("utf-8"))
+
+            self.club1.subtitle = ""
+            self.club1.save()
+
+        # authenticated users do not use the cache
+        self.client.login(username=self.user5.username, password="test")
+        resp = self.client.get(reverse("clubs-list"))
+        self.assertEqual(resp.status_code, 200, resp.content)
+        self.assertFalse(resp.has_header("ETag"))
+
     def test_club_qr(self):
         """
         Test generating a club fair QR code image.
@@ -595,13 +673,97 @@ class ClubTestCase(TestCase):
             reverse("favorites-calendar", args=(self.user1.profile.uuid_secret,))
         )
 
-        self.assertIn(resp.status_code, [200, 201], resp.content)
+        self.assertIn(resp.status_code, [200, 201])
 
-        cal = Calendar(resp.content.decode("utf8"))
+        cal = Calendar(b"".join(resp.streaming_content).decode("utf8"))
         actual = [ev.name for ev in cal.events]
         expected = [f"Club #{k+1} - Test Event for #{k+1}" for k in range(4)]
         self.assertEqual(actual.sort(), expected.sort())
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_favorite_calendar_cache(self):
+        """
+        Test that the calendar feed reuses rendered events and supports conditional requests.
+        """
+        cache.clear()
+        Favorite.objects.create(person=self.user1, club=self.club1)
+        for i in range(3):
+            Event.objects.create(
+                code=f"calendar-event-{i}",
+                name=f"Calendar Event #{i}",
+                club=self.club1,
+                description=f"<p>Event <b>description</b> #{i}</p>",
+                start_time=timezone.now() + datetime.timedelta(days=i),
+                end_time=timezone.now() + datetime.timedelta(days=i, hours=1),
+            )
+        url = reverse("favorites-calendar", args=(self.user1.profile.uuid_secret,))
+        count = self.club1.events.filter(
+            start_time__gte=timezone.now() - datetime.timedelta(days=30)
+        ).count()
+
+        def fetch(**headers):
+            resp = self.client.get(url, **headers)
+            content = b"".join(getattr(resp, "streaming_content", [])).decode("utf-8")
+            return resp, content
+
+        resp, content = fetch()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(Calendar(content).events), count)
+        self.assertIn("Event description #0", content)
+        etag = resp["ETag"]
+        self.assertNotIn("Last-Modified", resp)
+
+        # rendered events are cached
+        with patch("clubs.views.render_ics_event") as render_ics_event:
+            resp, cached_content = fetch()
+            render_ics_event.assert_not_called()
+        self.assertEqual(cached_content, content)
+
+        # unchanged calendars are not sent again
+        resp, _ = fetch(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+        # new favorites with older events change the calendar
+        club = Club.objects.create(code="calendar-club", name="Calendar Club", approved=True)
+        Event.objects.create(
+            code="calendar-event-old",
+            name="Older Event",
+            club=club,
+            start_time=timezone.now() - datetime.timedelta(days=1),
+            end_time=timezone.now() - datetime.timedelta(days=1, hours=-1),
+        )
+        Event.objects.filter(code="calendar-event-old").update(
+            updated_at=timezone.now() - datetime.timedelta(days=7)
+        )
+        Favorite.objects.create(person=self.user1, club=club)
+        resp, content = fetch(HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Older Event", content)
+        Favorite.objects.filter(person=self.user1, club=club).delete()
+        resp, content = fetch(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+        # modified events are rendered again
+        event = Event.objects.get(code="calendar-event-1")
+        event.name = "Renamed Event"
+        event.save()
+        resp, content = fetch(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp["ETag"], etag)
+        self.assertIn("Renamed Event", content)
+        self.assertEqual(len(Calendar(content).events), count)
+
+        # filling in missing descriptions with the sync command renders the events again
+        Event.objects.update(description_text="")
+        cache.clear()
+        _, content = fetch()
+        self.assertNotIn("Event description #0", content)
+        call_command("sync", stdout=io.StringIO())
+        _, content = fetch()
+        self.assertIn("Event description #0", content)
+
     def test_retrieve_ics_url(self):
         """
         Test retrieving the ICS URL from the endpoint.
@@ -1221,6 +1383,50 @@ class ClubTestCase(TestCase):
         data = json.loads(resp.content.decode("utf-8"))
         self.assertTrue(data)
 
+    def test_club_lookup(self):
+        """
+        Test looking up club codes from a list of club names.
+        """
+        Club.objects.create(code="chess", name="Penn Chess Club")
+        resp = self.client.post(
+            reverse("clubs-lookup"),
+            {"clubs": "Test Club\nchess club\n\nNonexistent Organization\tTEST CLUB"},
+            content_type="application/json",
+        )
+        self.assertIn(resp.status_code, [200], resp.content)
+        self.assertEqual(
+            resp.json()["output"].split("\n"), ["test-club", "chess", "None", "test-club"]
+        )
+
+    def test_search_document(self):
+        """
+        Test searching clubs and events using the precomputed search documents.
+        """
+        Club.objects.create(
+            code="chess", name="Penn Chess Club", subtitle="Checkmate!", approved=True
+        )
+
+        def search(url, query, key="code", **kwargs):
+            resp = self.client.get(url, {"search": query, **kwargs})
+            self.assertIn(resp.status_code, [200], resp.content)
+            return [item[key] for item in resp.json()]
+
+        # search is case insensitive and matches substrings of any search field
+        self.assertEqual(search(reverse("clubs-list"), "CHECKMATE"), ["chess"])
+        self.assertEqual(search(reverse("clubs-list"), "hess club"), ["chess"])
+        self.assertEqual(search(reverse("clubs-list"), "chess checkers"), [])
+        self.assertEqual(
+            set(search(reverse("clubs-list"), "club", ordering="relevance")),
+            {"chess", self.club1.code},
+        )
+
+        # event documents include information about the club
+        self.assertEqual(search(reverse("events-list"), "test club", key="id"), [self.event1.id])
+        self.assertEqual(search(reverse("events-list"), "organization", key="id"), [])
+        self.club1.name = "Renamed Organization"
+        self.club1.save()
+        self.assertEqual(search(reverse("events-list"), "organization", key="id"), [self.event1.id])
+
     def test_club_list_filter(self):
         """
         Test complex club filtering.
@@ -1299,6 +1505,50 @@ class ClubTestCase(TestCase):
         resp = self.client.get(reverse("clubs-children", args=(self.club1.code,)))
         self.assertIn(resp.status_code, [200], resp.content)
 
+    def test_club_children_parents_tree(self):
+        """
+        Test the structure of the children and parents trees and ensure that the number of
+        queries does not depend on the size of the tree.
+        """
+        self.client.login(username=self.user3.username, password="test")
+
+        def fetch(action, code):
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get(reverse(f"clubs-{action}", args=(code,)))
+            self.assertIn(resp.status_code, [200], resp.content)
+            return resp.json(), len(queries)
+
+        child1 = Club.objects.create(code="child-1", name="Child One", approved=True)
+        child1.parent_orgs.add(self.club1)
+        _, small_count = fetch("children", self.club1.code)
+
+        child2 = Club.objects.create(code="child-2", name="Child Two")
+        child2.parent_orgs.add(self.club1, child1)
+        for i in range(10):
+            Club.objects.create(code=f"grandchild-{i}", name=f"Grandchild {i}").parent_orgs.add(
+                child2
+            )
+
+        # cycles are displayed as a leaf node
+        self.club1.parent_orgs.add(child2)
+
+        tree, large_count = fetch("children", self.club1.code)
+        self.assertEqual(small_count, large_count)
+        self.assertEqual([c["code"] for c in tree["children"]], ["child-1", "child-2"])
+        self.assertEqual(tree["children"][0]["children"][0]["code"], "child-2")
+        grandchildren = tree["children"][1]["children"]
+        self.assertEqual(len(grandchildren), 11)
+        self.assertIn({"name": self.club1.name, "code": self.club1.code}, grandchildren)
+
+        tree, _ = fetch("parents", child1.code)
+        self.assertEqual(tree["code"], child1.code)
+        self.assertEqual(tree["children"][0]["code"], self.club1.code)
+        self.assertEqual(tree["children"][0]["children"][0]["code"], "child-2")
+        self.assertEqual(
+            tree["children"][0]["children"][0]["children"][0],
+            {"name": child1.name, "code": child1.code},
+        )
+
     def test_club_modify(self):
         """
         Owners and officers should be able to modify the club.
@@ -1417,6 +1667,13 @@ class ClubTestCase(TestCase):
         self.assertEqual(
             list(invites.values_list("role", flat=True)), [Membership.ROLE_OFFICER] * 3, data,
         )
+        # the invite emails are queued in the outbox and sent by the outbox worker
+        self.assertEqual(len(mail.outbox), 0, mail.outbox)
+        resp = self.client.get(reverse("club-invites-list", args=(self.club1.code,)))
+        self.assertEqual([i["email_status"] for i in resp.data], [OutboxEmail.PENDING] * 3)
+        call_command("send_outbox", stdout=io.StringIO())
+        resp = self.client.get(reverse("club-invites-list", args=(self.club1.code,)))
+        self.assertEqual([i["email_status"] for i in resp.data], [OutboxEmail.SENT] * 3)
         self.assertEqual(len(mail.outbox), 3, mail.outbox)
 
         # ensure we can get all memberships
@@ -1505,6 +1762,7 @@ class ClubTestCase(TestCase):
         )
         self.assertIn(resp.status_code, [200, 201], resp.content)
 
+        call_command("send_outbox", stdout=io.StringIO())
         self.assertTrue(len(mail.outbox), 2)
 
     def test_club_invite_email_resend(self):
@@ -1637,6 +1895,101 @@ class ClubTestCase(TestCase):
         self.assertTrue(isinstance(res.data[0], dict))
         self.assertTrue(len(res.data[0]) > 2)
 
+    def test_club_report_query_count(self):
+        """
+        Generating a report with all columns uses the same number of queries
+        regardless of the number of clubs.
+        """
+        self.client.login(username=self.user5.username, password="test")
+
+        now = timezone.now()
+        badge = Badge.objects.create(label="Report Badge")
+        fair = ClubFair.objects.create(
+            name="Report Fair",
+            start_time=now,
+            end_time=now + datetime.timedelta(days=1),
+            registration_end_time=now,
+        )
+
+        def add_clubs(start, end):
+            for i in range(start, end):
+                club = Club.objects.create(
+                    code=f"report-club-{i}", name=f"Report Club {i}", approved=True
+                )
+                club.badges.add(badge)
+                Testimonial.objects.create(club=club, text="Great club!")
+                Event.objects.create(
+                    code=f"report-event-{i}",
+                    club=club,
+                    name="Report Event",
+                    start_time=now,
+                    end_time=now + datetime.timedelta(hours=1),
+                )
+                Membership.objects.create(person=self.user1, club=club)
+                ClubFairRegistration.objects.create(club=club, fair=fair, registrant=self.user1)
+
+        def get_report():
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get(reverse("clubs-list"), {"format": "xlsx"})
+            self.assertEqual(resp.status_code, 200)
+            return resp.data, len(queries.captured_queries)
+
+        add_clubs(0, 2)
+        data, few_queries = get_report()
+        self.assertEqual(len(data), 3)
+
+        add_clubs(2, 8)
+        data, many_queries = get_report()
+        self.assertEqual(len(data), 9)
+        self.assertEqual(few_queries, many_queries)
+
+        row = next(row for row in data if row["Code"] == "report-club-0")
+        self.assertEqual(len(row["Events"]), 1)
+        self.assertEqual(row["Fairs"], [fair.id])
+        self.assertEqual(row["Testimonials"], "Great club!")
+        self.assertIn(self.user1.get_full_name(), row["Members"])
+
+    def test_club_report_streaming(self):
+        """
+        Streaming exports contain the same rows as the regular export, fetched in chunks.
+        """
+        for i in range(5):
+            Club.objects.create(code=f"stream-club-{i}", name=f"Stream Club {i}", approved=True)
+
+        params = {"format": "xlsx", "fields": "name,code,active"}
+        expected = self.client.get(reverse("clubs-list"), params).data
+        self.assertEqual(len(expected), 6)
+
+        with patch.object(ClubViewSet, "stream_chunk_size", 2), CaptureQueriesContext(
+            connection
+        ) as queries:
+            resp = self.client.get(reverse("clubs-list"), {**params, "stream": "true"})
+            content = b"".join(resp.streaming_content)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(".xlsx", resp["Content-Disposition"])
+
+        workbook = load_workbook(io.BytesIO(content), read_only=True)
+        rows = [list(row) for row in workbook.active.iter_rows(values_only=True)]
+        self.assertEqual(rows[0], list(expected[0].keys()))
+        self.assertEqual(rows[1:], [list(row.values()) for row in expected])
+        self.assertEqual({row[2] for row in rows[1:]}, {"False"})
+
+        # the clubs are fetched in chunks of two
+        chunk_queries = [
+            q
+            for q in queries.captured_queries
+            if 'FROM "clubs_club"' in q["sql"] and '"clubs_club"."id" IN (' in q["sql"]
+        ]
+        self.assertEqual(len(chunk_queries), 3)
+
+        resp = self.client.get(reverse("clubs-list"), {**params, "stream": "csv"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(".csv", resp["Content-Disposition"])
+        content = b"".join(resp.streaming_content).decode("utf-8")
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], list(expected[0].keys()))
+        self.assertEqual(rows[1:], [[str(v) for v in row.values()] for row in expected])
+
     def test_club_members_report(self):
         # login for extended member information
         self.client.login(username=self.user5.username, password="test")
@@ -1651,6 +2004,21 @@ class ClubTestCase(TestCase):
         self.assertEqual(200, resp.status_code)
         self.assertEqual(1, len(resp.data))
 
+        # generate the streaming report
+        resp = self.client.get(
+            reverse("club-members-list", args=("test-club",)), {"format": "xlsx", "stream": "csv"}
+        )
+        self.assertEqual(200, resp.status_code)
+        rows = list(csv.reader(io.StringIO(b"".join(resp.streaming_content).decode("utf-8"))))
+        self.assertEqual(2, len(rows))
+        self.assertIn(self.user5.username, rows[1])
+
+        # generate a streaming report of all club fields
+        resp = self.client.get(reverse("clubs-list"), {"format": "xlsx", "stream": "true"})
+        self.assertEqual(200, resp.status_code)
+        workbook = load_workbook(io.BytesIO(b"".join(resp.streaming_content)), read_only=True)
+        self.assertEqual(2, len(list(workbook.active.iter_rows())))
+
     def test_club_subscriptions_report(self):
         resp = self.client.get(
             reverse("clubs-subscription", args=("test-club",)), {"format": "xlsx"}
@@ -1691,8 +2059,19 @@ class ClubTestCase(TestCase):
         self.assertEqual(len(resp.data), old_count + 1, resp.data)
 
         # ensure email was sent out notifying officer of question
+        call_command("send_outbox", stdout=io.StringIO())
         self.assertEqual(len(mail.outbox), 1, mail.outbox)
 
+        # the question is not saved if the email cannot be queued
+        with patch(
+            "clubs.models.QuestionAnswer.send_question_mail", side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            self.client.post(
+                reverse("club-questions-list", args=("test-club",)),
+                {"question": "Is this club still cool?", "is_anonymous": False},
+            )
+        self.assertFalse(QuestionAnswer.objects.filter(question="Is this club still cool?"))
+
     def test_club_sensitive_field_renew(self):
         """
         When editing sensitive fields like the name, description, and club image, require
@@ -1839,6 +2218,7 @@ class ClubTestCase(TestCase):
         self.assertIn(resp.status_code, [200, 201], resp.content)
 
         # ensure a confirmation email was sent
+        call_command("send_outbox", stdout=io.StringIO())
         self.assertEqual(len(mail.outbox), mail_count + 1, mail.outbox)
 
         # reinit the count
@@ -1868,6 +2248,7 @@ class ClubTestCase(TestCase):
         self.assertIn(resp.status_code, [200, 201], resp.content)
 
         # ensure email is sent out to let club know
+        call_command("send_outbox", stdout=io.StringIO())
         self.assertEqual(len(mail.outbox), mail_count + 1, mail.outbox)
 
         # update mail count
@@ -1886,6 +2267,7 @@ class ClubTestCase(TestCase):
         self.assertIn(resp.status_code, [200, 201], resp.content)
 
         # ensure email is sent out to let club know
+        call_command("send_outbox", stdout=io.StringIO())
         self.assertEqual(len(mail.outbox), mail_count + 1, mail.outbox)
 
         # approve the club without comment
@@ -2041,6 +2423,158 @@ class ClubTestCase(TestCase):
         # ensure registration was processed
         self.assertTrue(ClubFairRegistration.objects.filter(club=self.club1, fair=fair).exists())
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_fair_directory_cache(self):
+        """
+        Test that the fair directory is cached until one of the objects it depends on changes,
+        and that only one request rebuilds it at a time.
+        """
+        cache.clear()
+        now = timezone.now()
+        fair = ClubFair.objects.create(
+            name="SAC Fair",
+            organization="Student Activities Council",
+            start_time=now + datetime.timedelta(days=1),
+            end_time=now + datetime.timedelta(days=2),
+            registration_start_time=now - datetime.timedelta(days=1),
+            registration_end_time=now + datetime.timedelta(days=1),
+        )
+        badge = Badge.objects.create(label="SAC", purpose="fair", fair=fair)
+        self.club1.badges.add(badge)
+        event = Event.objects.create(
+            code="fair-event",
+            name="Fair Event",
+            club=self.club1,
+            type=Event.FAIR,
+            start_time=fair.start_time,
+            end_time=fair.start_time + datetime.timedelta(hours=1),
+        )
+
+        def fetch():
+            resp = self.client.get(reverse("events-fair"), {"fair": fair.id})
+            self.assertEqual(resp.status_code, 200, resp.content)
+            return [
+                (category["category"], [e["code"] for e in category["events"]])
+                for group in resp.data["events"]
+                for category in group["events"]
+            ]
+
+        # invalidate immediately instead of when the test transaction commits
+        with patch("clubs.models.transaction.on_commit", side_effect=lambda func: func()):
+            self.assertEqual(fetch(), [("SAC", [self.club1.code])])
+
+            # cached directory is served without rebuilding it
+            with patch("clubs.views.fair_directory_helper") as helper:
+                self.assertEqual(fetch(), [("SAC", [self.club1.code])])
+                helper.assert_not_called()
+
+            # changes to the badge rebuild the directory
+            badge.label = "Renamed SAC"
+            badge.save()
+            self.assertEqual(fetch(), [("Renamed SAC", [self.club1.code])])
+
+            # while another request holds the lock, the outdated directory is served
+            event.delete()
+            cache.add(f"events:fair:directory:{fair.id}:lock", True)
+            with patch("clubs.views.fair_directory_helper") as helper:
+                self.assertEqual(fetch(), [("Renamed SAC", [self.club1.code])])
+                helper.assert_not_called()
+
+            cache.delete(f"events:fair:directory:{fair.id}:lock")
+            self.assertEqual(fetch(), [])
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_fair_directory_cache_invalidation(self):
+        """
+        Test that the cached fair directory is rebuilt when events stop being fair events, when
+        badges move between fairs and when events are imported from a calendar.
+        """
+        cache.clear()
+        now = timezone.now()
+        fairs = [
+            ClubFair.objects.create(
+                name=f"Fair #{i}",
+                organization="Student Activities Council",
+                start_time=now + datetime.timedelta(days=1),
+                end_time=now + datetime.timedelta(days=2),
+                registration_start_time=now - datetime.timedelta(days=1),
+                registration_end_time=now + datetime.timedelta(days=1),
+            )
+            for i in range(2)
+        ]
+        badge = Badge.objects.create(label="SAC", purpose="fair", fair=fairs[0])
+        self.club1.badges.add(badge)
+        self.club1.ics_import_url = "https://example.com/calendar.ics"
+        self.club1.save()
+        event = Event.objects.create(
+            code="fair-event",
+            name="Fair Event",
+            club=self.club1,
+            type=Event.FAIR,
+            start_time=fairs[0].start_time,
+            end_time=fairs[0].start_time + datetime.timedelta(hours=1),
+        )
+
+        def fetch(fair):
+            resp = self.client.get(reverse("events-fair"), {"fair": fair.id})
+            self.assertEqual(resp.status_code, 200, resp.content)
+            return [
+                (group["start_time"], [e["code"] for e in category["events"]])
+                for group in resp.data["events"]
+                for category in group["events"]
+            ]
+
+        with patch("clubs.models.transaction.on_commit", side_effect=lambda func: func()):
+            self.assertEqual(fetch(fairs[0]), [(event.start_time, [self.club1.code])])
+            self.assertEqual(fetch(fairs[1]), [])
+
+            # calendar imports that change fair events rebuild the directory
+            cal = Calendar()
+            ics_event = ICSEvent()
+            ics_event.name = event.name
+            ics_event.description = "A fair event"
+            ics_event.begin = event.start_time + datetime.timedelta(hours=2)
+            ics_event.end = event.end_time + datetime.timedelta(hours=2)
+            ics_event.uid = str(event.ics_uuid)
+            cal.events.add(ics_event)
+            self.club1.add_ics_events(str(cal))
+            event.refresh_from_db()
+            self.assertEqual(event.type, Event.FAIR)
+            self.assertEqual(fetch(fairs[0]), [(event.start_time, [self.club1.code])])
+
+            # events that stop being fair events are removed
+            event.type = Event.OTHER
+            event.save()
+            self.assertEqual(fetch(fairs[0]), [])
+
+            # deleting an outdated instance of a fair event removes it
+            Event.objects.filter(pk=event.pk).update(type=Event.FAIR)
+            self.assertEqual(fetch(fairs[0]), [])
+            cache.clear()
+            self.assertEqual(fetch(fairs[0]), [(event.start_time, [self.club1.code])])
+            event.delete()
+            self.assertEqual(fetch(fairs[0]), [])
+
+            # badges moving between fairs rebuild the directories of both fairs
+            Event.objects.create(
+                code="fair-event",
+                name="Fair Event",
+                club=self.club1,
+                type=Event.FAIR,
+                start_time=fairs[0].start_time,
+                end_time=fairs[0].start_time + datetime.timedelta(hours=1),
+            )
+            self.assertEqual(fetch(fairs[0]), [(fairs[0].start_time, [self.club1.code])])
+            self.assertEqual(fetch(fairs[1]), [])
+            badge.fair = fairs[1]
+            badge.save()
+            self.assertEqual(fetch(fairs[0]), [])
+            self.assertEqual(fetch(fairs[1]), [(fairs[0].start_time, [self.club1.code])])
+
     def test_bulk_edit(self):
         """
         Test the club bulk editing endpoint.
@@ -2394,3 +2928,135 @@ class ClubTestCase(TestCase):
                 leave_time=leave_time,
             )
         )
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+        CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    )
+    def test_zoom_webhook_live_stats(self):
+        """
+        Test that the Zoom webhook updates the live statistics for an event incrementally
+        and pushes them to the clients listening to the event.
+        """
+        cache.clear()
+        Membership.objects.create(person=self.user4, club=self.club1, role=Membership.ROLE_OFFICER)
+
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f"events-live-{self.event1.id}", channel)
+
+        def send(action, person, participant_id, time):
+            field = "join_time" if action == "meeting.participant_joined" else "leave_time"
+            req = {
+                "event": action,
+                "payload": {
+                    "object": {
+                        "participant": {
+                            "user_id": participant_id,
+                            field: time,
+                            "email": person.email,
+                        },
+                        "id": "4880003126",
+                    }
+                },
+            }
+            resp = self.client.post(
+                reverse("webhooks-meeting"), req, content_type="application/json"
+            )
+            self.assertIn(resp.status_code, [200, 201], resp.content)
+            return async_to_sync(layer.receive)(channel)["stats"]
+
+        joined = "meeting.participant_joined"
+        left = "meeting.participant_left"
+        stats = send(joined, self.user1, "user1", "2021-01-10T20:00:00Z")
+        self.assertEqual(stats, {"attending": 1, "attended": 0, "officers": 0, "time": 0})
+        stats = send(joined, self.user4, "user4", "2021-01-10T20:01:00Z")
+        self.assertEqual(stats, {"attending": 2, "attended": 0, "officers": 1, "time": 0})
+        stats = send(left, self.user1, "user1", "2021-01-10T20:04:00Z")
+        self.assertEqual(stats, {"attending": 1, "attended": 1, "officers": 1, "time": 240})
+
+        # rejoining and leaving again does not count the user twice
+        send(joined, self.user1, "user1", "2021-01-10T20:05:00Z")
+        stats = send(left, self.user1, "user1", "2021-01-10T20:06:00Z")
+        self.assertEqual(stats, {"attending": 1, "attended": 1, "officers": 1, "time": 240})
+        stats = send(left, self.user4, "user4", "2021-01-10T20:11:00Z")
+        self.assertEqual(stats, {"attending": 0, "attended": 2, "officers": 0, "time": 240})
+
+        # the statistics are served from the cache and match the database
+        with self.assertNumQueries(0):
+            resp = self.client.get(reverse("webhooks-meeting"), {"event": self.event1.id})
+        self.assertEqual(resp.data, stats)
+        cache.clear()
+        resp = self.client.get(reverse("webhooks-meeting"), {"event": self.event1.id})
+        self.assertEqual(resp.data, stats)
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_zoom_participant_user_cache(self):
+        """
+        Test that cached Zoom participant matches are removed when users are renamed or deleted.
+        """
+        cache.clear()
+        user = get_user_model().objects.create_user("zoomuser", "zoomuser@example.com", "test")
+        self.assertEqual(get_zoom_participant_user_id("zoomuser@upenn.edu"), user.id)
+        self.assertIsNone(get_zoom_participant_user_id("renamed@upenn.edu"))
+
+        # renamed users are matched by their new username only
+        user.username = "renamed"
+        user.save()
+        self.assertIsNone(get_zoom_participant_user_id("zoomuser@upenn.edu"))
+        self.assertEqual(get_zoom_participant_user_id("renamed@upenn.edu"), user.id)
+
+        # other changes to the user keep the cached match
+        user.last_login = timezone.now()
+        user.save(update_fields=["last_login"])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_zoom_participant_user_id("renamed@upenn.edu"), user.id)
+
+        # deleted users are no longer matched
+        user.delete()
+        self.assertIsNone(get_zoom_participant_user_id("renamed@upenn.edu"))
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_zoom_webhook_live_stats_attendees(self):
+        """
+        Test that Zoom participants that do not match a user are counted separately, and that
+        only officers and owners of the club are counted as officers.
+        """
+        cache.clear()
+        Membership.objects.create(person=self.user2, club=self.club1, role=Membership.ROLE_MEMBER)
+        Membership.objects.create(person=self.user4, club=self.club1, role=Membership.ROLE_OFFICER)
+
+        def send(action, email, participant_id, time):
+            field = "join_time" if action == "meeting.participant_joined" else "leave_time"
+            req = {
+                "event": action,
+                "payload": {
+                    "object": {
+                        "participant": {"user_id": participant_id, field: time, "email": email},
+                        "id": "4880003126",
+                    }
+                },
+            }
+            resp = self.client.post(
+                reverse("webhooks-meeting"), req, content_type="application/json"
+            )
+            self.assertIn(resp.status_code, [200, 201], resp.content)
+
+        joined = "meeting.participant_joined"
+        left = "meeting.participant_left"
+        for participant_id in ["guest1", "guest2"]:
+            send(joined, "guest@example.com", participant_id, "2021-01-10T20:00:00Z")
+            send(left, "guest@example.com", participant_id, "2021-01-10T20:01:00Z")
+        send(joined, self.user2.email, "user2", "2021-01-10T20:00:00Z")
+        send(joined, self.user4.email, "user4", "2021-01-10T20:00:00Z")
+
+        expected = {"attending": 2, "attended": 2, "officers": 1, "time": 60}
+        resp = self.client.get(reverse("webhooks-meeting"), {"event": self.event1.id})
+        self.assertEqual(resp.data, expected)
+        cache.clear()
+        resp = self.client.get(reverse("webhooks-meeting"), {"event": self.event1.id})
+        self.assertEqual(resp.data, expected)
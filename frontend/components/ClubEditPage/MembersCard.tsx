@@ -91,7 +91,9 @@ export default function MembersCard({ club }: MembersCardProps): ReactElement {
       />
       <div style={{ marginTop: '1em' }}>
         <a
-          href={getApiUrl(`/clubs/${club.code}/members/?format=xlsx`)}
+          href={getApiUrl(
+            `/clubs/${club.code}/members/?format=xlsx&stream=true`,
+          )}
           className="button is-link is-small"
         >
           <Icon alt="download" name="download" /> Download{' '}
@@ -103,21 +103,23 @@ const formatDuration = (time: number): string => {
 
 /**
  * Given an event ID, listen using a websocket connection for updates to this event.
+ * Updates include the new statistics for the event if they are available.
  */
 const LiveEventUpdater = ({
   id,
   onUpdate,
 }: {
   id: number
-  onUpdate: () => void
+  onUpdate: (stats?: LiveStatsData) => void
 }): null => {
   useEffect(() => {
     const wsUrl = `${location.protocol === 'http:' ? 'ws' : 'wss'}://${
       location.host
     }/api/ws/event/${id}/`
     const ws = new WebSocket(wsUrl)
-    ws.onmessage = () => {
-      onUpdate()
+    ws.onmessage = (message) => {
+      const data = JSON.parse(message.data)
+      onUpdate('attending' in data ? data : undefined)
     }
     return () => ws.close()
   }, [id])
@@ -234,7 +236,11 @@ const EventModal = (props: {
   const isHappening = now >= startDate && now <= endDate
   const isZoomMeeting = url && MEETING_REGEX.test(url)
 
-  const refreshLiveData = () => {
+  const refreshLiveData = (stats?: LiveStatsData) => {
+    if (stats != null) {
+      setUserCount(stats)
+      return
+    }
     if (isZoomMeeting) {
       doApiRequest(`/webhook/meeting/?format=json&event=${event.id}`)
         .then((resp) => resp.json())
@@ -244,7 +250,7 @@ const EventModal = (props: {
     }
   }
 
-  useEffect(refreshLiveData, [])
+  useEffect(() => refreshLiveData(), [])
 
   return (
     <ModalContainer>
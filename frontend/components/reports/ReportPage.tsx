@@ -15,7 +15,7 @@ const serializeParams = (params: { [key: string]: string }): string => {
 
 export const downloadReport = (report: Report): void => {
   window.open(
-    `${API_BASE_URL}/clubs/?bypass=true&${serializeParams(
+    `${API_BASE_URL}/clubs/?bypass=true&stream=true&${serializeParams(
       JSON.parse(report.parameters),
     )}`,
     '_blank',